@@ -1,8 +1,99 @@
 import sys
 import os
 import numpy as np
-import matplotlib.pyplot as plt
 import numpy as np
+
+from record_pack import is_packed, iter_blocks
+
+# This is a numpy datatype that corresponds to output files
+electron_dtype = np.dtype([
+	('x',  '=f'), ('y',  '=f'), ('z',  '=f'), # Position
+	('dx', '=f'), ('dy', '=f'), ('dz', '=f'), # Direction
+	('E',  '=f'),                             # Energy
+	('px', '=i'), ('py', '=i')])              # Pixel index
+
+# Number of records processed per chunk (~600 MB of .det data)
+CHUNK_RECORDS = 1 << 24
+
+
+class DetHistogram:
+	"""
+	Running pixel histogram of detected electrons.
+
+	Counts are kept in an int64 image that grows to cover the pixel range seen
+	so far, so memory is O(image) no matter how many records are added.
+	"""
+	def __init__(self):
+		self.counts = np.zeros((0, 0), dtype=np.int64)
+		self.xmin = 0
+		self.ymin = 0
+		self.total = 0
+
+	def _grow(self, xmin, xmax, ymin, ymax):
+		if self.counts.size == 0:
+			self.counts = np.zeros((xmax-xmin+1, ymax-ymin+1), dtype=np.int64)
+			self.xmin, self.ymin = xmin, ymin
+			return
+		old_xmax = self.xmin + self.counts.shape[0] - 1
+		old_ymax = self.ymin + self.counts.shape[1] - 1
+		new_xmin, new_ymin = min(xmin, self.xmin), min(ymin, self.ymin)
+		new_xmax, new_ymax = max(xmax, old_xmax), max(ymax, old_ymax)
+		if (new_xmin, new_ymin, new_xmax, new_ymax) == (self.xmin, self.ymin, old_xmax, old_ymax):
+			return
+		counts = np.zeros((new_xmax-new_xmin+1, new_ymax-new_ymin+1), dtype=np.int64)
+		i0, j0 = self.xmin-new_xmin, self.ymin-new_ymin
+		counts[i0:i0+self.counts.shape[0], j0:j0+self.counts.shape[1]] = self.counts
+		self.counts, self.xmin, self.ymin = counts, new_xmin, new_ymin
+
+	def update(self, px, py):
+		"""Add a batch of pixel indices to the histogram."""
+		if len(px) == 0:
+			return
+		px = np.asarray(px, dtype=np.int64)
+		py = np.asarray(py, dtype=np.int64)
+		self._grow(int(px.min()), int(px.max()), int(py.min()), int(py.max()))
+		nx, ny = self.counts.shape
+		index = (px-self.xmin)*ny + (py-self.ymin)
+		self.counts += np.bincount(index, minlength=nx*ny).reshape(nx, ny)
+		self.total += len(px)
+
+	def update_records(self, records):
+		"""Add a batch of electron_dtype records to the histogram."""
+		self.update(records['px'], records['py'])
+
+
+def det_records(sem_simu_result):
+	"""Memory-map a .det file as an array of electron_dtype records."""
+	count = os.path.getsize(sem_simu_result) // electron_dtype.itemsize
+	if count == 0:
+		return np.empty(0, dtype=electron_dtype)
+	return np.memmap(sem_simu_result, dtype=electron_dtype, mode='r', shape=(count,))
+
+
+def det_chunks(sem_simu_result, chunk_records=CHUNK_RECORDS):
+	"""Iterate over the records of a raw or packed .det file in chunks."""
+	if is_packed(sem_simu_result):
+		yield from iter_blocks(sem_simu_result)
+		return
+	data = det_records(sem_simu_result)
+	for start in range(0, len(data), chunk_records):
+		yield data[start:start+chunk_records]
+
+
+def sem_image(sem_simu_result, chunk_records=CHUNK_RECORDS):
+	"""
+	Accumulate the pixel histogram of a .det file chunk by chunk.
+
+	Files written by record_pack are read block by block; raw files are
+	memory-mapped. Returns the DetHistogram; its counts[i, j] is the number
+	of electrons detected in pixel (xmin+i, ymin+j).
+	"""
+	hist = DetHistogram()
+	for chunk in det_chunks(sem_simu_result, chunk_records):
+		hist.update_records(chunk)
+	return hist
+
+
 def sem_analysis(sem_simu_result,image_path, plot = False, save = False):
 	# Find out which file to open
 	# if len(sys.argv) < 2:
@@ -13,30 +104,16 @@ def sem_analysis(sem_simu_result,image_path, plot = False, save = False):
 		print("File {} cannot be found".format(sem_simu_result))
 		sys.exit()
 
+	# Stream the output file in chunks and histogram the pixel indices
+	hist = sem_image(sem_simu_result)
+	print("Number of electrons detected: {}".format(hist.total))
+	if hist.total == 0:
+		raise ValueError("No electrons detected in {}, no image to make".format(sem_simu_result))
+	H = hist.counts
 
-	# This is a numpy datatype that corresponds to output files
-	electron_dtype = np.dtype([
-		('x',  '=f'), ('y',  '=f'), ('z',  '=f'), # Position
-		('dx', '=f'), ('dy', '=f'), ('dz', '=f'), # Direction
-		('E',  '=f'),                             # Energy
-		('px', '=i'), ('py', '=i')])              # Pixel index
-
-	# Open the output file
-	data = np.fromfile(sem_simu_result, dtype=electron_dtype)
-	print("Number of electrons detected: {}".format(len(data)))
-
-
-	# Make a histogram of pixel indices
-	xmin = data['px'].min()
-	xmax = data['px'].max()
-	ymin = data['py'].min()
-	ymax = data['py'].max()
-	H, xedges, yedges = np.histogram2d(data['px'], data['py'],
-		bins = [
-			np.linspace(xmin-.5, xmax+.5, xmax-xmin+2),
-			np.linspace(ymin-.5, ymax+.5, ymax-ymin+2)
-		])
-
+	if save or plot:
+		# matplotlib.pyplot 导入较慢，只在保存或显示图像时导入
+		import matplotlib.pyplot as plt
 	if save:
 		plt.imsave(image_path, H.T, cmap='gray', dpi=300,origin='lower')
 	if plot:
@@ -49,4 +126,4 @@ def sem_analysis(sem_simu_result,image_path, plot = False, save = False):
 if __name__ == '__main__':
 	sem_simu_result='/home/chenguisen/AISI/nebula/data/output.det'
 	image_path='/home/chenguisen/AISI/nebula/data/output.png'
-	sem_analysis(sem_simu_result, image_path, plot=True, save=True)
\ No newline at end of file
+	sem_analysis(sem_simu_result, image_path, plot=True, save=True)
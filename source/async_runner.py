@@ -0,0 +1,329 @@
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import pathlib
+import queue
+import re
+import threading
+import time
+
+from gpu_pool import DevicePool, device_env
+from nebula_launcher import (COMPLETION_GRACE, FINISH_TIMEOUT, CompletionWatcher, check_det_records,
+                             kill, progress_parser, terminate)
+
+"""
+基于 asyncio 的模拟运行器
+
+用 asyncio.create_subprocess_exec 启动 nebula_gpu，一个事件循环即可同时等待几十个模拟进程，
+不需要为每个进程创建线程，也不需要 select 轮询。每个任务可以设置超时，也可以随时取消
+(取消时终止整个进程组)。进度事件与 nebula_launcher.launch 相同 (progress_events.ProgressEvent)。
+
+批量脚本:
+    runner = AsyncSimulationRunner(max_concurrent=4)
+    results = asyncio.run(runner.run_all([dict(argv=argv, det_path=det_path, timeout=3600), ...]))
+
+同步代码或 Qt GUI 中使用 AsyncLoopThread 在后台线程运行事件循环:
+    loop_thread = AsyncLoopThread().start()
+    future = loop_thread.submit(runner.run(argv, det_path))   # concurrent.futures.Future
+    loop_thread.shutdown(runner.shutdown())                   # 退出前终止所有模拟进程再停止事件循环
+"""
+
+# 每次从 stderr 读取的字节数
+STDERR_CHUNK = 64 * 1024
+
+# nebula_gpu 用 '\r' 刷新同一行进度，'\r' 和 '\n' 都作为行结束
+LINE_END = re.compile(r'\r\n|\r|\n')
+
+# 等待空闲 GPU 时的检查间隔 (秒)
+DEVICE_POLL_INTERVAL = 0.1
+
+
+async def _read_lines(reader):
+    """逐行读取 asyncio.StreamReader，'\\r' 结尾的进度行立即返回，不等待下一个字符。"""
+    pending = ''
+    while True:
+        chunk = await reader.read(STDERR_CHUNK)
+        if not chunk:
+            if pending.strip():
+                yield pending.strip()
+            return
+        *lines, pending = LINE_END.split(pending + chunk.decode(errors='replace'))
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+
+
+async def _watch_completion(watcher):
+    """异步版本的 CompletionWatcher 轮询，返回结束原因。"""
+    while watcher.process.returncode is None:
+        if watcher.step():
+            return
+        await asyncio.sleep(watcher.poll_interval)
+
+
+async def run_simulation(argv, det_path, cwd=None, env=None, timeout=None, on_line=print, log=print,
+                         on_event=None, completion_grace=COMPLETION_GRACE,
+                         finish_timeout=FINISH_TIMEOUT, on_process=None):
+    """
+    异步运行一个 nebula_gpu，stdout 写入 det_path。参数与 nebula_launcher.launch 相同，另有:
+
+    参数:
+        timeout: 整个运行的最长秒数，超时则终止进程，status 为 'timeout'；None 为不限制
+        on_process: 进程启动后的回调，参数为 asyncio 的 Process (用于关闭时终止进程组)
+
+    返回:
+        dict: 与 launch 相同；status 另有 'timeout'。
+              任务被取消时终止进程并重新抛出 asyncio.CancelledError。
+    """
+    t_start = time.time()
+    det_path = pathlib.Path(det_path)
+    parser = progress_parser(argv, t_start, on_event)
+    status = 'completed'
+    watcher = watch_task = None
+    with open(det_path, 'wb') as det_file:
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdout=det_file,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=(os.name == 'posix'),
+        )
+        if on_process is not None:
+            on_process(process)
+
+        async def consume():
+            nonlocal status, watcher, watch_task
+            async for line in _read_lines(process.stderr):
+                if on_line is not None:
+                    on_line(line)
+                event = parser.feed(line)
+                if event is not None and event.no_detection:
+                    log("检测到detected: 0，需要对输入进行优化")
+                    terminate(process)
+                    log("nebula_gpu 运行结束，未检测到有效数据，请优化输入")
+                    status = 'no_detection'
+                    break
+                if event is not None and event.complete and watch_task is None:
+                    log("检测到进度100.00%，等待剩余电子模拟完成和输出写完")
+                    watcher = CompletionWatcher(process, det_path, parser, grace=completion_grace,
+                                                finish_timeout=finish_timeout, log=log)
+                    watch_task = asyncio.ensure_future(_watch_completion(watcher))
+            await process.wait()
+
+        try:
+            await asyncio.wait_for(consume(), timeout)
+        except asyncio.TimeoutError:
+            log(f"nebula_gpu 运行超过{timeout:g}秒，终止进程")
+            terminate(process)
+            status = 'timeout'
+        except BaseException:
+            # 被取消或中断时不留下失控的模拟进程
+            kill(process)
+            await process.wait()
+            raise
+        finally:
+            if watch_task is not None and not watch_task.done():
+                watch_task.cancel()
+        return_code = await process.wait()
+    if watcher is not None and watcher.status is not None and status == 'completed':
+        status = watcher.status
+    status = check_det_records(det_path, status, log)
+    last = parser.last
+    return {
+        'argv': argv,
+        'det_path': det_path,
+        'return_code': return_code,
+        'wall_time': time.time() - t_start,
+        'detected': last.detected if last else None,
+        'detected_rate': last.detected_rate if last else None,
+        'primary_rate': last.primary_rate if last else None,
+        'status': status,
+    }
+
+
+class AsyncSimulationRunner:
+    def __init__(self, max_concurrent=None, device_pool=None):
+        """
+        参数:
+            max_concurrent: 同时运行的 nebula_gpu 数量上限，None 为不限制 (指定设备池时受设备数限制)
+            device_pool: gpu_pool.DevicePool，每个任务运行时占用一块空闲 GPU；None 时不指定设备
+        """
+        self.max_concurrent = max_concurrent
+        self.device_pool = device_pool
+        self.devices = None
+        self.tasks = {}
+        self.processes = set()
+        self._semaphore = None
+        self._devices_lock = None
+        self._ids = itertools.count()
+
+    async def use_devices(self, devices):
+        """
+        设置之后提交的任务使用的 GPU，返回设备池。
+
+        devices 为设备编号列表或 'auto' (自动检测)；为 None 时不指定设备，子进程环境变量保持不变。
+        设置改变时才创建新的设备池，检测设备 (nvidia-smi) 在线程池中运行，不阻塞事件循环；
+        正在运行的任务仍把设备归还给原来的设备池。
+        """
+        if self._devices_lock is None:
+            self._devices_lock = asyncio.Lock()
+        async with self._devices_lock:
+            if devices is None:
+                self.device_pool = None
+            elif self.device_pool is None or devices != self.devices:
+                loop = asyncio.get_running_loop()
+                self.device_pool = await loop.run_in_executor(
+                    None, DevicePool, None if devices == 'auto' else devices)
+            self.devices = devices
+            return self.device_pool
+
+    async def _acquire_device(self, device_pool):
+        # DevicePool 也被线程使用，这里以非阻塞方式轮询，不占用事件循环
+        while True:
+            try:
+                return device_pool.acquire(block=False)
+            except queue.Empty:
+                await asyncio.sleep(DEVICE_POLL_INTERVAL)
+
+    async def run(self, argv, det_path, **kwargs):
+        """运行一个任务，参数见 run_simulation；返回的结果中另有 device。"""
+        process = None
+
+        def register(started):
+            nonlocal process
+            process = started
+            self.processes.add(started)
+
+        try:
+            return await self._run(argv, det_path, on_process=register, **kwargs)
+        finally:
+            # 进程仍未退出时留在 processes 中，由 shutdown 终止
+            if process is not None and process.returncode is not None:
+                self.processes.discard(process)
+
+    async def _run(self, argv, det_path, **kwargs):
+        if self.max_concurrent is not None and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            # 任务运行期间 use_devices 可能换成新的设备池，设备归还给取得它的设备池
+            device_pool = self.device_pool
+            if device_pool is None:
+                result = await run_simulation(argv, det_path, **kwargs)
+                result['device'] = None
+                return result
+            device = await self._acquire_device(device_pool)
+            t_start = time.time()
+            try:
+                env = device_env(device, kwargs.pop('env', None))
+                result = await run_simulation(argv, det_path, env=env, **kwargs)
+            finally:
+                device_pool.release(device, time.time() - t_start)
+            result['device'] = device
+            return result
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def submit(self, argv, det_path, job_id=None, **kwargs):
+        """
+        在当前事件循环中创建任务并返回 asyncio.Task，可通过 job_id 取消。
+        同一 job_id 的任务仍在运行时抛出 ValueError。
+        """
+        job_id = next(self._ids) if job_id is None else job_id
+        if job_id in self.tasks:
+            raise ValueError(f"任务 {job_id} 正在运行")
+        task = asyncio.ensure_future(self.run(argv, det_path, **kwargs))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+        return task
+
+    async def run_all(self, jobs):
+        """
+        同时运行多个任务，返回与 jobs 顺序一致的结果；失败或被取消的任务对应异常对象。
+
+        参数:
+            jobs: 字典列表，每个包含 argv、det_path 以及 run_simulation 的其他参数
+        """
+        tasks = [self.submit(**job) for job in jobs]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def cancel(self, job_id):
+        """取消一个任务，任务不存在或已结束时返回 False。"""
+        task = self.tasks.get(job_id)
+        return task.cancel() if task is not None else False
+
+    def cancel_all(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+    async def shutdown(self):
+        """
+        取消所有任务并等待它们结束，再终止仍未退出的 nebula_gpu 进程组。
+        nebula_gpu 在独立的进程组中运行，事件循环停止前必须等到这一步完成，否则会留下孤儿进程。
+        """
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for process in list(self.processes):
+            kill(process)
+            await process.wait()
+        self.processes.clear()
+
+
+class AsyncLoopThread:
+    """在后台线程中运行 asyncio 事件循环，供同步代码和 Qt GUI 提交协程。"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """提交协程，返回 concurrent.futures.Future (可调用 cancel() 取消)。"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, function, *args):
+        """在事件循环线程中调用普通函数 (例如 runner.cancel)。"""
+        self.loop.call_soon_threadsafe(function, *args)
+
+    async def _cancel_pending(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self, cleanup=None, timeout=None):
+        """
+        在事件循环中运行 cleanup 协程 (例如 AsyncSimulationRunner.shutdown()) 并等待其完成，
+        再取消并等待其余任务，最后停止事件循环。timeout 为每一步最长等待的秒数。
+        """
+        if self._thread is not None:
+            try:
+                if cleanup is not None:
+                    self.submit(cleanup).result(timeout)
+                self.submit(self._cancel_pending()).result(timeout)
+            except concurrent.futures.TimeoutError:
+                print("[WARNING] 等待后台任务结束超时，直接停止事件循环")
+        elif cleanup is not None:
+            cleanup.close()
+        self.stop()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,55 @@
+import contextlib
+import os
+import pathlib
+import uuid
+
+"""
+原子输出
+
+多个 nebula_gpu 或生成进程同时运行时，输出文件先写到同目录下的临时文件，
+完成后再用 os.replace 重命名为最终文件名。其他进程只会看到完整的旧文件或完整的新文件，
+不会读到写了一半的 .tri/.pri/.det/.png。
+"""
+
+
+def temporary_path(path):
+    """
+    返回 path 同目录下唯一的临时文件路径，保留原扩展名
+    (matplotlib 等按扩展名判断输出格式)。
+    """
+    path = pathlib.Path(path)
+    return path.with_name(f'.{path.stem}.{os.getpid()}.{uuid.uuid4().hex[:8]}.part{path.suffix}')
+
+
+def commit(tmp_path, path):
+    """把临时文件原子地重命名为最终文件。"""
+    os.replace(tmp_path, path)
+    # 两者是同一文件的硬链接时 (例如都链接到同一个缓存条目)，rename 什么也不做
+    discard(tmp_path)
+    return pathlib.Path(path)
+
+
+def discard(tmp_path):
+    """删除未完成的临时文件。"""
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    在 with 块中写临时文件，正常结束时重命名为 path，发生异常时删除临时文件。
+
+    用法:
+        with atomic_output(det_path) as tmp_path:
+            write(tmp_path)
+    """
+    tmp_path = temporary_path(path)
+    try:
+        yield tmp_path
+    except BaseException:
+        discard(tmp_path)
+        raise
+    commit(tmp_path, path)
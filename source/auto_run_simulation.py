@@ -1,14 +1,9 @@
-import sys
 import os
-import json
-import matplotlib.pyplot as plt
 import pathlib
-import torch
 
 # 导入现有模块的功能
-from parameters import tri_parameters, pri_parameters
-from run_nebula import nebula_gpu
-from save_parameters import add_frame_to_parameters, save_parameters
+from sweep import SweepScheduler, make_jobs, save_camera_parameters
+from sweep_manifest import SweepManifest
 import numpy as np
 
 # 这个脚本用于自动化运行nebula_gpu模拟,用于不同倾转角度参数的模拟
@@ -16,6 +11,7 @@ import numpy as np
 # 1. 设置参数
 # 2. 生成.tri文件和.pri文件
 # 3. 运行nebula_gpu模拟
+#    (各步骤由sweep.SweepScheduler流水线执行：任务N模拟时，任务N+1生成.tri/.pri，任务N-1分析结果)
 # 4. 分析模拟结果
 # 5. 保存模拟结果
 # 6. 分析模拟结果
@@ -46,174 +42,82 @@ import numpy as np
 mat_paths_list =[pathlib.Path('/home/chenguisen/AISI/nebula/data/silicon.mat')]
 
 nebula_gpu_path = "/home/chenguisen/AISI/nebula/nebula_python_wrapper/source/nebula_gpu"
-import platform
-#nebula_gpu_path = pathlib.Path("D:/AISI/ZZZ/nebula_python_wrapper/source/mynebula.exe" if platform.system() == "Windows" else "mynebula")
-
-pri_file_path = None
 
 
 stl_dir = "/home/chenguisen/AISI/nebula/simulation_results"
-output_path = pathlib.Path(stl_dir)/'output.det'
 
 #可以指定特定的stl文件，则初始化stl_list为指定的文件路径，则不需要遍历目录
 stl_list = []                                    # 存储所有.stl文件的路径;也可以指定特定的stl文件
 
-# 遍历stl_dir目录下的所有文件，如果文件名以.stl结尾，则将其路径添加到stl_list中
-for file in os.listdir(stl_dir):
-    if file.endswith('.stl'):
-        stl_path = os.path.join(stl_dir, file)
-        stl_list.append(stl_path)        
-        print(stl_path)
-
 
 rotate_angle_start = 0  # 绕x轴旋转旋转一定角度后，以样品新的法线方向为轴的旋转角度,单位为度
 rotate_angle_stop = 10  # 旋转终止角度  如果stop = step，则只旋转一次
 rotate_angle_step = 10  # 旋转步长
 rotate_angle_list = np.arange(rotate_angle_start, rotate_angle_stop, rotate_angle_step)
-roi_array = [-256, 255, -456, 55]  # [roi_x_min, roi_x_max, roi_y_min, roi_y_max]
 sample_tilt_x = 0  # 样品绕x轴旋转的角度
 pixel_size = 2  # 像素大小，单位为nm
 energy = 500  # 电子束能量，单位：eV
 epx = 500  # 每像素电子数
-
-
-for stl_path in stl_list:
-    stl_path = pathlib.Path(stl_path)
-    file_name = stl_path.name
-    file_name_no_ext = file_name.split('.')[0]
-    
-    # 创建保存路径
-    save_dir = os.path.join(os.path.dirname(stl_path), file_name_no_ext)
-    os.makedirs(save_dir, exist_ok=True)
-    
-    # 创建相机参数保存路径
-    parameters_path = os.path.join(save_dir, "camera_parameters.json")
-
-
-    mesh_path = save_dir
-    print(f"stl_path: {stl_path}",'\n')
-    print(f"mesh_path: {mesh_path}",'\n')
-
-
-    for rotate_angle in rotate_angle_list:
-        print(f"rotate_angle: {rotate_angle}",'\n\n')
-        # 生成.tri文件
-        TRI = tri_parameters(
-            stl_path=stl_path,
-            mesh_path=mesh_path,
-            beam_type='ion',  # 'ion' or 'electron'
-            sample_tilt_x=sample_tilt_x,
-            sample_tilt_y=0,
-            sample_tilt_new_z=rotate_angle,
-            det_tilt_x=0,  # 0 or 76.8
-        )
-        v, faces, d_zmin, d_zmax, tri_file_path, R = TRI.run()
-        print(f"R: {R}")
-        print(f".tri 文件已生成，路径: {tri_file_path}")
-
-        if rotate_angle == rotate_angle_start:
-
-            # 计算像素范围
-            x_min = int(torch.floor(torch.min(v[:, 0])).item())
-            x_max = int(torch.ceil(torch.max(v[:, 0])).item())   
-            y_min = int(torch.floor(torch.min(v[:, 1])).item())
-            y_max = int(torch.ceil(torch.max(v[:, 1])).item())
-            roi_array = [x_min, x_max, y_min, y_max]
-            print(f"roi_array: {roi_array}")
-
-            PRI = pri_parameters(
-                pri_dir=stl_dir,  # 输出 .pri 文件的路径
-                pixel_size=pixel_size,  # 像素大小，单位为nm
-                energy=energy,
-                epx=epx,       # 每像素电子数
-                sigma=1.0,    # 高斯模糊参数，默认为1.0
-                poisson=True,
-                roi_x_min=roi_array[0],  # 这里的roi设置也可以设置为模型的尺寸范围
-                roi_x_max=roi_array[1],  # 这里的roi_x_max和roi_y_max要大于0.5，否则会报错
-                roi_y_min=roi_array[2],
-                roi_y_max=roi_array[3],
-                d_zmin=d_zmin,
-                d_zmax=d_zmax,
-            )
-            pri_file_path = PRI.run()
-            if pri_file_path is None:
-                raise ValueError("生成 .pri 文件失败，路径为 None")
-            
-        print(f".pri 文件已生成，路径: {pri_file_path}")
-            
-        # 将mat_paths_list中的路径直接用空格分隔，不使用shlex.quote
-        mat_paths_quoted = " ".join(str(path) for path in mat_paths_list)
-        import shlex
-        import pathlib
-
-        # 检查路径是否存在
-        if not pathlib.Path(nebula_gpu_path).is_file():
-            raise FileNotFoundError(f"可执行文件 {nebula_gpu_path} 不存在")
-        if not pathlib.Path(tri_file_path).exists():
-            raise FileNotFoundError(f"文件 {tri_file_path} 不存在")
-        if not pathlib.Path(pri_file_path).exists():
-            raise FileNotFoundError(f"文件 {pri_file_path} 不存在")
-
-
-
-        # 适配多平台，保持原有命令格式 "nebula_gpu sem.tri sem.pri silicon.mat pmma.mat > output.det"
-        if platform.system() == "Windows":
-            # Windows 下使用 cmd /c 执行重定向
-            command = f'"{nebula_gpu_path}" "{tri_file_path}" "{pri_file_path}" {mat_paths_quoted} > "{output_path}"'
-        else:
-            # Linux/Mac 下使用相同格式
-            command = f'"{nebula_gpu_path}" "{tri_file_path}" "{pri_file_path}" {mat_paths_quoted} > "{output_path}"'
-        
-        print(f"运行命令: {command}")
-        image_path = pathlib.Path(f"{tri_file_path}").with_suffix(".png")
-        
-        try:
-            print(f"[DEBUG] 完整命令: {command}")
-            NEBULA = nebula_gpu(
-                command=command,
-                sem_simu_result=output_path,
-                image_path=image_path,
-            )
-            NEBULA.run()
-        except Exception as e:
-            print(f"[ERROR] 调用 nebula_gpu 时发生异常: {e}")
-            print(f"[提示] 尝试直接在终端中运行命令: {command}")
-            raise
-        #NEBULA.show_image(plot=False, save=True)
-        print(f"图像已保存至: {image_path}")
-
-        # # 将 R 转换为 list 或其他可序列化的类型
-        if hasattr(R, 'tolist'):
-            R = R.tolist()
-        if rotate_angle == rotate_angle_start:
-            parameters = {
-                "camera": {
-                    "width": roi_array[1] - roi_array[0] + 1,  # 512
-                    "height": roi_array[3] - roi_array[2] + 1,  # 512
-                    "cx": (roi_array[1] - roi_array[0] + 1) / 2,  # 256.0
-                    "cy": (roi_array[3] - roi_array[2] + 1) / 2,  # 256.0
-                },
-                "frames": [
-                    {
-                    "file_path": str(image_path),
-                    "rotation": json.dumps(R),   #旋转
-                    "translation": json.dumps([0.0, 0.0, 0.0]) #平移
-                    },
-                ]
-            }
-        else:
-            # 添加新帧
-            parameters = add_frame_to_parameters(
-                parameters,
-                str(image_path),
-                json.dumps(R),
-                json.dumps([0.0, 0.0, 0.0])
-            )
-
-
-
-    save_parameters(parameters, parameters_path)
-    print(f"相机参数已保存至: {parameters_path}")
-
-
-
+stream_pri = False  # 是否通过命名管道流式输出.pri，边生成边模拟，不占用磁盘 (仅POSIX)
+live_interval = None  # 实时图像更新间隔(秒)，运行中跟踪output.det并打印已检测电子数；None为关闭
+progress_log = False  # 是否把nebula_gpu的进度事件记录到每个任务工作目录下的progress.csv
+completion_grace = 2.0  # 进度100%且running为0后，.det保持不变多少秒即结束nebula_gpu进程
+# 模拟结束后把.det压缩为record_pack容器('zlib'或'lzma')，不保留原始.det；None则不压缩
+compress_det = None
+pri_seed = None  # 生成.pri的随机种子，固定后输出可复现；None则每次生成新的随机实现
+# .pri缓存目录(如pri_cache.DEFAULT_CACHE_DIR)，束参数和pri_seed不变时复用已生成的.pri；
+# 只在固定pri_seed时生效，None则不使用缓存
+pri_cache_dir = None
+prepare_workers = 2  # 生成.tri/.pri的进程数
+devices = None  # 使用的GPU编号列表，如['0', '1']，或'auto'自动检测；None则不指定GPU
+sim_slots = None  # 同时运行的nebula_gpu数量，None则等于GPU数量(未指定GPU时为1)
+analysis_workers = 1  # 分析.det的进程数
+# 任务清单，中断后重新运行时跳过已完成的任务
+manifest_path = pathlib.Path(stl_dir)/'sweep_manifest.jsonl'
+
+
+def main():
+    # 遍历stl_dir目录下的所有文件，如果文件名以.stl结尾，则将其路径添加到stl_list中
+    if not stl_list:
+        for file in sorted(os.listdir(stl_dir)):
+            if file.endswith('.stl'):
+                stl_path = os.path.join(stl_dir, file)
+                stl_list.append(stl_path)
+                print(stl_path)
+
+    jobs = make_jobs(
+        stl_list,
+        rotate_angle_list,
+        nebula_gpu_path=nebula_gpu_path,
+        mat_paths=mat_paths_list,
+        beam_type='ion',  # 'ion' or 'electron'
+        sample_tilt_x=sample_tilt_x,
+        det_tilt_x=0,  # 0 or 76.8
+        pixel_size=pixel_size,  # 像素大小，单位为nm
+        energy=energy,
+        epx=epx,       # 每像素电子数
+        sigma=1.0,    # 高斯模糊参数，默认为1.0
+        poisson=True,
+        stream_pri=stream_pri,
+        pri_seed=pri_seed,
+        pri_cache_dir=pri_cache_dir,
+        live_interval=live_interval,
+        progress_log=progress_log,
+        completion_grace=completion_grace,
+        compress_det=compress_det,
+    )
+    print(f"共 {len(jobs)} 个任务 ({len(stl_list)} 个STL x {len(rotate_angle_list)} 个角度)")
+
+    results = SweepScheduler(
+        jobs,
+        prepare_workers=prepare_workers,
+        sim_slots=sim_slots,
+        analysis_workers=analysis_workers,
+        manifest=SweepManifest(manifest_path),
+        devices=devices,
+    ).run()
+    save_camera_parameters(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+入口模块的启动时间基准
+
+对每个入口模块在新的解释器中执行 python -X importtime -c "import <模块>"，
+汇总导入时间，列出最耗时的包以及是否导入了 torch、cv2 等重量级依赖。
+结果可保存为 JSON 作为基线，之后与基线比较，启动时间明显变长时以非零状态退出，
+用于发现某次修改又在模块顶层导入了重量级依赖。
+
+用法:
+    python bench_startup.py --save startup_baseline.json
+    python bench_startup.py --baseline startup_baseline.json
+"""
+
+SOURCE_DIR = pathlib.Path(__file__).resolve().parent
+
+# 默认测量的入口模块
+ENTRY_POINTS = [
+    'parameters',
+    'sweep',
+    'auto_run_simulation',
+    'nebula_gui',
+    'voxel_to_mesh',
+    'sem_pri',
+    'analysis',
+    'pri_split',
+    'run_nebula',
+]
+
+# 应当在第一次使用时才导入的重量级依赖
+HEAVY_MODULES = ['torch', 'torchmcubes', 'skimage', 'trimesh', 'cv2']
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出。
+
+    返回:
+        tuple: (总导入时间, 按顶层包名汇总的自身导入时间 dict)，单位均为微秒
+    """
+    total = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        if not name[1:].startswith(' '):
+            total += int(cumulative_us)  # 顶层导入 (包名前没有额外缩进)，累计时间已包含嵌套导入
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return total, packages
+
+
+def measure(module, python=sys.executable):
+    """
+    在新的解释器中导入一次 module。
+
+    返回:
+        dict: module, ok, error, total_ms (顶层导入累计时间), wall_ms (进程运行时间),
+              top (自身导入时间最多的 5 个顶层包), heavy (导入了的重量级依赖)
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SOURCE_DIR), env.get('PYTHONPATH')]))
+    t_start = time.perf_counter()
+    completed = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SOURCE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - t_start) * 1000
+    total_us, packages = parse_importtime(completed.stderr)
+    error = None
+    if completed.returncode != 0:
+        stderr = completed.stderr.strip()
+        error = stderr.splitlines()[-1] if stderr else f'exit {completed.returncode}'
+    return {
+        'module': module,
+        'ok': completed.returncode == 0,
+        'error': error,
+        'total_ms': total_us / 1000,
+        'wall_ms': wall_ms,
+        'top': sorted(((name, us / 1000) for name, us in packages.items()),
+                      key=lambda item: -item[1])[:5],
+        'heavy': [name for name in HEAVY_MODULES if name in packages],
+    }
+
+
+def benchmark(modules, repeat=3, python=sys.executable):
+    """每个模块测量 repeat 次，取顶层导入累计时间的中位数那一次。"""
+    results = {}
+    for module in modules:
+        runs = sorted((measure(module, python) for _ in range(repeat)), key=lambda r: r['total_ms'])
+        result = runs[len(runs) // 2]
+        result['runs_ms'] = [round(r['total_ms'], 1) for r in runs]
+        result['median_wall_ms'] = statistics.median(r['wall_ms'] for r in runs)
+        results[module] = result
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, slack_ms=20.0):
+    """
+    与基线比较，超过 基线 * (1 + tolerance) + slack_ms 的模块视为退步。
+
+    返回:
+        list: 退步的 (模块, 基线毫秒, 当前毫秒)
+    """
+    regressions = []
+    for module, result in results.items():
+        before = baseline.get(module)
+        if before is None or not result['ok']:
+            continue
+        limit = before['total_ms'] * (1 + tolerance) + slack_ms
+        if result['total_ms'] > limit:
+            regressions.append((module, before['total_ms'], result['total_ms']))
+    return regressions
+
+
+def report(results, baseline=None):
+    for module, result in results.items():
+        if not result['ok']:
+            print(f"{module:<22} 导入失败: {result['error']}")
+            continue
+        line = (f"{module:<22} {result['total_ms']:8.1f} ms  "
+                f"(进程 {result['median_wall_ms']:.0f} ms)")
+        if baseline and module in baseline:
+            line += f"  基线 {baseline[module]['total_ms']:.1f} ms"
+        if result['heavy']:
+            line += f"  重量级依赖: {', '.join(result['heavy'])}"
+        print(line)
+        print('    ' + ', '.join(f"{name} {ms:.1f}" for name, ms in result['top']))
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(
+        description='Measure import-time startup cost of the entry-point modules')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS,
+                        help='Modules to import; default: all entry points')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Runs per module; the median is reported')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter to measure')
+    parser.add_argument('--save', help='Write results to this JSON file (e.g. as a new baseline)')
+    parser.add_argument('--baseline', help='Compare against a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown against the baseline')
+    parser.add_argument('--slack-ms', type=float, default=20.0,
+                        help='Allowed absolute slowdown in milliseconds')
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    results = benchmark(args.modules, args.repeat, args.python)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.save}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.slack_ms)
+        for module, before, after in regressions:
+            print(f"启动时间退步: {module} {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
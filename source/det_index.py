@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import pathlib
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from analysis import CHUNK_RECORDS, DetHistogram, det_chunks, det_records, electron_dtype
+from atomic_output import atomic_output
+from record_pack import is_packed, iter_block_headers, read_blocks_at
+
+"""
+.det 的逐像素索引
+
+查看结果的一小块区域时，不再需要把整个 output.det 读一遍。build_index 顺序读取一次 .det
+(原始格式或 record_pack 压缩容器均可)，写出旁路索引文件 (默认 output.det.idx):
+    offsets: 按 (px, py) 排列的每个像素的记录起始位置 (CSR 格式，长度为像素数 + 1)
+    perm:    按像素排序后的记录编号，像素 p 的记录是 perm[offsets[p]:offsets[p+1]]
+.det 本身不改动。之后 ROI 子图、单个像素或区域的能谱、行/列剖面只读取选中的记录，
+计数图和剖面只用 offsets，完全不读 .det。压缩的 .det 只解压包含选中记录的块。
+
+索引记录 .det 的大小和修改时间，.det 改变后 open_index 会重新建立索引。
+
+用法:
+    python det_index.py build output.det
+    python det_index.py roi output.det 100 164 200 264 --image roi.png --records roi.det
+    python det_index.py spectrum output.det 120 121 230 231 --bins 50
+    python det_index.py profile output.det --axis x --position 256 --width 4
+"""
+
+MAGIC = b'NEBIDX01'
+VERSION = 1
+
+# 索引文件的默认扩展名 (附加在 .det 文件名之后)
+INDEX_SUFFIX = '.idx'
+
+_LENGTH = struct.Struct('<I')
+_PIXEL_DTYPE = np.dtype([('px', '<i4'), ('py', '<i4')])
+
+
+def index_path_for(det_path):
+    """索引文件的默认路径: .det 文件名加 INDEX_SUFFIX。"""
+    det_path = pathlib.Path(det_path)
+    return det_path.with_name(det_path.name + INDEX_SUFFIX)
+
+
+def _source_stat(det_path):
+    stat = os.stat(det_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _layout(header_bytes, pixels, index_dtype):
+    """offsets 和 perm 在索引文件中的字节偏移 (都按 8 字节对齐)。"""
+    offsets_start = -(-(len(MAGIC) + _LENGTH.size + header_bytes) // 8) * 8
+    perm_start = offsets_start + (pixels + 1) * 8
+    return offsets_start, perm_start
+
+
+def _block_starts(det_path):
+    """压缩 .det 每块的文件偏移和第一条记录的编号。"""
+    blocks = []
+    start = 0
+    for offset, block, _ in iter_block_headers(det_path):
+        blocks.append([offset, start])
+        start += block['n']
+    return blocks
+
+
+def build_index(det_path, index_path=None, chunk_records=CHUNK_RECORDS):
+    """
+    顺序读取一次 .det，建立逐像素索引。
+
+    读取时累计像素直方图，并把每条记录的 (px, py) 暂存到索引目录下的临时文件 (8 字节/记录)；
+    读完后由直方图得到每个像素的起始位置，再按块把记录编号放到各自像素的位置上，
+    同一像素内保持记录在 .det 中的先后顺序。
+
+    参数:
+        det_path: .det 文件 (原始格式或压缩容器)
+        index_path: 索引文件路径，默认为 index_path_for(det_path)
+        chunk_records: 每次处理的记录数
+
+    返回:
+        pathlib.Path: 索引文件路径
+    """
+    t_start = time.time()
+    det_path = pathlib.Path(det_path)
+    index_path = pathlib.Path(index_path) if index_path is not None else index_path_for(det_path)
+    source = dict(_source_stat(det_path), packed=is_packed(det_path))
+    hist = DetHistogram()
+    with tempfile.TemporaryFile(dir=index_path.parent) as pixels_file:
+        for chunk in det_chunks(det_path, chunk_records):
+            hist.update_records(chunk)
+            pixels = np.empty(len(chunk), dtype=_PIXEL_DTYPE)
+            pixels['px'] = chunk['px']
+            pixels['py'] = chunk['py']
+            pixels_file.write(pixels)
+        pixels_file.flush()
+
+        total = hist.total
+        nx, ny = hist.counts.shape
+        offsets = np.zeros(nx * ny + 1, dtype='<i8')
+        np.cumsum(hist.counts.ravel(), out=offsets[1:])
+        index_dtype = np.dtype('<u4') if total < 2**32 else np.dtype('<u8')
+        header = json.dumps({
+            'version': VERSION,
+            'source': source,
+            'blocks': _block_starts(det_path) if source['packed'] else None,
+            'xmin': hist.xmin,
+            'ymin': hist.ymin,
+            'nx': nx,
+            'ny': ny,
+            'records': total,
+            'index_dtype': index_dtype.str,
+        }, separators=(',', ':')).encode('utf-8')
+        offsets_start, perm_start = _layout(len(header), nx * ny, index_dtype)
+
+        with atomic_output(index_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+                f.seek(offsets_start)
+                f.write(offsets)
+                f.truncate(perm_start + total * index_dtype.itemsize)
+            if total:
+                all_pixels = np.memmap(pixels_file, dtype=_PIXEL_DTYPE, mode='r', shape=(total,))
+                perm = np.memmap(tmp_path, dtype=index_dtype, mode='r+', offset=perm_start,
+                                 shape=(total,))
+                cursor = offsets[:-1].copy()
+                for start in range(0, total, chunk_records):
+                    chunk = np.array(all_pixels[start:start + chunk_records])
+                    keys = ((chunk['px'].astype(np.int64) - hist.xmin) * ny
+                            + (chunk['py'] - hist.ymin))
+                    order = np.argsort(keys, kind='stable')
+                    sorted_keys = keys[order]
+                    pixel, first, count = np.unique(sorted_keys, return_index=True,
+                                                    return_counts=True)
+                    rank = np.arange(len(sorted_keys)) - np.repeat(first, count)
+                    perm[cursor[sorted_keys] + rank] = start + order
+                    cursor[pixel] += count
+                perm.flush()
+                del perm, all_pixels
+    print(f"索引已保存到 {index_path}: {total} 个记录, {nx}x{ny} 像素, "
+          f"用时 {time.time() - t_start:.1f}s")
+    return index_path
+
+
+class DetIndex:
+    def __init__(self, det_path, index_path=None):
+        """
+        打开已建立的索引。索引与 .det 不一致 (.det 的大小或修改时间变了) 时抛出 ValueError。
+
+        坐标均为 .det 中的像素编号，区域为半开区间 [x0, x1) x [y0, y1)。
+        """
+        self.det_path = pathlib.Path(det_path)
+        if index_path is None:
+            index_path = index_path_for(det_path)
+        self.index_path = pathlib.Path(index_path)
+        with open(self.index_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.index_path} 不是 .det 索引文件")
+            header_bytes = _LENGTH.unpack(f.read(_LENGTH.size))[0]
+            header = json.loads(f.read(header_bytes))
+        if header['version'] != VERSION:
+            raise ValueError(f"不支持的索引版本: {header['version']}")
+        source = header['source']
+        if _source_stat(self.det_path) != {'size': source['size'], 'mtime_ns': source['mtime_ns']}:
+            raise ValueError(f"{self.index_path} 与 {self.det_path} 不一致，需要重新建立索引")
+        self.packed = source['packed']
+        self.blocks = header['blocks']
+        self.xmin, self.ymin = header['xmin'], header['ymin']
+        self.nx, self.ny = header['nx'], header['ny']
+        self.total = header['records']
+        index_dtype = np.dtype(header['index_dtype'])
+        offsets_start, perm_start = _layout(header_bytes, self.nx * self.ny, index_dtype)
+        self.offsets = np.fromfile(self.index_path, dtype='<i8', count=self.nx * self.ny + 1,
+                                   offset=offsets_start)
+        if self.total:
+            self.perm = np.memmap(self.index_path, dtype=index_dtype, mode='r', offset=perm_start,
+                                  shape=(self.total,))
+        else:
+            self.perm = np.empty(0, dtype=index_dtype)
+
+    @property
+    def counts(self):
+        """整幅计数图，counts[i, j] 为像素 (xmin+i, ymin+j) 的记录数，与 sem_image 相同。"""
+        return np.diff(self.offsets).reshape(self.nx, self.ny)
+
+    def _clip(self, x0, x1, y0, y1):
+        """区域与已索引范围的交集，返回局部下标 (i0, i1, j0, j1)。"""
+        i0, i1 = max(x0 - self.xmin, 0), min(x1 - self.xmin, self.nx)
+        j0, j1 = max(y0 - self.ymin, 0), min(y1 - self.ymin, self.ny)
+        return i0, max(i1, i0), j0, max(j1, j0)
+
+    def roi_image(self, x0, x1, y0, y1):
+        """区域的计数图，形状为 (x1-x0, y1-y0)，超出已索引范围的像素为 0。不读取 .det。"""
+        image = np.zeros((max(x1 - x0, 0), max(y1 - y0, 0)), dtype=np.int64)
+        i0, i1, j0, j1 = self._clip(x0, x1, y0, y1)
+        if i0 < i1 and j0 < j1:
+            di, dj = self.xmin + i0 - x0, self.ymin + j0 - y0
+            image[di:di + i1 - i0, dj:dj + j1 - j0] = self.counts[i0:i1, j0:j1]
+        return image
+
+    def record_indices(self, x0, x1, y0, y1):
+        """区域内所有记录在 .det 中的编号，按像素 (先 px 后 py) 排列。"""
+        i0, i1, j0, j1 = self._clip(x0, x1, y0, y1)
+        rows = np.arange(i0, i1) * self.ny
+        # 每个 x 行中 [j0, j1) 的记录在 perm 中是连续的一段
+        starts, stops = self.offsets[rows + j0], self.offsets[rows + j1]
+        parts = [self.perm[a:b] for a, b in zip(starts, stops)]
+        return np.concatenate(parts + [self.perm[:0]]).astype(np.int64)
+
+    def records(self, indices):
+        """读取指定编号的记录，按在 .det 中的先后顺序返回。压缩的 .det 只解压用到的块。"""
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        if not self.packed:
+            return np.array(det_records(self.det_path)[indices])
+        block_starts = np.array([start for _, start in self.blocks], dtype=np.int64)
+        which = np.searchsorted(block_starts, indices, side='right') - 1
+        needed = np.unique(which)
+        parts = []
+        blocks = read_blocks_at(self.det_path, [self.blocks[b][0] for b in needed])
+        for b, block in zip(needed, blocks):
+            parts.append(block[indices[which == b] - block_starts[b]])
+        if not parts:
+            return np.empty(0, dtype=electron_dtype)
+        return np.concatenate(parts)
+
+    def roi_records(self, x0, x1, y0, y1):
+        """区域内的全部记录。"""
+        return self.records(self.record_indices(x0, x1, y0, y1))
+
+    def pixel_records(self, px, py):
+        """单个像素的全部记录。"""
+        return self.roi_records(px, px + 1, py, py + 1)
+
+    def energy_spectrum(self, x0, x1, y0, y1, bins=100, range=None):
+        """区域内记录的能量直方图，返回 (计数, 能量分箱边界)，参数同 np.histogram。"""
+        return np.histogram(self.roi_records(x0, x1, y0, y1)['E'], bins=bins, range=range)
+
+    def line_profile(self, axis, position, width=1):
+        """
+        行或列的计数剖面。不读取 .det。
+
+        参数:
+            axis: 'x' 为沿 x 方向的剖面 (py 在 [position, position+width) 内求和)，'y' 为沿 y 方向
+            position: 剖面所在的像素编号
+            width: 求和的行/列数
+
+        返回:
+            tuple: (沿剖面方向的像素编号, 计数)
+        """
+        if axis == 'x':
+            coords = np.arange(self.xmin, self.xmin + self.nx)
+            image = self.roi_image(self.xmin, self.xmin + self.nx, position, position + width)
+            return coords, image.sum(axis=1)
+        if axis == 'y':
+            coords = np.arange(self.ymin, self.ymin + self.ny)
+            image = self.roi_image(position, position + width, self.ymin, self.ymin + self.ny)
+            return coords, image.sum(axis=0)
+        raise ValueError(f"axis 只能是 'x' 或 'y': {axis}")
+
+
+def open_index(det_path, index_path=None, build=True):
+    """
+    打开 .det 的索引；build 为 True 时在索引不存在或已过期时先 (重新) 建立索引。
+    """
+    index_path = pathlib.Path(index_path) if index_path is not None else index_path_for(det_path)
+    if build:
+        try:
+            return DetIndex(det_path, index_path)
+        except (FileNotFoundError, ValueError):
+            build_index(det_path, index_path)
+    return DetIndex(det_path, index_path)
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(description='Build and query a per-pixel index of a .det file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Build (or rebuild) the index sidecar')
+    build.add_argument('det', help='.det file, raw or packed by record_pack')
+    build.add_argument('--index', help=f'Index file; default: det + {INDEX_SUFFIX}')
+    info = commands.add_parser('info', help='Show the indexed pixel range and record count')
+    info.add_argument('det', help='.det file')
+    info.add_argument('--index', help='Index file')
+    roi = commands.add_parser('roi', help='Counts of a region [x0, x1) x [y0, y1)')
+    roi.add_argument('det', help='.det file')
+    roi.add_argument('bounds', type=int, nargs=4, metavar=('X0', 'X1', 'Y0', 'Y1'),
+                     help='Pixel region')
+    roi.add_argument('--index', help='Index file')
+    roi.add_argument('--image', help='Save the region count image (PNG)')
+    roi.add_argument('--records', help='Save the region records as a raw .det file')
+    spectrum = commands.add_parser('spectrum',
+                                   help='Energy spectrum of a region [x0, x1) x [y0, y1)')
+    spectrum.add_argument('det', help='.det file')
+    spectrum.add_argument('bounds', type=int, nargs=4, metavar=('X0', 'X1', 'Y0', 'Y1'),
+                          help='Pixel region')
+    spectrum.add_argument('--index', help='Index file')
+    spectrum.add_argument('--bins', type=int, default=100, help='Number of energy bins')
+    spectrum.add_argument('--range', type=float, nargs=2, metavar=('EMIN', 'EMAX'),
+                          help='Energy range in eV')
+    profile = commands.add_parser('profile', help='Line profile of counts along x or y')
+    profile.add_argument('det', help='.det file')
+    profile.add_argument('--index', help='Index file')
+    profile.add_argument('--axis', choices=['x', 'y'], required=True,
+                         help='Direction of the profile')
+    profile.add_argument('--position', type=int, required=True,
+                         help='Pixel row (axis x) or column (axis y)')
+    profile.add_argument('--width', type=int, default=1, help='Number of rows/columns summed')
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    if args.command == 'build':
+        build_index(args.det, args.index)
+        return
+    index = open_index(args.det, args.index)
+    if args.command == 'info':
+        print(f"{index.det_path}: {index.total} 个记录, "
+              f"像素范围 x [{index.xmin}, {index.xmin + index.nx}), "
+              f"y [{index.ymin}, {index.ymin + index.ny}), "
+              f"{'压缩' if index.packed else '原始'}格式")
+    elif args.command == 'roi':
+        x0, x1, y0, y1 = args.bounds
+        image = index.roi_image(x0, x1, y0, y1)
+        print(f"区域 x [{x0}, {x1}), y [{y0}, {y1}): {image.sum()} 个记录")
+        if args.image:
+            # matplotlib.pyplot 导入较慢，只在保存图像时导入
+            import matplotlib.pyplot as plt
+            plt.imsave(args.image, image.T, cmap='gray', origin='lower')
+            print(f"计数图已保存到 {args.image}")
+        if args.records:
+            records = index.roi_records(x0, x1, y0, y1)
+            with atomic_output(args.records) as tmp_path:
+                records.tofile(tmp_path)
+            print(f"{len(records)} 个记录已保存到 {args.records}")
+    elif args.command == 'spectrum':
+        counts, edges = index.energy_spectrum(*args.bounds, bins=args.bins, range=args.range)
+        print("E_min(eV)\tE_max(eV)\tcount")
+        for lo, hi, n in zip(edges[:-1], edges[1:], counts):
+            print(f"{lo:.2f}\t{hi:.2f}\t{n}")
+    else:
+        coords, counts = index.line_profile(args.axis, args.position, args.width)
+        print(f"p{args.axis}\tcount")
+        for c, n in zip(coords, counts):
+            print(f"{c}\t{n}")
+
+
+if __name__ == '__main__':
+    main()
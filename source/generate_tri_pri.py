@@ -1,6 +1,5 @@
 import sys
 import pathlib
-import torch
 import numpy as np
 from sem_pri import generate_sem_pri_data
 from voxel_to_mesh import run_interface
@@ -84,10 +83,10 @@ if __name__ == "__main__":
         
         v, faces, d_zmin, d_zmax = run_interface(voxel_path, mesh_path, final_side=1000,sample_tilt_x=sample_tilt_x,sample_tilt_new_z=0, det_tilt_x=det_tilt_x)
 
-        x_min = int(np.floor(torch.min(v[:, 0]).cpu()))
-        x_max = int(np.ceil(torch.max(v[:, 0]).cpu()))   
-        y_min = int(np.floor(torch.min(v[:, 1]).cpu()))
-        y_max = int(np.ceil(torch.max(v[:, 1]).cpu()))   
+        x_min = int(np.floor(float(v[:, 0].min())))
+        x_max = int(np.ceil(float(v[:, 0].max())))   
+        y_min = int(np.floor(float(v[:, 1].min())))
+        y_max = int(np.ceil(float(v[:, 1].max())))   
         
         print("x_min, x_max, y_min, y_max = ", x_min, x_max, y_min, y_max)
 
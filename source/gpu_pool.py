@@ -0,0 +1,105 @@
+import contextlib
+import os
+import queue
+import subprocess
+import threading
+import time
+
+"""
+GPU 设备池
+
+多 GPU 节点上同时运行多个 nebula_gpu 时，每个进程通过环境变量 CUDA_VISIBLE_DEVICES
+只看到分配给它的一块 GPU。DevicePool 维护空闲设备队列，模拟任务取得空闲设备后运行，
+结束后归还；同时按任务用时统计每个设备的利用率。
+
+设备只通过环境变量传递，可以用打印 $CUDA_VISIBLE_DEVICES 的脚本代替 nebula_gpu 进行测试。
+"""
+
+
+def discover_devices(devices=None):
+    """
+    确定可用的 GPU 设备编号列表 (字符串)。
+
+    优先级: devices 参数 > 环境变量 CUDA_VISIBLE_DEVICES > nvidia-smi -L > ['0']
+    """
+    if devices is not None:
+        return [str(d) for d in devices]
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES', '').strip()
+    if visible:
+        return [d.strip() for d in visible.split(',') if d.strip()]
+    try:
+        output = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True,
+                                timeout=10).stdout
+        count = sum(1 for line in output.splitlines() if line.startswith('GPU '))
+        if count:
+            return [str(i) for i in range(count)]
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return ['0']
+
+
+def device_env(device, base=None):
+    """返回只暴露 device 这块 GPU 的进程环境变量。"""
+    env = dict(os.environ if base is None else base)
+    env['CUDA_VISIBLE_DEVICES'] = str(device)
+    return env
+
+
+class DevicePool:
+    def __init__(self, devices=None):
+        """
+        参数:
+            devices: 设备编号列表，为 None 时由 discover_devices 自动确定
+        """
+        self.devices = discover_devices(devices)
+        self._free = queue.Queue()
+        for device in self.devices:
+            self._free.put(device)
+        self._lock = threading.Lock()
+        self.busy_time = {device: 0.0 for device in self.devices}
+        self.job_count = {device: 0 for device in self.devices}
+        self.start_time = time.time()
+
+    def __len__(self):
+        return len(self.devices)
+
+    @contextlib.contextmanager
+    def device(self, timeout=None):
+        """
+        取得一个空闲设备，with 块结束时归还并记录用时。没有空闲设备时阻塞等待。
+
+        用法:
+            with pool.device() as device:
+                subprocess.run(argv, env=device_env(device))
+        """
+        device = self.acquire(timeout=timeout)
+        t_start = time.time()
+        try:
+            yield device
+        finally:
+            self.release(device, time.time() - t_start)
+
+    def acquire(self, block=True, timeout=None):
+        """取得一个空闲设备；block 为 False 且没有空闲设备时抛出 queue.Empty。"""
+        return self._free.get(block=block, timeout=timeout)
+
+    def release(self, device, busy_seconds):
+        """归还设备并记录本次占用时间。"""
+        with self._lock:
+            self.busy_time[device] += busy_seconds
+            self.job_count[device] += 1
+        self._free.put(device)
+
+    def utilization(self):
+        """每个设备的利用率: 占用时间 / 设备池创建以来的时间。"""
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        with self._lock:
+            return {device: busy / elapsed for device, busy in self.busy_time.items()}
+
+    def report(self):
+        """打印每个设备的任务数、占用时间和利用率。"""
+        utilization = self.utilization()
+        for device in self.devices:
+            print(f"[GPU {device}] 任务数: {self.job_count[device]}, "
+                  f"占用时间: {self.busy_time[device]:.1f}s, "
+                  f"利用率: {utilization[device] * 100:.1f}%")
@@ -0,0 +1,90 @@
+import os
+import threading
+
+import numpy as np
+
+from analysis import CHUNK_RECORDS, DetHistogram, electron_dtype
+
+"""
+实时 .det 图像
+
+nebula_gpu 运行时会持续向 .det 文件追加 36 字节的电子记录。DetFollower 像 tail -f 一样
+跟踪该文件，每次只读取新增的完整记录 (不完整的尾部字节留到下一次)，
+并更新累计像素直方图，GUI 和批量脚本可以随时取得部分图像，提前发现异常的模拟。
+"""
+
+
+class DetFollower:
+    def __init__(self, det_path, interval=2.0, on_update=None):
+        """
+        参数:
+            det_path: 正在写入的 .det 文件路径
+            interval: 轮询间隔 (秒)
+            on_update: 有新记录时的回调，参数为 DetFollower 本身
+        """
+        self.det_path = str(det_path)
+        self.interval = interval
+        self.on_update = on_update
+        self.hist = DetHistogram()
+        self._file = None
+        self._pending = b''
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def total(self):
+        """已读取的电子数量。"""
+        return self.hist.total
+
+    def image(self):
+        """返回当前部分图像的副本，image[i, j] 对应像素 (xmin+i, ymin+j)。"""
+        with self._lock:
+            return self.hist.counts.copy(), self.hist.xmin, self.hist.ymin
+
+    def poll(self):
+        """读取新增的完整记录并更新直方图，返回本次新增的记录数。"""
+        if self._file is None:
+            if not os.path.exists(self.det_path):
+                return 0
+            self._file = open(self.det_path, 'rb')
+        added = 0
+        # 分块读取，落后较多时也不会一次读入整个文件
+        while True:
+            chunk = self._file.read(CHUNK_RECORDS * electron_dtype.itemsize)
+            if not chunk:
+                return added
+            data = self._pending + chunk
+            usable = len(data) - len(data) % electron_dtype.itemsize
+            self._pending = data[usable:]
+            if usable == 0:
+                continue
+            records = np.frombuffer(data, dtype=electron_dtype,
+                                    count=usable // electron_dtype.itemsize)
+            with self._lock:
+                self.hist.update_records(records)
+            added += len(records)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.poll() and self.on_update is not None:
+                self.on_update(self)
+
+    def start(self):
+        """在后台线程中按 interval 轮询文件。"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止轮询，读取剩余记录后关闭文件。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.poll() and self.on_update is not None:
+            self.on_update(self)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
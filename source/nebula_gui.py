@@ -1,8 +1,7 @@
 import sys
 import os
-import subprocess
+import asyncio
 import pathlib
-import torch
 import numpy as np
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
@@ -10,12 +9,20 @@ from PyQt6.QtWidgets import (
     QComboBox, QSpinBox, QDoubleSpinBox, QCheckBox, QGroupBox, QTabWidget, QProgressBar,
     QTextEdit
 )
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QUrl
+from PyQt6.QtCore import QObject, QThread, pyqtSignal, Qt, QUrl
+from PyQt6.QtGui import QImage, QPixmap
 from PyQt6.QtCore import QSettings
 
 
 from sem_pri import generate_sem_pri_data
+from pri_cache import PriCache, pri_cache_key, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
 from voxel_to_mesh import run_interface
+from live_det import DetFollower
+from nebula_launcher import build_argv, format_argv, is_successful
+from async_runner import AsyncLoopThread, AsyncSimulationRunner
+
+# 关闭窗口时等待后台模拟结束的最长秒数
+SHUTDOWN_TIMEOUT = 10
 
 
 class NebulaGUI(QMainWindow):
@@ -29,6 +36,11 @@ class NebulaGUI(QMainWindow):
         self.d_zmin = 0
         self.d_zmax = 0
 
+        # nebula_gpu 在后台线程的 asyncio 事件循环中运行，结果通过 Qt 信号回到界面线程；
+        # 填写 GPU 设备后，首次运行时才在后台创建设备池，每个 nebula_gpu 使用一块空闲的 GPU
+        self.simulation_loop = AsyncLoopThread().start()
+        self.simulation_bridge = SimulationBridge(AsyncSimulationRunner(), self.simulation_loop)
+
         # 主控件
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -119,16 +131,46 @@ class NebulaGUI(QMainWindow):
         self.output_layout.addWidget(self.output_button)
         self.nebula_layout.addLayout(self.output_layout)
 
+        # GPU 设备: 留空时不指定 GPU，nebula_gpu 继承当前环境变量
+        self.devices_layout = QHBoxLayout()
+        self.devices_label = QLabel("GPU 设备:")
+        self.devices_input = QLineEdit()
+        self.devices_input.setPlaceholderText("留空则不指定；如 0,1，或 auto 自动检测")
+        self.devices_layout.addWidget(self.devices_label)
+        self.devices_layout.addWidget(self.devices_input)
+        self.nebula_layout.addLayout(self.devices_layout)
+
         # 运行按钮
         self.run_button = QPushButton("运行 nebula_gpu")
         self.run_button.clicked.connect(self.run_nebula_gpu)
         self.nebula_layout.addWidget(self.run_button)
 
+        # 停止按钮: 取消所有正在运行的 nebula_gpu
+        self.stop_button = QPushButton("停止 nebula_gpu")
+        self.stop_button.clicked.connect(self.stop_nebula_gpu)
+        self.nebula_layout.addWidget(self.stop_button)
+
+        # 运行中的实时图像预览
+        self.live_preview = QLabel("实时图像预览")
+        self.live_preview.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.live_preview.setMinimumHeight(200)
+        self.nebula_layout.addWidget(self.live_preview)
+
+        # 模拟进度
+        self.nebula_progress_bar = QProgressBar()
+        self.nebula_progress_bar.setRange(0, 100)
+        self.nebula_layout.addWidget(self.nebula_progress_bar)
+
         # 日志输出
         self.log_output = QPlainTextEdit()
         self.log_output.setReadOnly(True)
         self.log_output.setStyleSheet("font-family: monospace;")
         self.nebula_layout.addWidget(self.log_output)
+
+        self.simulation_bridge.log_signal.connect(self.log_output.appendPlainText)
+        self.simulation_bridge.live_signal.connect(self.on_live_image)
+        self.simulation_bridge.progress_signal.connect(self.on_progress_event)
+        self.simulation_bridge.finished_signal.connect(self.on_simulation_finished)
         
    
     def init_tri_pri_tab(self):
@@ -342,6 +384,46 @@ class NebulaGUI(QMainWindow):
         poisson_layout.addWidget(self.poisson_check)
         pri_layout.addLayout(poisson_layout)
         
+        # 随机种子，-1 表示不固定，每次生成新的随机实现
+        seed_layout = QHBoxLayout()
+        seed_label = QLabel("随机种子:")
+        self.pri_seed_spin = QSpinBox()
+        self.pri_seed_spin.setRange(-1, 2147483647)
+        self.pri_seed_spin.setValue(-1)
+        self.pri_seed_spin.setSpecialValueText("不固定")
+        seed_layout.addWidget(seed_label)
+        seed_layout.addWidget(self.pri_seed_spin)
+        pri_layout.addLayout(seed_layout)
+        
+        # .pri 缓存，只在固定随机种子时使用
+        pri_cache_check_layout = QHBoxLayout()
+        pri_cache_check_label = QLabel("复用.pri缓存 (需固定随机种子):")
+        self.pri_cache_check = QCheckBox()
+        self.pri_cache_check.setChecked(False)
+        self.pri_cache_check.stateChanged.connect(self.toggle_pri_cache_controls)
+        pri_cache_check_layout.addWidget(pri_cache_check_label)
+        pri_cache_check_layout.addWidget(self.pri_cache_check)
+        pri_layout.addLayout(pri_cache_check_layout)
+        
+        pri_cache_dir_layout = QHBoxLayout()
+        pri_cache_dir_label = QLabel("缓存目录:")
+        self.pri_cache_dir_edit = QLineEdit(str(DEFAULT_CACHE_DIR))
+        self.pri_cache_dir_btn = QPushButton("浏览...")
+        self.pri_cache_dir_btn.clicked.connect(self.browse_pri_cache_dir)
+        pri_cache_dir_layout.addWidget(pri_cache_dir_label)
+        pri_cache_dir_layout.addWidget(self.pri_cache_dir_edit)
+        pri_cache_dir_layout.addWidget(self.pri_cache_dir_btn)
+        pri_layout.addLayout(pri_cache_dir_layout)
+        
+        pri_cache_size_layout = QHBoxLayout()
+        pri_cache_size_label = QLabel("缓存大小上限 (GB):")
+        self.pri_cache_size_spin = QSpinBox()
+        self.pri_cache_size_spin.setRange(1, 10000)
+        self.pri_cache_size_spin.setValue(DEFAULT_MAX_BYTES // 1024**3)
+        pri_cache_size_layout.addWidget(pri_cache_size_label)
+        pri_cache_size_layout.addWidget(self.pri_cache_size_spin)
+        pri_layout.addLayout(pri_cache_size_layout)
+        
         pri_group.setLayout(pri_layout)
         self.tri_pri_layout.addWidget(pri_group)
         
@@ -377,6 +459,9 @@ class NebulaGUI(QMainWindow):
         # 初始化ROI控件状态
         self.toggle_roi_controls(Qt.CheckState.Unchecked)
         
+        # 初始化缓存控件状态
+        self.toggle_pri_cache_controls(Qt.CheckState.Unchecked.value)
+        
         # 初始化时不设置默认路径，将在选择STL文件后自动设置
 
 
@@ -436,6 +521,20 @@ class NebulaGUI(QMainWindow):
             self.det_tilt_spin.setValue(76.8)
             self.det_tilt_spin.setEnabled(True)  # 电子束模式下启用探测器倾转角
             
+    def browse_pri_cache_dir(self):
+        """浏览选择.pri缓存目录"""
+        path = QFileDialog.getExistingDirectory(self, "选择.pri缓存目录",
+                                                self.pri_cache_dir_edit.text())
+        if path:
+            self.pri_cache_dir_edit.setText(path)
+
+    def toggle_pri_cache_controls(self, state):
+        """根据缓存复选框的状态，启用或禁用缓存目录和大小上限控件。"""
+        enabled = state == Qt.CheckState.Checked.value
+        self.pri_cache_dir_edit.setEnabled(enabled)
+        self.pri_cache_dir_btn.setEnabled(enabled)
+        self.pri_cache_size_spin.setEnabled(enabled)
+
     def toggle_roi_controls(self, state):
         """
         根据 ROI（Region of Interest）复选框的状态，启用或禁用 ROI 相关控件。
@@ -570,7 +669,11 @@ class NebulaGUI(QMainWindow):
             'roi_y_max': self.roi_y_max_spin.value(),
             # 添加d_zmin和d_zmax参数
             'd_zmin': self.d_zmin,
-            'd_zmax': self.d_zmax
+            'd_zmax': self.d_zmax,
+            'seed': None if self.pri_seed_spin.value() < 0 else self.pri_seed_spin.value(),
+            'cache_dir': (pathlib.Path(self.pri_cache_dir_edit.text())
+                          if self.pri_cache_check.isChecked() else None),
+            'cache_max_bytes': self.pri_cache_size_spin.value() * 1024**3,
         }
         
         # 清空日志
@@ -628,145 +731,192 @@ class NebulaGUI(QMainWindow):
             QMessageBox.warning(self, "警告", "请选择输出文件路径！")
             return
 
-        mat_paths_list = [f'"{path.strip()}"' for path in mat_paths.split(",")]
-        mat_paths_quoted = " ".join(mat_paths_list)
-        command = f"{nebula_gpu_path} {tri_path} {pri_path} {mat_paths_quoted} > {output_path}"
-        image_path = str(pathlib.Path(tri_path).with_suffix(".png"))
+        mat_paths_list = [path.strip() for path in mat_paths.split(",")]
+        devices = self.devices_input.text().strip()
+        if devices and devices != 'auto':
+            devices = [device.strip() for device in devices.split(",") if device.strip()]
+        command = build_argv(nebula_gpu_path, tri_path, pri_path, mat_paths_list)
         self.log_output.clear()
-        self.log_output.appendPlainText(f"运行命令: {command}")
+        self.log_output.appendPlainText(f"运行命令: {format_argv(command, output_path)}")
+
+        self.nebula_progress_bar.setValue(0)
+        self.simulation_bridge.submit(command, output_path, devices=devices or None)
 
-        self.worker_thread = WorkerThread(command, output_path,image_path=image_path)
-        self.worker_thread.log_signal.connect(self.log_output.appendPlainText)
-        self.worker_thread.start()
+    def stop_nebula_gpu(self):
+        """取消所有正在运行的 nebula_gpu"""
+        self.simulation_bridge.cancel_all()
 
+    def on_simulation_finished(self, result):
+        """nebula_gpu 运行结束 (包括分析图像)"""
+        if result.get('error'):
+            self.log_output.appendPlainText(f"nebula_gpu 运行失败: {result['error']}")
+        elif result.get('cancelled'):
+            self.log_output.appendPlainText("nebula_gpu 已取消")
 
-class WorkerThread(QThread):
+    def closeEvent(self, event):
+        # 关闭窗口时取消仍在运行的模拟，等待进程组被终止后再停止事件循环，不留下孤儿进程
+        self.simulation_bridge.shutdown()
+        super().closeEvent(event)
+
+    def on_progress_event(self, event):
+        """根据 nebula_gpu 的进度事件更新进度条"""
+        if event.percent is not None:
+            self.nebula_progress_bar.setValue(int(event.percent))
+        rate = f"{event.primary_rate:,.0f} 电子/秒" if event.primary_rate is not None else ""
+        self.nebula_progress_bar.setFormat(f"%p% | 检测: {event.detected} | {rate}")
+
+    def on_live_image(self, counts):
+        """显示运行中的部分SEM图像"""
+        if counts.size == 0 or counts.max() == 0:
+            return
+        # 与 sem_analysis 保存的图像方向一致 (origin='lower')
+        image = np.ascontiguousarray((counts.T[::-1] * (255.0 / counts.max())).astype(np.uint8))
+        height, width = image.shape
+        qimage = QImage(image.data, width, height, width, QImage.Format.Format_Grayscale8)
+        pixmap = QPixmap.fromImage(qimage.copy())
+        self.live_preview.setPixmap(pixmap.scaled(
+            self.live_preview.width(), self.live_preview.height(),
+            Qt.AspectRatioMode.KeepAspectRatio))
+
+
+async def run_sem_analysis_script(det_path, log):
+    """在子进程中运行 sem-analysis.py 生成图像，输出逐行写入日志"""
+    try:
+        log(f"开始调用 sem-analysis.py 展示图像，输出文件: {det_path}")
+
+        # 获取当前脚本所在目录
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        script_path = os.path.join(current_dir, "sem-analysis.py")
+
+        # 如果当前目录下没有，则尝试使用相对路径
+        if not os.path.exists(script_path):
+            script_path = "sem-analysis.py"
+        if not os.path.exists(script_path):
+            log(f"未找到 sem-analysis.py，请确保该文件在当前目录或指定路径下")
+            return
+
+        # 使用系统Python解释器
+        analysis_process = await asyncio.create_subprocess_exec(
+            sys.executable, script_path, str(det_path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await analysis_process.communicate()
+        for output in stdout.decode(errors='replace').splitlines():
+            if output.strip():
+                log(output.strip())
+
+        # 过滤GTK警告信息
+        for error in stderr.decode(errors='replace').splitlines():
+            error_stripped = error.strip()
+            if error_stripped and not ("Gtk-CRITICAL" in error_stripped or
+                                       "gtk_tree_view_scroll_to_cell" in error_stripped or
+                                       "assertion" in error_stripped):
+                log(error_stripped)
+        log(f"sem-analysis.py 执行完成，返回码: {analysis_process.returncode}")
+    except Exception as e:
+        log(f"调用 sem-analysis.py 时发生异常: {str(e)}")
+
+
+class SimulationBridge(QObject):
+    """
+    Qt 与 async_runner 之间的桥接: 在后台事件循环中运行 nebula_gpu，
+    日志、进度事件、实时图像和运行结果都通过信号发送到界面线程。
+    """
     log_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(object)  # 进度事件 (progress_events.ProgressEvent)
+    live_signal = pyqtSignal(object)  # 运行中的部分图像 (像素计数数组)
+    finished_signal = pyqtSignal(object)  # 运行结果 dict
 
-    def __init__(self, command, output_file="output.det",image_path=None):
+    def __init__(self, runner, loop_thread, live_interval=2.0):
         super().__init__()
-        self.command = command
-        self.output_file = output_file
-        self.image_path = image_path
-    def run(self):
-        #try:
-        import select
-        import time
-        import re
-        process = subprocess.Popen(
-            self.command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=0  # 无缓冲模式
-        )
+        self.runner = runner
+        self.loop_thread = loop_thread
+        self.live_interval = live_interval
+        # 正在运行 (含图像分析) 的 job_id，只在事件循环线程中读写
+        self.active = set()
 
-        progress_completed = False
-        progress_100_time = None
-        # 使用 select 监听标准输出和错误
-        while True:
-            reads = [process.stdout.fileno(), process.stderr.fileno()]
-            ret = select.select(reads, [], [])
-            for fd in ret[0]:                                           
-                if fd == process.stderr.fileno():
-                    error = process.stderr.readline()
-                    if error:
-                        error_stripped = error.strip()
-                        self.log_signal.emit(error_stripped)
-                        # 检测是否为detected: 0
-                        if "running: 0 | detected: 0" in error_stripped:
-                            message = "检测到detected: 0，需要对输入进行优化"
-                            self.log_signal.emit(message)
-                            process.terminate()
-                            return_code = 1
-                            message2 = "nebula_gpu 运行结束，未检测到有效数据，请优化输入"
-                            self.log_signal.emit(message2)
-                            return
-                        
-                        # 检测进度是否为100.00%
-                        if "Progress 100.00%" in error_stripped and not progress_completed:                       
-                            message = "检测到进度100.00%，将在20秒后终止进程并展示结果"
-                            self.log_signal.emit(message)
-                            progress_completed = True
-                            progress_100_time = time.time()
-                            
-                        # 如果已经检测到100%进度且已经过了5秒，则终止进程
-                        if progress_completed and progress_100_time is not None and time.time() - progress_100_time >= 20:
-                            message1 = "如果等待20秒完成，进程未自然结束，则终止进程并展示结果"
-                            self.log_signal.emit(message1)
-                            process.terminate()
-                            message2 = "nebula_gpu 运行成功！"
-                            self.log_signal.emit(message2)
-                            self.show_image()
-                            return
-
-            # 检查进程是否自然结束
-            if process.poll() is not None:
-                message2 = "nebula_gpu 运行成功！"
-                self.log_signal.emit(message2)
-                self.show_image()
-                break
+    def on_live_update(self, live):
+        counts, _, _ = live.image()
+        self.log_signal.emit(f"[实时] 已检测电子数: {live.total}")
+        self.live_signal.emit(counts)
 
-        # except Exception as e:
-        #     error_msg = f"调用 nebula_gpu 时发生异常: {str(e)}"
-        #     print(f"[ERROR] {error_msg}")  # 在终端打印异常信息
-        #     self.log_signal.emit(error_msg)
-            
-    def show_image(self):
-        # 自动调用 sem-analysis.py
+    def submit(self, command, output_file, job_id=None, devices=None):
+        """
+        提交一次运行，立即返回 concurrent.futures.Future。
+
+        devices 为 GPU 编号列表或 'auto'，为 None 时不指定 GPU，
+        见 AsyncSimulationRunner.use_devices。
+        """
+        # 默认以输出文件的绝对路径作为 job_id，写同一个 .det 的运行不能同时进行
+        job_id = os.path.abspath(output_file) if job_id is None else job_id
+        future = self.loop_thread.submit(self._run(command, output_file, job_id, devices))
+        future.add_done_callback(self._done)
+        return future
+
+    async def _run(self, command, output_file, job_id, devices=None):
+        # 同一输出文件的运行 (包括其后的图像分析) 结束前不接受新的运行，
+        # 也不删除正在运行的 nebula_gpu 仍在写入的输出文件
+        if job_id in self.active:
+            raise ValueError(f"{output_file} 的模拟仍在运行，请等待结束或先停止")
+        self.active.add(job_id)
         try:
-            self.log_signal.emit(f"开始调用 sem-analysis.py 展示图像，输出文件: {self.output_file}")
-            
-            # 定义脚本路径
-            import os
-            import sys
-            
-            # 获取当前脚本所在目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            primary_script_path = os.path.join(current_dir, "sem-analysis.py")
-            
-            # 如果当前目录下没有，则尝试使用相对路径
-            if not os.path.exists(primary_script_path):
-                primary_script_path = "sem-analysis.py"
-            
-            # 使用系统Python解释器
-            python_path = sys.executable
-            
-            # 检查主要路径是否存在
-            if not os.path.exists(primary_script_path):
-                self.log_signal.emit(f"未找到 sem-analysis.py，请确保该文件在当前目录或指定路径下")
-                return
+            return await self._run_job(command, output_file, job_id, devices)
+        finally:
+            self.active.discard(job_id)
+
+    async def _run_job(self, command, output_file, job_id, devices):
+        previous_pool = self.runner.device_pool
+        device_pool = await self.runner.use_devices(devices)
+        if device_pool is not None and device_pool is not previous_pool:
+            self.log_signal.emit(f"可用GPU: {', '.join(device_pool.devices)}")
+        # 删除上一次的输出，实时预览只读取本次运行写入的记录
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        live = DetFollower(output_file, interval=self.live_interval,
+                           on_update=self.on_live_update).start()
+        try:
+            task = self.runner.submit(command, output_file, job_id=job_id,
+                                      on_line=self.log_signal.emit, log=self.log_signal.emit,
+                                      on_event=self.progress_signal.emit)
+            result = await task
+        finally:
+            live.stop()
+        if result['device'] is not None:
+            self.log_signal.emit(f"使用GPU: {result['device']}")
+        self.log_signal.emit(f"用时 {result['wall_time']:.1f}s, 检测电子数: {result['detected']}")
+        if not is_successful(result):
+            self.log_signal.emit(
+                f"nebula_gpu 运行失败，状态码: {result['return_code']}, 状态: {result['status']}")
+            return result
+        self.log_signal.emit("nebula_gpu 运行成功！")
+        await run_sem_analysis_script(output_file, self.log_signal.emit)
+        return result
+
+    def _done(self, future):
+        if future.cancelled():
+            self.finished_signal.emit({'cancelled': True})
+        elif future.exception() is not None:
+            error = future.exception()
+            if isinstance(error, asyncio.CancelledError):
+                self.finished_signal.emit({'cancelled': True})
             else:
-                script_path = primary_script_path
-                
-            analysis_process = subprocess.Popen(
-                [python_path, script_path, self.output_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=0
-            )
-            for output in analysis_process.stdout:
-                if output:
-                    output_stripped = output.strip()
-                    self.log_signal.emit(output_stripped)
-            
-            # 过滤GTK警告信息
-            for error in analysis_process.stderr:
-                if error:
-                    error_stripped = error.strip()
-                    # 过滤掉GTK相关的警告信息
-                    if not ("Gtk-CRITICAL" in error_stripped or 
-                            "gtk_tree_view_scroll_to_cell" in error_stripped or
-                            "assertion" in error_stripped):
-                        self.log_signal.emit(error_stripped)
-            analysis_process.wait()
-            self.log_signal.emit(f"sem-analysis.py 执行完成，返回码: {analysis_process.returncode}")
-        except Exception as e:
-            error_msg = f"调用 sem-analysis.py 时发生异常: {str(e)}"
-            self.log_signal.emit(error_msg)
-       
+                self.finished_signal.emit({'error': str(error)})
+        else:
+            self.finished_signal.emit(future.result())
+
+    def cancel(self, job_id):
+        self.loop_thread.call(self.runner.cancel, job_id)
+
+    def cancel_all(self):
+        self.loop_thread.call(self.runner.cancel_all)
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        取消所有运行并等待 nebula_gpu 进程结束，然后停止事件循环 (阻塞，最长约 2 * timeout 秒)。
+        """
+        self.loop_thread.shutdown(self.runner.shutdown(), timeout)
+
 class PriGeneratorWorker(QThread):
     """工作线程，仅用于生成.pri文件"""
     progress_signal = pyqtSignal(str)
@@ -796,6 +946,8 @@ class PriGeneratorWorker(QThread):
             roi_x_max = self.params['roi_x_max']
             roi_y_min = self.params['roi_y_min']
             roi_y_max = self.params['roi_y_max']
+            seed = self.params.get('seed')
+            cache_dir = self.params.get('cache_dir')
             
             
             self.progress_signal.emit("正在生成.pri文件...")
@@ -821,7 +973,33 @@ class PriGeneratorWorker(QThread):
                 # 计算束的z位置，使用tri类传出的d_zmax和d_zmin值
                 beam_zmax = (self.d_zmax + self.d_zmin) / 2
                 self.progress_signal.emit(f"束z位置: {beam_zmax}")
-                
+
+                # 固定随机种子且参数未变化时直接复用缓存的.pri文件；不固定种子时每次生成新的随机实现
+                cache = None
+                if cache_dir is not None:
+                    if seed is None:
+                        self.progress_signal.emit("未固定随机种子，不使用.pri缓存")
+                    else:
+                        cache = PriCache(cache_dir,
+                                         self.params.get('cache_max_bytes', DEFAULT_MAX_BYTES))
+                        cache_key = pri_cache_key(
+                            roi=[roi_x_min, roi_x_max, roi_y_min, roi_y_max],
+                            pixel_size=pixel_size,
+                            energy=energy,
+                            epx=epx,
+                            sigma=sigma,
+                            poisson=poisson,
+                            z=beam_zmax,
+                            direction=beam_incident_dir.tolist(),
+                            seed=seed,
+                            mode='vectorized',
+                        )
+                if cache is not None and cache.fetch(cache_key, pri_file_path):
+                    self.pri_file_path = str(pri_file_path)
+                    self.progress_signal.emit(f"✅复用缓存的.pri文件: {self.pri_file_path}")
+                    self.finished_signal.emit(True, "复用缓存的.pri文件", self.pri_file_path)
+                    return
+
                 generate_sem_pri_data(
                     z=beam_zmax,  # 使用tri类传出的d_zmax值计算的beam_zmax
                     xpx=xpx,
@@ -833,12 +1011,16 @@ class PriGeneratorWorker(QThread):
                     dx=beam_incident_dir[0],
                     dy=beam_incident_dir[1],
                     dz=beam_incident_dir[2],
-                    file_path=pri_file_path
+                    file_path=pri_file_path,
+                    vectorized=True,
+                    seed=seed
                 )
                 
                 # 验证.pri文件是否成功生成
                 if not pri_file_path.exists():
                     raise Exception("未生成.pri文件")
+                if cache is not None:
+                    cache.store(cache_key, pri_file_path)
                 
                 self.pri_file_path = str(pri_file_path)
                 
@@ -919,10 +1101,10 @@ class TriGeneratorWorker(QThread):
                 self.tri_file_path = str(tri_file_path)
                 
                 # 计算像素范围
-                x_min = int(torch.floor(torch.min(v[:, 0])).item())
-                x_max = int(torch.ceil(torch.max(v[:, 0])).item())   
-                y_min = int(torch.floor(torch.min(v[:, 1])).item())
-                y_max = int(torch.ceil(torch.max(v[:, 1])).item())   
+                x_min = int(np.floor(float(v[:, 0].min())))
+                x_max = int(np.ceil(float(v[:, 0].max())))   
+                y_min = int(np.floor(float(v[:, 1].min())))
+                y_max = int(np.ceil(float(v[:, 1].max())))   
                 
                 self.progress_signal.emit(f"x_min, x_max, y_min, y_max = {x_min}, {x_max}, {y_min}, {y_max}")
                 
@@ -0,0 +1,285 @@
+import os
+import pathlib
+import platform
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from progress_events import ProgressParser
+
+"""
+nebula_gpu 进程启动器
+
+直接以参数列表启动 nebula_gpu，不经过 shell: 路径中的空格和引号不需要转义，
+也不会多出一个 shell 进程。.det 文件由本进程打开后作为子进程的 stdout，
+nebula_gpu 直接写入该文件描述符，不经过管道和 Python 中转。
+stderr 逐行读取，由 progress_events.ProgressParser 解析为进度事件，用于显示进度和判断运行状态。
+
+进度达到 100% 后，nebula_gpu 有时不会自行退出。CompletionWatcher 轮询 .det 文件大小，
+当没有正在模拟的电子 (running: 0) 且 .det 在 grace 秒内不再增长时，认为输出已经写完，
+先发送 SIGINT 等待进程自行退出；finish_timeout 后仍未退出才发送 SIGTERM。
+文件大小不变并不能保证 stdout 缓冲已经写出，因此运行结束后还要求 .det 按记录对齐，
+否则状态为 'truncated'。
+"""
+
+# .pri 和 .det 中每个电子记录的字节数
+PRI_RECORD_SIZE = 36
+
+# 检测到 100% 进度后，等待进程自行结束的最长时间 (秒)
+FINISH_TIMEOUT = 20
+
+# running 为 0 后 .det 大小保持不变多久即认为输出已写完 (秒)
+COMPLETION_GRACE = 2.0
+
+# 检查 .det 大小的间隔 (秒)
+COMPLETION_POLL_INTERVAL = 0.25
+
+
+def build_argv(nebula_gpu_path, tri_path, pri_path, mat_paths):
+    """nebula_gpu 参数列表: [nebula_gpu, sem.tri, sem.pri, a.mat, b.mat, ...]。"""
+    return [str(nebula_gpu_path), str(tri_path), str(pri_path)] + [str(path) for path in mat_paths]
+
+
+def format_argv(argv, det_path=None):
+    """把参数列表格式化为便于阅读和复制的命令行，仅用于日志。"""
+    if platform.system() == 'Windows':
+        text = subprocess.list2cmdline(argv)
+    else:
+        text = shlex.join(argv)
+    if det_path is not None:
+        text += f' > {det_path}'
+    return text
+
+
+def _signal_process(process, sig):
+    """
+    向进程发送信号。POSIX 上 nebula_gpu 在独立的进程组中启动，信号发给整个进程组，
+    包装脚本启动的子进程也会一起结束，不会因为仍持有 stderr 管道而阻塞读取。
+    """
+    # subprocess.Popen 与 asyncio 的 Process 都可以使用
+    returncode = process.poll() if hasattr(process, 'poll') else process.returncode
+    if returncode is not None:
+        return
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+    elif sig in (signal.SIGTERM, signal.SIGINT):
+        process.terminate()
+    else:
+        process.kill()
+
+
+def interrupt(process):
+    _signal_process(process, signal.SIGINT)
+
+
+def terminate(process):
+    _signal_process(process, signal.SIGTERM)
+
+
+def kill(process):
+    _signal_process(process, signal.SIGKILL if os.name == 'posix' else signal.SIGTERM)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+class CompletionWatcher:
+    def __init__(self, process, det_path, parser, grace=COMPLETION_GRACE,
+                 finish_timeout=FINISH_TIMEOUT, poll_interval=COMPLETION_POLL_INTERVAL, log=print):
+        """
+        在进度达到 100% 后启动，判断模拟何时真正结束。
+
+        参数:
+            process: nebula_gpu 进程
+            det_path: 正在写入的 .det 文件
+            parser: ProgressParser，用于读取最新的 running 数量
+            grace: running 为 0 后 .det 大小保持不变的秒数，之后发送 SIGINT
+            finish_timeout: 最长等待秒数，超时后无论状态如何都发送 SIGTERM 终止进程
+            poll_interval: 检查间隔 (秒)
+            log: 状态信息的输出函数
+        """
+        self.process = process
+        self.det_path = det_path
+        self.parser = parser
+        self.grace = grace
+        self.finish_timeout = finish_timeout
+        self.poll_interval = poll_interval
+        self.log = log
+        self.status = None
+        self._thread = None
+        self._t_start = time.time()
+        self._last_size = _file_size(det_path)
+        self._stable_since = self._t_start
+
+    def check(self):
+        """检查一次，返回 'terminated' (超时)、'finished' (输出已写完) 或 None (继续等待)。"""
+        now = time.time()
+        size = _file_size(self.det_path)
+        if size != self._last_size:
+            self._last_size, self._stable_since = size, now
+        if now - self._t_start >= self.finish_timeout:
+            return 'terminated'
+        last = self.parser.last
+        if last is not None and last.running == 0 and now - self._stable_since >= self.grace:
+            return 'finished'
+        return None
+
+    def step(self):
+        """
+        检查一次并在需要时结束进程，返回 True 表示已发送 SIGTERM、不必继续轮询。
+
+        输出写完后先发送 SIGINT，进程正常退出时会写出 stdout 缓冲；
+        等待 finish_timeout 后仍未退出才发送 SIGTERM。
+        """
+        status = self.check()
+        if status == 'finished' and self.status is None:
+            self.log(f"没有正在模拟的电子，且.det已{self.grace:g}秒未增长，发送中断信号等待进程退出")
+            self.status = status
+            interrupt(self.process)
+        elif status == 'terminated':
+            self.log(f"等待{self.finish_timeout:g}秒后进程仍未结束，终止进程并展示结果")
+            if self.status is None:
+                self.status = status
+            terminate(self.process)
+            return True
+        return False
+
+    def start(self):
+        """在后台线程中轮询 (用于 subprocess.Popen)。"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while self.process.poll() is None:
+            if self.step():
+                return
+            time.sleep(self.poll_interval)
+
+
+def check_det_records(det_path, status, log=print):
+    """
+    运行结束后检查 .det 是否按记录对齐。按成功结束的状态不对齐时说明输出被截断
+    (例如进程被终止时 stdout 缓冲没有写出)，返回 'truncated'，否则原样返回 status。
+    """
+    size = _file_size(det_path)
+    if status in ('completed', 'finished', 'terminated') and size % PRI_RECORD_SIZE != 0:
+        log(f"{det_path} 大小为 {size} 字节，不是 {PRI_RECORD_SIZE} 字节记录的整数倍，输出不完整")
+        return 'truncated'
+    return status
+
+
+def is_successful(result):
+    """
+    判断一次运行 (launch 或 async_runner.run_simulation 的返回值) 是否成功。
+
+    进程自行结束 ('completed') 时要求退出码为 0；进度达到 100% 后由启动器终止的进程
+    ('finished' 确认输出写完，'terminated' 等待 finish_timeout 后仍未结束) 视为成功，
+    这是 nebula_gpu 不自行退出时的正常结束方式。'no_detection'、'timeout'、
+    'truncated' (.det 未按记录对齐) 以及运行异常 (result 为 None) 均为失败。
+    """
+    if result is None:
+        return False
+    if result['status'] in ('finished', 'terminated'):
+        return True
+    return result['status'] == 'completed' and result['return_code'] == 0
+
+
+def progress_parser(argv, start_time, on_event=None):
+    """创建 ProgressParser，初级电子总数由参数列表中 .pri 文件的大小得到。"""
+    total_primaries = None
+    if len(argv) > 2 and os.path.isfile(argv[2]):
+        total_primaries = os.path.getsize(argv[2]) // PRI_RECORD_SIZE
+    parser = ProgressParser(total_primaries=total_primaries, start_time=start_time)
+    if on_event is not None:
+        parser.subscribe(on_event)
+    return parser
+
+
+def launch(argv, det_path, cwd=None, env=None, on_line=print, log=print,
+           finish_timeout=FINISH_TIMEOUT, on_event=None, completion_grace=COMPLETION_GRACE):
+    """
+    运行 nebula_gpu 并把 stdout 写入 det_path，阻塞到进程结束。
+
+    参数:
+        argv: build_argv 生成的参数列表
+        det_path: 输出 .det 文件路径 (会被覆盖)
+        cwd: 工作目录
+        env: 环境变量，为 None 时继承当前进程
+        on_line: 每行 stderr 的回调
+        log: 状态信息的输出函数 (print 或 GUI 的日志信号)
+        finish_timeout: 检测到 100% 进度后最长等待的秒数，超时则终止进程
+        on_event: 进度事件的回调，参数为 progress_events.ProgressEvent
+        completion_grace: 进度 100% 且 running 为 0 后，.det 保持不变多少秒即终止进程
+
+    返回:
+        dict: return_code (退出码), wall_time (秒), detected (最后报告的检测电子数),
+              detected_rate / primary_rate (每秒检测电子数 / 每秒初级电子数),
+              status ('completed' 自行结束, 'finished' 确认输出写完后中断,
+                      'terminated' 100% 后超时终止, 'no_detection' 未检测到电子,
+                      'truncated' .det 未按记录对齐)
+    """
+    t_start = time.time()
+    det_path = pathlib.Path(det_path)
+    status = 'completed'
+    parser = progress_parser(argv, t_start, on_event)
+    with open(det_path, 'wb') as det_file:
+        process = subprocess.Popen(
+            argv,
+            stdout=det_file,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=(os.name == 'posix'),
+            universal_newlines=True,
+            bufsize=1  # 行缓冲
+        )
+        watcher = None
+        try:
+            for line in process.stderr:
+                line = line.strip()
+                if on_line is not None:
+                    on_line(line)
+                event = parser.feed(line)
+
+                if event is not None and event.no_detection:
+                    log("检测到detected: 0，需要对输入进行优化")
+                    terminate(process)
+                    log("nebula_gpu 运行结束，未检测到有效数据，请优化输入")
+                    status = 'no_detection'
+                    break
+
+                if event is not None and event.complete and watcher is None:
+                    log("检测到进度100.00%，等待剩余电子模拟完成和输出写完")
+                    watcher = CompletionWatcher(process, det_path, parser, grace=completion_grace,
+                                                finish_timeout=finish_timeout, log=log).start()
+        except BaseException:
+            # 被中断时不留下失控的模拟进程
+            kill(process)
+            raise
+        finally:
+            return_code = process.wait()
+            process.stderr.close()
+    if watcher is not None and watcher.status is not None and status == 'completed':
+        status = watcher.status
+    status = check_det_records(det_path, status, log)
+    last = parser.last
+    return {
+        'argv': argv,
+        'det_path': det_path,
+        'return_code': return_code,
+        'wall_time': time.time() - t_start,
+        'detected': last.detected if last else None,
+        'detected_rate': last.detected_rate if last else None,
+        'primary_rate': last.primary_rate if last else None,
+        'status': status,
+    }
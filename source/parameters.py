@@ -1,6 +1,9 @@
 import numpy as np
 from voxel_to_mesh import run_interface
-from sem_pri import generate_sem_pri_data
+from sem_pri import generate_sem_pri_data, generate_sem_pri_data_parallel
+from pri_stream import PriStream
+from pri_cache import PriCache, pri_cache_key, DEFAULT_MAX_BYTES
+from atomic_output import atomic_output
 import pathlib
 class tri_parameters:
     def __init__(self, stl_path, mesh_path, beam_type, sample_tilt_x, sample_tilt_y, sample_tilt_new_z, det_tilt_x):
@@ -54,9 +57,20 @@ class pri_parameters:
         roi_y_max (float): ROI 的 Y 轴最大值。
         d_zmin (float): Z 轴最小值。
         d_zmax (float): Z 轴最大值。
+        vectorized (bool): 是否使用整幅向量化模式生成 .pri。
+        seed (int): 随机种子，固定后输出可复现。
+        workers (int): 生成 .pri 的进程数，大于 1 时按行带多进程并行生成。
+        stream (bool): 是否通过命名管道流式输出 .pri，不在磁盘上生成文件。
+            每次运行只能被 nebula_gpu 读取一次，模拟结束后需调用 pri_stream.close()，
+            再调用 pri_stream.check() 确认输出完整。
+        cache_dir (pathlib.Path): .pri 缓存目录，为 None 时不使用缓存；
+            seed 为 None 时同样不使用缓存，每次都生成新的随机实现。
+        cache_max_bytes (int): .pri 缓存总大小上限 (字节)。
     """
     def __init__(self, pri_dir, pixel_size, energy, epx, sigma, poisson,
-                 roi_x_min, roi_x_max, roi_y_min, roi_y_max, d_zmin, d_zmax):
+                 roi_x_min, roi_x_max, roi_y_min, roi_y_max, d_zmin, d_zmax,
+                 vectorized=True, seed=None, workers=1, stream=False,
+                 cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES):
         
         self.pri_dir = pri_dir
         self.pixel_size = pixel_size
@@ -70,6 +84,13 @@ class pri_parameters:
         self.roi_y_max = roi_y_max
         self.d_zmin = d_zmin
         self.d_zmax = d_zmax
+        self.vectorized = vectorized
+        self.seed = seed
+        self.workers = workers
+        self.stream = stream
+        self.pri_stream = None
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
 
     def run(self):
         # 计算像素数量
@@ -94,20 +115,87 @@ class pri_parameters:
             beam_zmax = (self.d_zmax + self.d_zmin) / 2
             print(f"束z位置: {beam_zmax}")
             
-            generate_sem_pri_data(
-                z=beam_zmax,  # 使用tri类传出的d_zmax值计算的beam_zmax
-                xpx=xpx,
-                ypx=ypx,
-                energy=self.energy,
-                epx=self.epx,
-                sigma=self.sigma,
-                poisson=self.poisson,
-                dx=beam_incident_dir[0],
-                dy=beam_incident_dir[1],
-                dz=beam_incident_dir[2],
-                file_path=pri_file_path
-            )
-            
+            if self.stream:
+                self.pri_stream = PriStream(
+                    pathlib.Path(self.pri_dir)/'sem.pri.fifo',
+                    z=beam_zmax,
+                    xpx=xpx,
+                    ypx=ypx,
+                    energy=self.energy,
+                    epx=self.epx,
+                    sigma=self.sigma,
+                    poisson=self.poisson,
+                    dx=beam_incident_dir[0],
+                    dy=beam_incident_dir[1],
+                    dz=beam_incident_dir[2],
+                    seed=self.seed
+                )
+                pri_file_path = pathlib.Path(self.pri_stream.start())
+                print(f"已创建.pri命名管道，路径: {pri_file_path}")
+                return pri_file_path
+
+            parallel = self.workers is not None and self.workers > 1
+            cache = None
+            if self.cache_dir is not None and self.seed is None:
+                print("未固定随机种子，不使用.pri缓存")
+            elif self.cache_dir is not None:
+                cache = PriCache(self.cache_dir, self.cache_max_bytes)
+                cache_key = pri_cache_key(
+                    roi=[self.roi_x_min, self.roi_x_max, self.roi_y_min, self.roi_y_max],
+                    pixel_size=self.pixel_size,
+                    energy=self.energy,
+                    epx=self.epx,
+                    sigma=self.sigma,
+                    poisson=self.poisson,
+                    z=beam_zmax,
+                    direction=beam_incident_dir.tolist(),
+                    seed=self.seed,
+                    mode='parallel' if parallel else ('vectorized' if self.vectorized else 'pixel'),
+                )
+
+            # 先生成到临时文件，完成后再重命名为 sem.pri，同时运行的模拟不会读到不完整的文件
+            with atomic_output(pri_file_path) as tmp_path:
+                cached = cache is not None and cache.fetch(cache_key, tmp_path)
+                if not cached:
+                    if parallel:
+                        generate_sem_pri_data_parallel(
+                            z=beam_zmax,
+                            xpx=xpx,
+                            ypx=ypx,
+                            energy=self.energy,
+                            epx=self.epx,
+                            sigma=self.sigma,
+                            poisson=self.poisson,
+                            dx=beam_incident_dir[0],
+                            dy=beam_incident_dir[1],
+                            dz=beam_incident_dir[2],
+                            file_path=tmp_path,
+                            seed=self.seed,
+                            workers=self.workers
+                        )
+                    else:
+                        generate_sem_pri_data(
+                            z=beam_zmax,  # 使用tri类传出的d_zmax值计算的beam_zmax
+                            xpx=xpx,
+                            ypx=ypx,
+                            energy=self.energy,
+                            epx=self.epx,
+                            sigma=self.sigma,
+                            poisson=self.poisson,
+                            dx=beam_incident_dir[0],
+                            dy=beam_incident_dir[1],
+                            dz=beam_incident_dir[2],
+                            file_path=tmp_path,
+                            vectorized=self.vectorized,
+                            seed=self.seed
+                        )
+
+            if cached:
+                print(f"复用缓存的.pri文件，路径: {pri_file_path}")
+                return pri_file_path
+            if cache is not None:
+                cache.store(cache_key, pri_file_path)
+
             print(f"生成.pri文件成功，路径: {pri_file_path}")
             
             return pri_file_path
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+"""
+.pri 文件缓存
+
+以束参数 (ROI、像素大小、能量、epx、sigma、泊松、z、随机种子等) 的哈希作为键，
+把生成好的 .pri 文件保存在缓存目录中。命中时通过硬链接(跨文件系统时复制)复用缓存文件，
+跳过耗时的生成步骤。缓存总大小超过上限时按最近使用时间(LRU)淘汰。
+"""
+
+DEFAULT_CACHE_DIR = pathlib.Path.home() / '.cache' / 'nebula_python_wrapper' / 'pri'
+DEFAULT_MAX_BYTES = 50 * 1024**3  # 50 GB
+
+# 参数含义或文件格式变化时递增，使旧缓存失效
+CACHE_VERSION = 1
+
+
+def pri_cache_key(**params):
+    """由束参数计算缓存键 (sha256)。numpy 标量会先转换为 Python 数值。"""
+    normalized = {k: (v.item() if hasattr(v, 'item') else v) for k, v in params.items()}
+    normalized['_version'] = CACHE_VERSION
+    text = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    dst = pathlib.Path(dst)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class PriCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限 (字节)
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def entry_path(self, key):
+        return self.cache_dir / f'{key}.pri'
+
+    def fetch(self, key, dest):
+        """命中时把缓存文件链接到 dest 并返回 True，否则返回 False。"""
+        entry = self.entry_path(key)
+        if not entry.exists():
+            return False
+        # 更新修改时间作为最近使用时间
+        os.utime(entry)
+        _link_or_copy(entry, dest)
+        print(f"命中.pri缓存: {entry}")
+        return True
+
+    def store(self, key, src):
+        """把新生成的 src 放入缓存，然后按 LRU 淘汰超出上限的条目。"""
+        entry = self.entry_path(key)
+        # 临时文件名包含进程号，多个进程同时写入同一条目时互不干扰
+        tmp = entry.with_suffix(f'.{os.getpid()}.tmp')
+        _link_or_copy(src, tmp)
+        os.replace(tmp, entry)
+        os.utime(entry)
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep=None):
+        """删除最久未使用的条目，直到缓存总大小不超过 max_bytes。"""
+        entries = sorted(self.cache_dir.glob('*.pri'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        for p in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and p == keep:
+                continue
+            total -= p.stat().st_size
+            p.unlink()
+            print(f"淘汰.pri缓存: {p}")
+        return total
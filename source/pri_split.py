@@ -0,0 +1,270 @@
+import argparse
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from atomic_output import atomic_output
+from gpu_pool import DevicePool, device_env
+from nebula_launcher import build_argv, is_successful
+from run_nebula import nebula_gpu
+from sem_pri import electron_dtype
+
+"""
+把一个大 .pri 拆分给多个 nebula_gpu 同时模拟，再合并 .det
+
+nebula_gpu 对每个初级电子独立模拟，.det 中的记录只与对应的初级电子有关，
+因此把 .pri 的电子记录分成 N 份分别模拟，再把 N 个 .det 拼接起来，
+得到的图像统计上与一次模拟整个 .pri 相同。
+
+拆分方式:
+    records: 按记录数平均分成 N 段连续的字节范围 (按 36 字节记录对齐)
+    rows: 按像素行 (px) 分成 N 个行带，每份包含完整的像素行；
+          要求 .pri 按 px 递增排列 (sem_pri 生成的文件满足)
+
+多节点运行时，在共享文件系统上执行 split，各节点分别模拟自己的分片，最后执行 merge:
+    python pri_split.py split sem.pri -n 4
+    nebula_gpu sem.tri sem_split/sem.part0.pri a.mat > sem_split/sem.part0.det   (每个节点一个分片)
+    python pri_split.py merge output.det sem_split/sem.part*.det
+"""
+
+COPY_BUFFER = 64 * 1024**2  # 复制文件时每次读写 64 MB
+
+
+def _copy_range(src, dst, offset, length):
+    """把 src 中 [offset, offset+length) 的字节写到已打开的 dst。"""
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(COPY_BUFFER, length))
+        if not data:
+            break
+        dst.write(data)
+        length -= len(data)
+
+
+def _row_start(px, i):
+    """二分查找记录 i 所在像素行的第一条记录，只访问 O(log n) 条记录。"""
+    target = px[i]
+    lo, hi = 0, i
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if px[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def split_boundaries(pri_path, parts, mode='records'):
+    """
+    计算分片边界 (记录下标)。
+
+    返回:
+        list: 长度为 parts+1 的递增记录下标，第 k 份为 [bounds[k], bounds[k+1])
+    """
+    n = os.path.getsize(pri_path) // electron_dtype.itemsize
+    bounds = np.linspace(0, n, parts + 1).round().astype(np.int64)
+    if mode == 'records' or n == 0:
+        return bounds.tolist()
+    if mode != 'rows':
+        raise ValueError(f"未知的拆分方式: {mode}")
+    # px 单调递增，把每个边界移到所在像素行的起点
+    px = np.memmap(pri_path, dtype=electron_dtype, mode='r', shape=(n,))['px']
+    for k in range(1, parts):
+        if bounds[k] < n:
+            bounds[k] = _row_start(px, bounds[k])
+    return np.maximum.accumulate(bounds).tolist()
+
+
+def split_pri(pri_path, parts, out_dir=None, mode='records'):
+    """
+    把 .pri 拆分为 parts 个分片文件 {stem}.part{k}.pri
+
+    参数:
+        pri_path: 输入 .pri 文件
+        parts: 分片数量
+        out_dir: 分片目录，默认为 .pri 旁边的 {stem}_split 目录
+        mode: 'records' 或 'rows'
+
+    返回:
+        list: 分片文件路径 (空分片不生成文件)
+    """
+    pri_path = pathlib.Path(pri_path)
+    if out_dir is None:
+        out_dir = pri_path.parent / f'{pri_path.stem}_split'
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    bounds = split_boundaries(pri_path, parts, mode)
+    part_paths = []
+    with open(pri_path, 'rb') as src:
+        for k in range(parts):
+            start, stop = bounds[k], bounds[k + 1]
+            if stop <= start:
+                continue
+            part_path = out_dir / f'{pri_path.stem}.part{k}.pri'
+            with atomic_output(part_path) as tmp_path, open(tmp_path, 'wb') as dst:
+                _copy_range(src, dst, start * electron_dtype.itemsize,
+                            (stop - start) * electron_dtype.itemsize)
+            part_paths.append(part_path)
+            print(f"分片 {k}: 电子 {start} - {stop} ({stop - start} 个) -> {part_path}")
+    return part_paths
+
+
+def merge_det(det_paths, out_path):
+    """
+    按顺序拼接多个 .det 为一个文件。每个文件末尾不完整的记录 (进程被终止时可能出现) 会被丢弃。
+
+    返回:
+        int: 合并后的记录数
+    """
+    total = 0
+    with atomic_output(out_path) as tmp_path, open(tmp_path, 'wb') as dst:
+        for det_path in det_paths:
+            records = os.path.getsize(det_path) // electron_dtype.itemsize
+            with open(det_path, 'rb') as src:
+                _copy_range(src, dst, 0, records * electron_dtype.itemsize)
+            total += records
+    print(f"已合并 {len(det_paths)} 个.det文件，共 {total} 条记录 -> {out_path}")
+    return total
+
+
+def _absolute_executable(path):
+    """可执行文件路径含目录时转换为绝对路径；只有命令名时保持不变，仍按 PATH 查找。"""
+    text = str(path)
+    if os.sep in text or (os.altsep and os.altsep in text):
+        return pathlib.Path(text).resolve()
+    return pathlib.Path(text)
+
+
+def simulate_split(nebula_gpu_path, tri_path, pri_path, mat_paths, det_path, parts,
+                   mode='records', devices=None, work_dir=None, keep_parts=False):
+    """
+    在本机把 .pri 拆分为 parts 份，同时运行 parts 个 nebula_gpu，再合并为 det_path。
+
+    参数:
+        devices: GPU 编号列表或 'auto'，每个分片使用一块空闲 GPU；为 None 时不指定设备
+        work_dir: 分片的工作目录，默认为 det_path 旁边的 {stem}_split 目录
+        keep_parts: 是否保留分片 .pri/.det
+
+    返回:
+        dict: det_path, 各分片的退出码, 合并后的记录数, 用时
+    """
+    t_start = time.time()
+    # nebula_gpu 在 work_dir 中运行，参数中的相对路径要先转换为绝对路径
+    det_path = pathlib.Path(det_path).resolve()
+    if work_dir is None:
+        work_dir = det_path.parent / f'{det_path.stem}_split'
+    work_dir = pathlib.Path(work_dir).resolve()
+    nebula_gpu_path = _absolute_executable(nebula_gpu_path)
+    tri_path = pathlib.Path(tri_path).resolve()
+    mat_paths = [pathlib.Path(path).resolve() for path in mat_paths]
+    part_pris = split_pri(pathlib.Path(pri_path).resolve(), parts, work_dir, mode)
+    pool = DevicePool(None if devices == 'auto' else devices) if devices is not None else None
+
+    def run_part(part_pri):
+        part_det = part_pri.with_suffix('.det')
+        command = build_argv(nebula_gpu_path, tri_path, part_pri, mat_paths)
+        runner = dict(command=command, sem_simu_result=part_det, image_path=None, analyze=False,
+                      cwd=work_dir)
+        if pool is None:
+            simulation = nebula_gpu(**runner)
+            return_code = simulation.run()
+        else:
+            with pool.device() as device:
+                simulation = nebula_gpu(env=device_env(device), **runner)
+                return_code = simulation.run()
+        return return_code, simulation.result
+
+    with ThreadPoolExecutor(len(part_pris) or 1) as executor:
+        outcomes = list(executor.map(run_part, part_pris))
+    return_codes = [code for code, _ in outcomes]
+    statuses = [result['status'] if result is not None else None for _, result in outcomes]
+    # 一个分片的电子全部没有到达探测器时，它的结果就是空 .det；全部分片都没有检测到电子才算失败
+    if statuses and all(status == 'no_detection' for status in statuses):
+        raise RuntimeError("所有分片都没有检测到电子，未合并 .det")
+    for part_pri, status in zip(part_pris, statuses):
+        if status == 'no_detection':
+            part_pri.with_suffix('.det').write_bytes(b'')
+    # 成功的判断与 run_nebula 相同，见 nebula_launcher.is_successful
+    failed = [(part_pri.name, code, status)
+              for part_pri, (code, result), status in zip(part_pris, outcomes, statuses)
+              if status != 'no_detection' and not is_successful(result)]
+    if failed:
+        # 不合并不完整的结果，保留分片文件便于检查
+        raise RuntimeError(
+            f"{len(failed)} 个分片模拟失败 (分片, 退出码, 状态): {failed}，未合并 .det")
+
+    part_dets = [p.with_suffix('.det') for p in part_pris]
+    total = merge_det(part_dets, det_path)
+    if not keep_parts:
+        for path in part_pris + part_dets:
+            path.unlink(missing_ok=True)
+        try:
+            work_dir.rmdir()
+        except OSError:
+            pass
+    if pool is not None:
+        pool.report()
+    return {
+        'det_path': det_path,
+        'return_codes': return_codes,
+        'records': total,
+        'sim_time': time.time() - t_start,
+    }
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(
+        description='Split a .pri across several nebula_gpu runs and merge the .det outputs')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    split = sub.add_parser('split', help='Split a .pri into N part files')
+    split.add_argument('pri', help='Path to input .pri file')
+    split.add_argument('-n', '--parts', type=int, required=True, help='Number of parts')
+    split.add_argument('--mode', choices=['records', 'rows'], default='records',
+                       help='Split by record count or by pixel rows')
+    split.add_argument('--out-dir', help='Directory for part files; default: <pri stem>_split')
+
+    merge = sub.add_parser('merge', help='Concatenate part .det files into one')
+    merge.add_argument('output', help='Path to merged .det file')
+    merge.add_argument('parts', nargs='+', help='Part .det files')
+
+    run = sub.add_parser('run', help='Split, simulate all parts locally and merge')
+    run.add_argument('nebula_gpu', help='Path to nebula_gpu executable')
+    run.add_argument('tri', help='Path to .tri file')
+    run.add_argument('pri', help='Path to .pri file')
+    run.add_argument('output', help='Path to merged .det file')
+    run.add_argument('mat', nargs='+', help='Material .mat files')
+    run.add_argument('-n', '--parts', type=int, required=True, help='Number of parts')
+    run.add_argument('--mode', choices=['records', 'rows'], default='records',
+                     help='Split by record count or by pixel rows')
+    run.add_argument('--devices', help="Comma-separated GPU ids, or 'auto'")
+    run.add_argument('--keep-parts', action='store_true', help='Keep part .pri/.det files')
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    if args.command == 'split':
+        split_pri(args.pri, args.parts, args.out_dir, args.mode)
+    elif args.command == 'merge':
+        merge_det(args.parts, args.output)
+    else:
+        devices = args.devices
+        if devices is not None and devices != 'auto':
+            devices = devices.split(',')
+        try:
+            result = simulate_split(args.nebula_gpu, args.tri, args.pri, args.mat, args.output,
+                                    args.parts, mode=args.mode, devices=devices,
+                                    keep_parts=args.keep_parts)
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        print(f"分片模拟完成! 用时 {result['sim_time']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import os
+import queue
+import threading
+import time
+
+from sem_pri import iter_sem_pri_blocks
+
+"""
+流式 .pri 输出
+
+创建命名管道(FIFO)，在 nebula_gpu 读取的同时把电子记录写入管道，
+不再先把完整的 sem.pri 写到磁盘。生成线程与写管道线程之间使用有界队列，
+当模拟器读取较慢时生成线程会被阻塞(背压)，内存占用不超过 queue_size 个数据块。
+数据块也可以来自已有的压缩 .pri (blocks=record_pack.iter_blocks(path))，边解压边模拟。
+
+仅支持提供 os.mkfifo 的 POSIX 系统。
+"""
+
+
+class PriStream:
+    def __init__(self, fifo_path, queue_size=4, blocks=None, **pri_kwargs):
+        """
+        参数:
+            fifo_path: 命名管道路径，作为 .pri 文件路径传给 nebula_gpu
+            queue_size: 有界队列中最多缓存的数据块数量
+            blocks: 电子记录数组的迭代器 (例如 record_pack.iter_blocks)，指定时不再生成电子
+            pri_kwargs: 传给 iter_sem_pri_blocks 的参数 (z, xpx, ypx, energy, epx, ...)
+        """
+        self.fifo_path = str(fifo_path)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.blocks = blocks
+        self.pri_kwargs = pri_kwargs
+        self.total_electrons = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._connected = threading.Event()
+        self._producer = None
+        self._writer = None
+
+    def start(self):
+        """创建命名管道并启动生成线程和写管道线程，返回管道路径。"""
+        if not hasattr(os, 'mkfifo'):
+            raise RuntimeError("流式 .pri 需要命名管道，仅支持 POSIX 系统")
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
+        os.mkfifo(self.fifo_path)
+
+        self._producer = threading.Thread(target=self._produce, daemon=True)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._producer.start()
+        self._writer.start()
+        return self.fifo_path
+
+    def _put(self, item):
+        # 队列满时等待，同时响应停止请求
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            if self.blocks is None:
+                buffers = (buffer for _, buffer in iter_sem_pri_blocks(**self.pri_kwargs))
+            else:
+                buffers = self.blocks
+            for buffer in buffers:
+                if not self._put(buffer):
+                    return
+        except Exception as e:
+            self.error = e
+            self._stop.set()
+        finally:
+            self._put(None)
+
+    def _write(self):
+        try:
+            # 打开管道写端会阻塞，直到模拟器打开读端
+            with open(self.fifo_path, 'wb') as fifo:
+                self._connected.set()
+                while not self._stop.is_set():
+                    try:
+                        buffer = self.queue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if buffer is None:
+                        break
+                    fifo.write(buffer.data)
+                    self.total_electrons += len(buffer)
+        except BrokenPipeError:
+            # 模拟器提前退出或被终止
+            print("[WARNING] nebula_gpu 已关闭 .pri 管道，停止流式输出")
+        except Exception as e:
+            self.error = e
+        finally:
+            self._stop.set()
+
+    def join(self, timeout=None):
+        """等待流式输出结束。"""
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in (self._producer, self._writer):
+            if thread is not None:
+                thread.join(None if deadline is None else max(0, deadline - time.time()))
+
+    def check(self):
+        """
+        等待两个线程结束，生成或写管道时发生过异常则重新抛出 (RuntimeError)。
+        模拟器读到的 .pri 在出错处被截断，调用方应把这次模拟视为失败。
+        """
+        self.join()
+        if self.error is not None:
+            raise RuntimeError(
+                f"流式 .pri 输出失败，nebula_gpu 读到的 .pri 不完整: {self.error}") from self.error
+
+    def close(self):
+        """停止输出并删除命名管道。不抛出线程中的异常，需要时之后调用 check()。"""
+        self._stop.set()
+        if self._writer is not None and not self._connected.is_set():
+            # 模拟器从未打开管道：打开读端以解除写线程在 open 上的阻塞
+            try:
+                fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+        self.join(timeout=5)
+        if os.path.exists(self.fifo_path):
+            os.remove(self.fifo_path)
@@ -2,13 +2,42 @@ import numpy as np
 from stl import mesh
 import os
 import sys
+import time
 import argparse
+from atomic_output import atomic_output
 
 # 常量定义
 SCALE_FACTOR = 20  # 坐标缩放因子
 POSITIVE_MARKER = "0 -123"  # 正向法向量标记
 NEGATIVE_MARKER = "-123 0"  # 负向法向量标记
-PROGRESS_INTERVAL = 10000  # 进度显示间隔
+CHUNK_TRIANGLES = 100000  # 每次格式化并写出的三角形数量，限制大网格的内存占用
+
+def triangle_markers(normals, num_triangles):
+    """
+    按法向量分量之和的符号确定每个三角形的标记，缺少法向量的三角形视为正向
+
+    返回:
+        np.ndarray: (num_triangles,) 的布尔数组，True 表示正向
+    """
+    positive = np.ones(num_triangles, dtype=bool)
+    count = min(len(normals), num_triangles)
+    positive[:count] = np.sum(normals[:count], axis=1) >= 0
+    return positive
+
+def write_tri_rows(f, markers, triangles):
+    """
+    批量写出一块三角形行 "标记 x1 y1 z1 x2 y2 z2 x3 y3 z3"
+
+    参数:
+        f: 已打开的文本文件
+        markers: (n,) 的布尔数组，True 为正向
+        triangles: (n, 9) 的顶点坐标数组 (已缩放)
+    """
+    row_format = '%s ' + ' '.join(['%.6f'] * 9) + '\n'
+    values = np.empty((len(triangles), 10), dtype=object)
+    values[:, 0] = np.where(markers, POSITIVE_MARKER, NEGATIVE_MARKER)
+    values[:, 1:] = triangles
+    f.write((row_format * len(triangles)) % tuple(values.ravel().tolist()))
 
 def process_stl_to_tri(input_path, output_path=None, scale_factor=SCALE_FACTOR):
     """
@@ -44,31 +73,21 @@ def process_stl_to_tri(input_path, output_path=None, scale_factor=SCALE_FACTOR):
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 打开输出文件
-        with open(output_path, 'w') as f:
-            # 处理每个三角形
-            for i, triangle in enumerate(stl_mesh.vectors):
-                # 获取法向量
-                normal = stl_mesh.normals[i] if i < len(stl_mesh.normals) else None
-                
-                # 确定法向量方向标记
-                marker = POSITIVE_MARKER if (normal is None or np.sum(normal) >= 0) else NEGATIVE_MARKER
-                
-                # 获取三角形的三个顶点坐标
-                v1, v2, v3 = triangle
-                
-                # 创建格式化的顶点字符串（应用缩放因子）
-                vertices_str = " ".join(f"{(coord * scale_factor):.6f}" for vertex in [v1, v2, v3] for coord in vertex)
-                
-                # 写入一行
-                line = f"{marker} {vertices_str}\n"
-                f.write(line)
-                
-                # 显示进度
-                if (i + 1) % PROGRESS_INTERVAL == 0:
-                    print(f"已处理 {i+1} 个三角形...")
+        t_start = time.time()
+        # 一次计算所有三角形的法向量方向标记，顶点展开为 (N, 9)
+        positive = triangle_markers(stl_mesh.normals, num_triangles)
+        vertices = stl_mesh.vectors.reshape(num_triangles, 9)
+        
+        # 按块缩放并写出，内存占用只与块大小有关；
+        # 先写临时文件，中断时不会留下看起来已是最新的不完整输出
+        with atomic_output(output_path) as tmp_path, open(tmp_path, 'w') as f:
+            for start in range(0, num_triangles, CHUNK_TRIANGLES):
+                stop = start + CHUNK_TRIANGLES
+                write_tri_rows(f, positive[start:stop], vertices[start:stop] * scale_factor)
         
-        print(f"转换完成! 输出文件: {output_path}")
+        elapsed = time.time() - t_start
+        rate = num_triangles / elapsed if elapsed > 0 else float('inf')
+        print(f"转换完成! 输出文件: {output_path}, 用时: {elapsed:.2f}s ({rate:.0f} 三角形/秒)")
         return num_triangles, output_path
         
     except Exception as e:
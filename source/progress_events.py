@@ -0,0 +1,166 @@
+import csv
+import re
+import time
+
+"""
+nebula_gpu 进度事件
+
+nebula_gpu 在 stderr 输出形如 "Progress 45.67% | running: 1234 | detected: 5678" 的进度行。
+ProgressParser 把这些行解析为 ProgressEvent (进度百分比、正在模拟的电子数、已检测电子数、速率)，
+并发布给所有订阅的回调；GUI、批量脚本和指标记录器使用同一个事件流，不再各自匹配字符串。
+
+用法:
+    parser = ProgressParser(total_primaries=n)
+    parser.subscribe(lambda event: print(event.percent))
+    for line in stderr:
+        parser.feed(line)
+"""
+
+PROGRESS_PATTERN = re.compile(r'Progress\s+([\d.]+)\s*%')
+RUNNING_PATTERN = re.compile(r'running:\s*(\d+)', re.IGNORECASE)
+DETECTED_PATTERN = re.compile(r'detected:\s*(\d+)', re.IGNORECASE)
+
+
+class ProgressEvent:
+    """
+    一条进度行对应的事件，行中没有出现的字段沿用上一条事件的值。
+
+    Attributes:
+        time (float): 事件时间 (time.time())
+        elapsed (float): 距离运行开始的秒数
+        percent (float): 进度百分比
+        running (int): 正在模拟的电子数
+        detected (int): 已检测电子数
+        detected_rate (float): 平均每秒检测电子数
+        primary_rate (float): 平均每秒完成的初级电子数，需要知道初级电子总数
+        line (str): 原始输出行
+    """
+    __slots__ = ('time', 'elapsed', 'percent', 'running', 'detected', 'detected_rate',
+                 'primary_rate', 'line')
+
+    def __init__(self, time, elapsed, percent, running, detected, detected_rate, primary_rate,
+                 line):
+        self.time = time
+        self.elapsed = elapsed
+        self.percent = percent
+        self.running = running
+        self.detected = detected
+        self.detected_rate = detected_rate
+        self.primary_rate = primary_rate
+        self.line = line
+
+    @property
+    def complete(self):
+        """进度已达到 100%。"""
+        return self.percent is not None and self.percent >= 100.0
+
+    @property
+    def no_detection(self):
+        """没有正在模拟的电子，也没有检测到任何电子，输入需要优化。"""
+        return self.running == 0 and self.detected == 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return (f"ProgressEvent(percent={self.percent}, running={self.running}, "
+                f"detected={self.detected}, detected_rate={self.detected_rate})")
+
+
+class ProgressParser:
+    def __init__(self, total_primaries=None, start_time=None):
+        """
+        参数:
+            total_primaries: .pri 中的初级电子总数，用于计算 primary_rate；未知时为 None
+            start_time: 运行开始时间，默认为创建解析器的时间
+        """
+        self.total_primaries = total_primaries
+        self.start_time = time.time() if start_time is None else start_time
+        self.listeners = []
+        self.last = None
+
+    def subscribe(self, callback):
+        """订阅事件，callback 参数为 ProgressEvent。返回 callback，便于之后取消订阅。"""
+        self.listeners.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.listeners.remove(callback)
+
+    def parse(self, line):
+        """解析一行，不是进度行时返回 None；不发布事件。"""
+        progress = PROGRESS_PATTERN.search(line)
+        running = RUNNING_PATTERN.search(line)
+        detected = DETECTED_PATTERN.search(line)
+        if progress is None and running is None and detected is None:
+            return None
+        last = self.last
+        now = time.time()
+        elapsed = now - self.start_time
+        percent = float(progress.group(1)) if progress else (last.percent if last else None)
+        detected_count = int(detected.group(1)) if detected else (last.detected if last else None)
+        detected_rate = None
+        if detected_count is not None and elapsed > 0:
+            detected_rate = detected_count / elapsed
+        primary_rate = None
+        if self.total_primaries is not None and percent is not None and elapsed > 0:
+            primary_rate = self.total_primaries * percent / 100.0 / elapsed
+        return ProgressEvent(
+            time=now,
+            elapsed=elapsed,
+            percent=percent,
+            running=int(running.group(1)) if running else (last.running if last else None),
+            detected=detected_count,
+            detected_rate=detected_rate,
+            primary_rate=primary_rate,
+            line=line,
+        )
+
+    def feed(self, line):
+        """解析一行 stderr，是进度行时把事件发布给所有订阅者并返回事件，否则返回 None。"""
+        event = self.parse(line.strip())
+        if event is None:
+            return None
+        self.last = event
+        for callback in list(self.listeners):
+            callback(event)
+        return event
+
+    def events(self, lines):
+        """逐行解析，依次产生事件 (同时发布给订阅者)。"""
+        for line in lines:
+            event = self.feed(line)
+            if event is not None:
+                yield event
+
+    async def aevents(self, reader):
+        """从 asyncio.StreamReader 逐行读取 stderr，依次产生事件 (同时发布给订阅者)。"""
+        async for raw in reader:
+            event = self.feed(raw.decode(errors='replace'))
+            if event is not None:
+                yield event
+
+
+class ProgressLogger:
+    def __init__(self, csv_path, run_id=''):
+        """
+        把进度事件追加到 CSV 文件，可直接作为 ProgressParser 的订阅回调。
+
+        参数:
+            csv_path: CSV 文件路径，不存在时写入表头
+            run_id: 写入每一行的运行标识，便于区分同一文件中的多次运行
+        """
+        self.csv_path = csv_path
+        self.run_id = run_id
+        self.fields = ['run_id', 'time', 'elapsed', 'percent', 'running', 'detected',
+                       'detected_rate', 'primary_rate']
+        try:
+            with open(csv_path, 'x', newline='') as f:
+                csv.writer(f).writerow(self.fields)
+        except FileExistsError:
+            pass
+
+    def __call__(self, event):
+        row = dict(event.as_dict(), run_id=self.run_id)
+        with open(self.csv_path, 'a', newline='') as f:
+            csv.writer(f).writerow([row[name] for name in self.fields])
@@ -1,40 +1,128 @@
+import argparse
+import os
+import time
+
 import numpy as np
-import struct
+
+# 二进制STL: 80字节文件头 + 4字节三角形数量，之后每个三角形一条50字节的记录
+STL_HEADER_SIZE = 84
+
+# 二进制STL的三角形记录: 法向量、三个顶点 (均为 float32) 和 2 字节属性
+stl_triangle_dtype = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('v1', '<f4', (3,)),
+    ('v2', '<f4', (3,)),
+    ('v3', '<f4', (3,)),
+    ('attr', '<u2'),
+])
+
+# 每次格式化并写出的顶点数
+TEXT_CHUNK_VERTICES = 300000
+
+# 坐标的文本格式: 9 位有效数字可以无损还原 float32；'%r' 与旧版本逐行写出的格式相同，但慢约 3 倍
+TEXT_FORMAT = '%.9g'
+
+
+def _stl_triangle_count(header, size):
+    num_triangles = int(np.frombuffer(header, dtype='<u4', count=1, offset=80)[0])
+    if size < STL_HEADER_SIZE + num_triangles * stl_triangle_dtype.itemsize:
+        raise ValueError(f"二进制STL文件不完整: 文件头声明 {num_triangles} 个三角形，"
+                         f"数据只有 {size} 字节")
+    return num_triangles
+
+
+def stl_triangles(data):
+    """
+    把二进制STL数据解析为结构化数组 (不复制数据)
+    :param data: 二进制数据 (bytes、bytearray 或 memoryview)
+    :return: stl_triangle_dtype 的数组，每个元素为一个三角形
+    """
+    num_triangles = _stl_triangle_count(data[:STL_HEADER_SIZE], len(data))
+    return np.frombuffer(data, dtype=stl_triangle_dtype, count=num_triangles,
+                         offset=STL_HEADER_SIZE)
+
+
+def read_stl_triangles(stl_file_path):
+    """
+    以内存映射方式读取二进制STL，大文件不需要一次读入内存
+    :param stl_file_path: STL文件路径
+    :return: stl_triangle_dtype 的数组 (np.memmap)
+    """
+    with open(stl_file_path, 'rb') as stl_file:
+        header = stl_file.read(STL_HEADER_SIZE)
+    num_triangles = _stl_triangle_count(header, os.path.getsize(stl_file_path))
+    if num_triangles == 0:
+        return np.zeros(0, dtype=stl_triangle_dtype)
+    return np.memmap(stl_file_path, dtype=stl_triangle_dtype, mode='r', offset=STL_HEADER_SIZE,
+                     shape=(num_triangles,))
+
+
+def triangle_vertices(triangles):
+    """把三角形记录展开为 (3N, 3) 的顶点数组，顺序为每个三角形的 v1, v2, v3。"""
+    return np.stack([triangles['v1'], triangles['v2'], triangles['v3']], axis=1).reshape(-1, 3)
+
 
 def parse_stl_binary(data):
     """
     解析二进制STL文件数据
     :param data: 二进制数据
-    :return: 顶点列表
-    """
-    vertices = []
-    header = data[0:80]
-    num_triangles = struct.unpack('<I', data[80:84])[0]
-    offset = 84
-    for _ in range(num_triangles):
-        normal = struct.unpack('<3f', data[offset:offset+12])
-        v1 = struct.unpack('<3f', data[offset+12:offset+24])
-        v2 = struct.unpack('<3f', data[offset+24:offset+36])
-        v3 = struct.unpack('<3f', data[offset+36:offset+48])
-        vertices.extend([v1, v2, v3])
-        offset += 50
-    return vertices
-
-def read_stl_to_txt(stl_file_path, txt_file_path):
+    :return: (3N, 3) 的 float32 顶点数组
+    """
+    return triangle_vertices(stl_triangles(data))
+
+
+def write_vertices_txt(txt_file, vertices, fmt=TEXT_FORMAT, chunk_vertices=TEXT_CHUNK_VERTICES):
+    """
+    按块批量写出顶点，每行 "x y z"
+    :param txt_file: 已打开的文本文件
+    :param vertices: (M, 3) 的顶点数组
+    :param fmt: 单个坐标的 % 格式
+    :param chunk_vertices: 每次格式化的顶点数
+    """
+    row_format = ' '.join([fmt] * 3) + '\n'
+    for start in range(0, len(vertices), chunk_vertices):
+        block = vertices[start:start + chunk_vertices]
+        txt_file.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
+
+def read_stl_to_txt(stl_file_path, txt_file_path, fmt=TEXT_FORMAT):
     """
     读取STL文件并写入TXT文件
     :param stl_file_path: STL文件路径
     :param txt_file_path: 输出的TXT文件路径
+    :param fmt: 单个坐标的 % 格式
+    :return: 三角形数量
     """
-    with open(stl_file_path, 'rb') as stl_file:
-        data = stl_file.read()
-    
+    t_start = time.time()
+    triangles = read_stl_triangles(stl_file_path)
     with open(txt_file_path, 'w') as txt_file:
-            vertices = parse_stl_binary(data)
-            for v in vertices:
-                txt_file.write(f"{v[0]} {v[1]} {v[2]}\n")
+        # 按三角形分块展开顶点，内存占用与文件大小无关
+        step = TEXT_CHUNK_VERTICES // 3
+        for start in range(0, len(triangles), step):
+            write_vertices_txt(txt_file, triangle_vertices(triangles[start:start + step]), fmt)
+    elapsed = time.time() - t_start
+    rate = len(triangles) / elapsed if elapsed > 0 else float('inf')
+    print(f"已转换 {len(triangles)} 个三角形, 用时: {elapsed:.2f}s ({rate:.0f} 三角形/秒)")
+    return len(triangles)
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(
+        description='Write the vertices of a binary STL as a "x y z" text file')
+    parser.add_argument('input_stl', help='Path to input binary .stl file')
+    parser.add_argument('output_txt', nargs='?',
+                        help='Path to output .txt file; default: <input>.txt')
+    parser.add_argument('--fmt', default=TEXT_FORMAT,
+                        help="printf-style format per coordinate "
+                             "(default: %(default)s; '%%r' reproduces the old output)")
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    output_txt = args.output_txt or f"{os.path.splitext(args.input_stl)[0]}.txt"
+    read_stl_to_txt(args.input_stl, output_txt, args.fmt)
+
 
 if __name__ == "__main__":
-    stl_file_path = "/home/chenguisen/AISI/nebula/nebula_python_wrapper/data/4_Trench Milling.stl"
-    txt_file_path = "/home/chenguisen/AISI/nebula/nebula_python_wrapper/data/4_Trench Milling.txt"
-    read_stl_to_txt(stl_file_path, txt_file_path)
+    main()
@@ -0,0 +1,438 @@
+import argparse
+import contextlib
+import json
+import lzma
+import os
+import pathlib
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from atomic_output import atomic_output
+
+"""
+.pri/.det 压缩容器
+
+.pri 中 z、dx、dy、dz、E 在一次扫描中是常数，px/py 按像素成片重复，原始格式的大部分字节是冗余的。
+压缩容器按块保存电子记录，每块内按列拆分后分别压缩:
+    const:   整块取同一个值的列只在块头中记录该值 (按原始字节保存，NaN 和 -0.0 也逐位还原)
+    delta:   整数列 (px, py) 保存相邻记录的差值，再按字节拆分
+    shuffle: 其余列按字节拆分 (所有记录的第 0 字节、第 1 字节……依次排列)
+拆分后的字节用标准库的 zlib 或 lzma 压缩。解压后与原始文件逐字节一致。
+
+文件结构:
+    MAGIC (8 字节) | 头长度 (uint32) | 文件头 JSON (dtype、编码、每块记录数)
+    重复: 块头长度 (uint32) | 块头 JSON (记录数、每列的编码方式和压缩后字节数) | 各列压缩数据
+文件只顺序写入，没有尾部索引，可以直接写入管道。
+
+nebula_gpu 只读取原始格式: 用 expand 流式还原为原始文件或写入命名管道，
+也可以把 iter_blocks 交给 pri_stream.PriStream 边解压边模拟。
+
+用法:
+    python record_pack.py pack output.det output.det.pack --codec lzma
+    python record_pack.py unpack sem.pri.pack sem.pri
+    python record_pack.py info output.det.pack
+"""
+
+MAGIC = b'NEBPACK1'
+VERSION = 1
+
+# 压缩文件的默认扩展名 (附加在原文件名之后，例如 output.det.pack)
+PACK_SUFFIX = '.pack'
+
+# 每块的记录数 (约 36 MB 原始数据)
+BLOCK_RECORDS = 1 << 20
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+# 各编码的默认压缩级别: 拆分后的 x/y 随机字节占压缩结果的大部分，
+# 更高级别几乎不能再减小文件，只会更慢
+DEFAULT_LEVEL = {'zlib': 1, 'lzma': 0}
+
+_LENGTH = struct.Struct('<I')
+
+
+def packed_path(path):
+    """压缩文件的默认路径: 原文件名加 PACK_SUFFIX。"""
+    path = pathlib.Path(path)
+    return path.with_name(path.name + PACK_SUFFIX)
+
+
+def is_packed(path):
+    """文件是否为压缩容器 (按文件开头的 MAGIC 判断，与扩展名无关)。"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _shuffle(values):
+    """按字节拆分: 返回所有记录的第 0 字节、第 1 字节……依次排列的字节串。"""
+    return np.ascontiguousarray(values).view(np.uint8).reshape(len(values), -1).T.tobytes()
+
+
+def _unshuffle(data, dtype, n):
+    columns = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, n)
+    return columns.T.copy().view(dtype).ravel()
+
+
+def _encode_column(values, compress):
+    """编码一列，返回 (列描述 dict, 压缩数据)。"""
+    raw = values.view(np.uint8).reshape(len(values), -1)
+    if (raw == raw[0]).all():
+        return {'mode': 'const', 'value': raw[0].tobytes().hex(), 'nbytes': 0}, b''
+    if values.dtype.kind in 'iu':
+        # 第一个差值相对 0，累加即还原；整数溢出按补码回绕，与累加时一致
+        data = compress(_shuffle(np.diff(values, prepend=values.dtype.type(0))))
+        return {'mode': 'delta', 'nbytes': len(data)}, data
+    data = compress(_shuffle(values))
+    return {'mode': 'shuffle', 'nbytes': len(data)}, data
+
+
+def _decode_column(column, data, dtype, n, decompress):
+    if column['mode'] == 'const':
+        return np.frombuffer(bytes.fromhex(column['value']), dtype=dtype)[0]
+    values = _unshuffle(decompress(data), dtype, n)
+    if column['mode'] == 'delta':
+        return np.cumsum(values, dtype=dtype)
+    return values
+
+
+class PackWriter:
+    def __init__(self, file, dtype, codec='zlib', level=None, block_records=BLOCK_RECORDS):
+        """
+        参数:
+            file: 输出路径或已以二进制写方式打开的文件对象 (可以是管道)
+            dtype: 记录的 numpy 结构化数据类型，例如 sem_pri.electron_dtype
+            codec: 'zlib' 或 'lzma'
+            level: 压缩级别，默认取 DEFAULT_LEVEL
+            block_records: 每块的记录数
+
+        用法:
+            with PackWriter('sem.pri.pack', electron_dtype, codec='lzma') as writer:
+                for _, buffer in iter_sem_pri_blocks(...):
+                    writer.write(buffer)
+        """
+        if codec not in CODECS:
+            raise ValueError(f"未知的压缩编码: {codec}")
+        self.dtype = np.dtype(dtype)
+        self.codec = codec
+        self.level = DEFAULT_LEVEL[codec] if level is None else level
+        self.block_records = block_records
+        self.records = 0
+        self.raw_bytes = 0
+        self.packed_bytes = 0
+        self._compress = CODECS[codec][0]
+        self._pending = []
+        self._pending_records = 0
+        self._owns_file = isinstance(file, (str, os.PathLike))
+        self.file = open(file, 'wb') if self._owns_file else file
+        header = {
+            'version': VERSION,
+            'dtype': [[name, self.dtype.fields[name][0].str] for name in self.dtype.names],
+            'codec': codec,
+            'block_records': block_records,
+        }
+        self._write_chunk(MAGIC)
+        self._write_json(header)
+
+    def _write_chunk(self, data):
+        self.file.write(data)
+        self.packed_bytes += len(data)
+
+    def _write_json(self, obj):
+        data = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+        self._write_chunk(_LENGTH.pack(len(data)))
+        self._write_chunk(data)
+
+    def _write_block(self, records):
+        columns = []
+        payloads = []
+        for name in self.dtype.names:
+            column, data = _encode_column(np.ascontiguousarray(records[name]),
+                                          lambda raw: self._compress(raw, self.level))
+            columns.append(dict(column, name=name))
+            payloads.append(data)
+        self._write_json({'n': len(records), 'columns': columns})
+        for data in payloads:
+            self._write_chunk(data)
+        self.records += len(records)
+        self.raw_bytes += records.nbytes
+
+    def write(self, records):
+        """
+        追加记录 (dtype 必须与创建时相同)，凑满 block_records 时写出一块。
+        暂存时不复制，写入后不要再修改 records。
+        """
+        if records.dtype != self.dtype:
+            raise ValueError(f"记录类型 {records.dtype} 与容器类型 {self.dtype} 不一致")
+        if len(records) == 0:
+            return
+        # 小批量写入时先暂存，凑满一块后一次拼接，避免反复复制
+        self._pending.append(records)
+        self._pending_records += len(records)
+        if self._pending_records < self.block_records:
+            return
+        pending = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        full = len(pending) // self.block_records * self.block_records
+        for start in range(0, full, self.block_records):
+            self._write_block(pending[start:start + self.block_records])
+        rest = pending[full:].copy()
+        self._pending = [rest] if len(rest) else []
+        self._pending_records = len(rest)
+
+    def close(self):
+        """写出剩余记录并关闭 (传入的文件对象不关闭)。"""
+        if self._pending:
+            self._write_block(np.concatenate(self._pending))
+            self._pending = []
+            self._pending_records = 0
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._owns_file:
+            self.file.close()
+
+
+@contextlib.contextmanager
+def record_writer(path, dtype, codec=None, level=None, block_records=BLOCK_RECORDS):
+    """
+    打开记录输出: codec 为 None 时是原始格式的文件，否则是 PackWriter。
+    两者都用 write(records) 写入，调用方不需要区分格式。
+    """
+    if codec is None:
+        with open(path, 'wb') as f:
+            yield f
+    else:
+        with PackWriter(path, dtype, codec, level, block_records) as writer:
+            yield writer
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("压缩文件不完整")
+    return data
+
+
+def _read_json(f, allow_eof=False):
+    prefix = f.read(_LENGTH.size)
+    if not prefix and allow_eof:
+        return None
+    if len(prefix) != _LENGTH.size:
+        raise ValueError("压缩文件不完整")
+    return json.loads(_read_exact(f, _LENGTH.unpack(prefix)[0]))
+
+
+def read_header(f):
+    """读取并检查文件头，返回 (头 dict, 记录 dtype)。f 为已打开的二进制文件对象。"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("不是压缩的 .pri/.det 文件")
+    header = _read_json(f)
+    if header['version'] != VERSION:
+        raise ValueError(f"不支持的压缩文件版本: {header['version']}")
+    if header['codec'] not in CODECS:
+        raise ValueError(f"未知的压缩编码: {header['codec']}")
+    return header, np.dtype([(name, fmt) for name, fmt in header['dtype']])
+
+
+def iter_block_headers(path):
+    """逐块读取块头而不解压数据，产出 (块在文件中的偏移, 块头 dict, 压缩数据字节数)。"""
+    with open(path, 'rb') as f:
+        read_header(f)
+        while True:
+            offset = f.tell()
+            block = _read_json(f, allow_eof=True)
+            if block is None:
+                return
+            nbytes = sum(column['nbytes'] for column in block['columns'])
+            f.seek(nbytes, os.SEEK_CUR)
+            yield offset, block, nbytes
+
+
+def _read_block(f, dtype, decompress):
+    """从当前位置读取并解压一块，到达文件末尾时返回 None。"""
+    block = _read_json(f, allow_eof=True)
+    if block is None:
+        return None
+    n = block['n']
+    records = np.empty(n, dtype=dtype)
+    for column in block['columns']:
+        name = column['name']
+        data = _read_exact(f, column['nbytes'])
+        records[name] = _decode_column(column, data, dtype.fields[name][0], n, decompress)
+    return records
+
+
+def iter_blocks(path):
+    """逐块解压，产出记录数组 (dtype 与写入时相同)，内存占用为一块。"""
+    with open(path, 'rb') as f:
+        header, dtype = read_header(f)
+        decompress = CODECS[header['codec']][1]
+        while True:
+            records = _read_block(f, dtype, decompress)
+            if records is None:
+                return
+            yield records
+
+
+def read_blocks_at(path, offsets):
+    """只解压指定偏移 (见 iter_block_headers) 处的块，按 offsets 的顺序产出记录数组。"""
+    with open(path, 'rb') as f:
+        header, dtype = read_header(f)
+        decompress = CODECS[header['codec']][1]
+        for offset in offsets:
+            f.seek(offset)
+            records = _read_block(f, dtype, decompress)
+            if records is None:
+                raise ValueError("压缩文件不完整")
+            yield records
+
+
+def read_records(path):
+    """一次读入全部记录 (小文件或测试时使用)。"""
+    blocks = list(iter_blocks(path))
+    if not blocks:
+        with open(path, 'rb') as f:
+            return np.empty(0, dtype=read_header(f)[1])
+    return np.concatenate(blocks)
+
+
+def expand(path, out):
+    """
+    流式还原为原始格式。
+
+    参数:
+        path: 压缩文件
+        out: 输出路径 (可以是已创建的命名管道) 或已打开的二进制文件对象
+
+    返回:
+        int: 写出的记录数
+    """
+    total = 0
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(out, 'wb')) if isinstance(out, (str, os.PathLike)) else out
+        for records in iter_blocks(path):
+            f.write(records)
+            total += len(records)
+    return total
+
+
+def pack_file(src, dst, dtype, codec='zlib', level=None, block_records=BLOCK_RECORDS):
+    """
+    把原始 .pri/.det 压缩为 dst (先写临时文件，完成后原子重命名)。
+    原始文件按 block_records 分段映射读取，内存占用与文件大小无关。
+
+    返回:
+        dict: records, raw_bytes, packed_bytes, seconds
+    """
+    t_start = time.time()
+    dtype = np.dtype(dtype)
+    size = os.path.getsize(src)
+    count = size // dtype.itemsize
+    if size % dtype.itemsize:
+        print(f"[WARNING] {src} 末尾有 {size % dtype.itemsize} 字节不完整的记录，已忽略")
+    with atomic_output(dst) as tmp_path:
+        with PackWriter(tmp_path, dtype, codec, level, block_records) as writer:
+            if count:
+                data = np.memmap(src, dtype=dtype, mode='r', shape=(count,))
+                for start in range(0, count, block_records):
+                    writer.write(np.array(data[start:start + block_records]))
+                del data
+    return {'records': writer.records, 'raw_bytes': writer.raw_bytes,
+            'packed_bytes': writer.packed_bytes, 'seconds': time.time() - t_start}
+
+
+def info(path):
+    """
+    统计压缩文件而不解压。
+
+    返回:
+        dict: codec, dtype, records, blocks, packed_bytes, raw_bytes, modes (每列各编码方式的块数)
+    """
+    with open(path, 'rb') as f:
+        header, dtype = read_header(f)
+    records = blocks = 0
+    modes = {name: {} for name in dtype.names}
+    for _, block, _ in iter_block_headers(path):
+        blocks += 1
+        records += block['n']
+        for column in block['columns']:
+            counts = modes[column['name']]
+            counts[column['mode']] = counts.get(column['mode'], 0) + 1
+    return {
+        'codec': header['codec'],
+        'dtype': dtype,
+        'records': records,
+        'blocks': blocks,
+        'packed_bytes': os.path.getsize(path),
+        'raw_bytes': records * dtype.itemsize,
+        'modes': modes,
+    }
+
+
+def _ratio(raw_bytes, packed_bytes):
+    return raw_bytes / packed_bytes if packed_bytes else float('inf')
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(
+        description='Pack, unpack or inspect compressed .pri/.det files')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='Compress a raw .pri/.det file')
+    pack.add_argument('src', help='Raw .pri or .det file')
+    pack.add_argument('dst', nargs='?', help=f'Output file; default: src + {PACK_SUFFIX}')
+    pack.add_argument('--codec', choices=sorted(CODECS), default='zlib', help='Compression codec')
+    pack.add_argument('--level', type=int, help='Compression level; default: 1 (zlib) or 0 (lzma)')
+    pack.add_argument('--block-records', type=int, default=BLOCK_RECORDS, help='Records per block')
+    unpack = commands.add_parser('unpack', help='Expand to the raw format read by nebula_gpu')
+    unpack.add_argument('src', help='Packed file')
+    unpack.add_argument('dst', help='Raw output file or an existing named pipe')
+    show = commands.add_parser('info', help='Show records, blocks and column encodings')
+    show.add_argument('src', help='Packed file')
+    return parser
+
+
+def main():
+    # 只在命令行中使用，避免 record_pack 被 sem_pri 导入时形成循环导入
+    from sem_pri import electron_dtype
+
+    args = _build_cli().parse_args()
+    if args.command == 'pack':
+        dst = args.dst or packed_path(args.src)
+        result = pack_file(args.src, dst, electron_dtype, args.codec, args.level,
+                           args.block_records)
+        ratio = _ratio(result['raw_bytes'], result['packed_bytes'])
+        print(f"{result['records']} 个记录: {result['raw_bytes'] / 2**20:.1f} MB -> "
+              f"{result['packed_bytes'] / 2**20:.1f} MB (压缩比 {ratio:.1f}), "
+              f"用时 {result['seconds']:.1f}s, 已保存到 {dst}")
+    elif args.command == 'unpack':
+        t_start = time.time()
+        total = expand(args.src, args.dst)
+        print(f"已还原 {total} 个记录到 {args.dst}, 用时 {time.time() - t_start:.1f}s")
+    else:
+        result = info(args.src)
+        print(f"编码: {result['codec']}, 记录数: {result['records']}, 块数: {result['blocks']}, "
+              f"{result['raw_bytes'] / 2**20:.1f} MB -> {result['packed_bytes'] / 2**20:.1f} MB "
+              f"(压缩比 {_ratio(result['raw_bytes'], result['packed_bytes']):.1f})")
+        for name, counts in result['modes'].items():
+            modes = ', '.join(f"{mode} {n}" for mode, n in sorted(counts.items()))
+            print(f"    {name:<4} {modes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 
 def rotation_matrix(tilt_x: float = 0, tilt_y: float = 0, rotate_angle: float = 0) -> np.ndarray:
@@ -40,6 +39,7 @@ def rotation_matrix(tilt_x: float = 0, tilt_y: float = 0, rotate_angle: float =
     # 构建旋转向量（方向为旋转轴，长度为旋转角度）
     rotation_vector = rotation_axis * rotation_angle_rad
 
-    # 转换为旋转矩阵
+    # 转换为旋转矩阵 (cv2 导入较慢，在第一次使用时才导入)
+    import cv2
     rotation_matrix, _ = cv2.Rodrigues(rotation_vector)
     return rotation_matrix
@@ -1,91 +1,98 @@
-import subprocess
-import threading
-import time
+import os
 import platform
 from analysis import sem_analysis
+from live_det import DetFollower
+from nebula_launcher import COMPLETION_GRACE, format_argv, is_successful, launch
+
+
+def _format_rate(rate):
+    return '-' if rate is None else f'{rate:,.0f}'
+
+
 class nebula_gpu:
-    def __init__(self, command, sem_simu_result:str, image_path:str):
+    def __init__(self, command, sem_simu_result:str, image_path:str, live_interval=None,
+                 on_live_update=None, analyze=True, cwd=None, env=None, on_progress=None,
+                 completion_grace=COMPLETION_GRACE):
+        """
+        参数:
+            command: nebula_gpu 参数列表，见 nebula_launcher.build_argv
+            sem_simu_result: 输出 .det 文件路径
+            image_path: 输出图像路径
+            live_interval: 实时图像的更新间隔 (秒)，为 None 时不跟踪运行中的 .det
+            on_live_update: 实时图像更新时的回调，参数为 DetFollower
+            analyze: 运行结束后是否立即分析 .det 并保存图像；流水线调度时由单独的分析阶段完成
+            cwd: nebula_gpu 的工作目录，为 None 时使用当前目录；同时运行多个模拟时应各不相同
+            env: nebula_gpu 的环境变量，为 None 时继承当前进程；可用 gpu_pool.device_env 指定 GPU
+            on_progress: 进度事件的回调，参数为 progress_events.ProgressEvent
+            completion_grace: 进度 100% 且没有正在模拟的电子后，.det 保持不变多少秒即结束进程
+        """
         super().__init__()
         self.command = command
         self.sem_simu_result = sem_simu_result
         self.image_path = image_path
+        self.live_interval = live_interval
+        self.on_live_update = on_live_update
+        self.live = None
+        self.analyze = analyze
+        self.cwd = cwd
+        self.env = env
+        self.on_progress = on_progress
+        self.completion_grace = completion_grace
+        self.result = None
     def run(self):
+        """运行 nebula_gpu，返回进程退出码；发生异常时返回 None。"""
         try:           
             # 打印调试信息
-            print(f"[DEBUG] 执行命令: {self.command}")
+            print(f"[DEBUG] 执行命令: {format_argv(self.command, self.sem_simu_result)}")
             print(f"[DEBUG] 操作系统: {platform.system()}")
-            
-            # 所有平台都使用 Popen 并监听输出
-            print(f"[INFO] 在 {platform.system()} 平台上执行命令")
-            
-            # 创建进程
-            process = subprocess.Popen(
-                self.command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1  # 行缓冲
-            )
-            
-            # 监听输出的函数
-            def monitor_output(pipe, is_error=False):
-                progress_completed = False
-                progress_100_time = None
-                
-                for line in iter(pipe.readline, ''):
-                    line_stripped = line.strip()
-                    print(line_stripped)
-                    
-                    # 检测是否为detected: 0
-                    if "running: 0 | detected: 0" in line_stripped:
-                        print("检测到detected: 0，需要对输入进行优化")
-                        process.terminate()
-                        print("nebula_gpu 运行结束，未检测到有效数据，请优化输入")
-                        return False
-                    
-                    # 检测进度是否为100.00%
-                    if "Progress 100.00%" in line_stripped and not progress_completed:
-                        print("检测到进度100.00%，将在20秒后终止进程并展示结果")
-                        progress_completed = True
-                        progress_100_time = time.time()
-                    
-                    # 如果已经检测到100%进度且已经过了20秒，则终止进程
-                    if progress_completed and progress_100_time is not None and time.time() - progress_100_time >= 20:
-                        print("如果等待20秒完成，进程未自然结束，则终止进程并展示结果")
-                        process.terminate()
-                        print("nebula_gpu 运行成功！")
-                        return True
-                
-                return None
-            
-            # 创建线程监听stderr
-            stderr_thread = threading.Thread(target=monitor_output, args=(process.stderr, True))
-            stderr_thread.daemon = True
-            stderr_thread.start()
-            
-            # 等待进程完成或被终止
-            return_code = process.wait()
-            
-            # 检查进程是否正常结束
-            if return_code == 0:
+
+            if self.live_interval is not None:
+                # 删除上一次的输出，避免在打开输出文件前读到旧数据
+                if os.path.exists(self.sem_simu_result):
+                    os.remove(self.sem_simu_result)
+                self.live = DetFollower(
+                    self.sem_simu_result,
+                    interval=self.live_interval,
+                    on_update=self.on_live_update or self.print_live_update,
+                ).start()
+
+            # 不经过 shell 直接启动进程，stdout 直接写入 .det 文件
+            try:
+                self.result = launch(self.command, self.sem_simu_result, cwd=self.cwd,
+                                     env=self.env, on_event=self.on_progress,
+                                     completion_grace=self.completion_grace)
+            finally:
+                if self.live is not None:
+                    self.live.stop()
+            return_code = self.result['return_code']
+            print(f"[INFO] nebula_gpu 用时 {self.result['wall_time']:.1f}s, "
+                  f"检测电子数: {self.result['detected']}, "
+                  f"速率: {_format_rate(self.result['primary_rate'])} 初级电子/秒")
+
+            # 检查进程是否正常结束 (进度 100% 后由启动器终止的进程同样视为成功，见 is_successful)
+            if is_successful(self.result):
                 print("nebula_gpu 运行成功！")
-                self.show_image(plot=False, save=True)
-                return
+                if self.analyze:
+                    self.show_image(plot=False, save=True)
+                return return_code
             else:
-                print(f"[WARNING] nebula_gpu 进程返回非零状态码: {return_code}")
+                print(f"[WARNING] nebula_gpu 运行失败，状态码: {return_code}, "
+                      f"状态: {self.result['status']}")
                 # 尝试显示图像，即使进程返回非零状态码
-                try:
-                    self.show_image(plot=False, save=True)
-                except Exception as e:
-                    print(f"[ERROR] 显示图像失败: {e}")
-                return
+                if self.analyze:
+                    try:
+                        self.show_image(plot=False, save=True)
+                    except Exception as e:
+                        print(f"[ERROR] 显示图像失败: {e}")
+                return return_code
             # 所有平台都使用相同的监听方法，不再需要区分
 
         except Exception as e:
             error_msg = f"调用 nebula_gpu 时发生异常: {str(e)}"
             print(f"[ERROR] {error_msg}")  # 在终端打印异常信息
             print(error_msg)
+    def print_live_update(self, live):
+        print(f"[LIVE] 已检测电子数: {live.total}")
     def show_image(self, plot = True, save = False):
             # 自动调用 sem-analysis.py
             try:
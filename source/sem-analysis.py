@@ -1,7 +1,7 @@
 import sys
 import os
-import numpy as np
 import matplotlib.pyplot as plt
+from analysis import sem_image
 
 # Find out which file to open
 if len(sys.argv) < 2:
@@ -13,28 +13,12 @@ if not os.path.exists(filename):
 	sys.exit()
 
 
-# This is a numpy datatype that corresponds to output files
-electron_dtype = np.dtype([
-    ('x',  '=f'), ('y',  '=f'), ('z',  '=f'), # Position
-    ('dx', '=f'), ('dy', '=f'), ('dz', '=f'), # Direction
-    ('E',  '=f'),                             # Energy
-    ('px', '=i'), ('py', '=i')])              # Pixel index
-
-# Open the output file
-data = np.fromfile(filename, dtype=electron_dtype)
-print("Number of electrons detected: {}".format(len(data)))
-
-
-# Make a histogram of pixel indices
-xmin = data['px'].min()
-xmax = data['px'].max()
-ymin = data['py'].min()
-ymax = data['py'].max()
-H, xedges, yedges = np.histogram2d(data['px'], data['py'],
-	bins = [
-		np.linspace(xmin-.5, xmax+.5, xmax-xmin+2),
-		np.linspace(ymin-.5, ymax+.5, ymax-ymin+2)
-	])
+# Stream the output file in chunks and histogram the pixel indices
+hist = sem_image(filename)
+print("Number of electrons detected: {}".format(hist.total))
+if hist.total == 0:
+	sys.exit()
+H = hist.counts
 
 # Make a plot
 plt.imshow(H.T, cmap='gray', vmin=0,origin='lower')
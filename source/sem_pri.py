@@ -2,6 +2,10 @@ import numpy as np
 import os
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from record_pack import record_writer
 
 """
 SEM Image Simulation Generator
@@ -10,8 +14,92 @@ SEM Image Simulation Generator
 .pri文件格式存储每个模拟电子的位置、方向、能量和像素信息。
 
 输出:
-- sem.pri: 包含电子数据的二进制文件
+- sem.pri: 包含电子数据的二进制文件 (指定 compress 时为 record_pack 压缩容器)
 """
+
+# 这是一个对应pri文件格式的numpy数据类型
+electron_dtype = np.dtype([
+    ('x',  '=f'), ('y',  '=f'), ('z',  '=f'), # 位置
+    ('dx', '=f'), ('dy', '=f'), ('dz', '=f'), # 方向
+    ('E',  '=f'),                             # 能量
+    ('px', '=i'), ('py', '=i')])              # 像素索引
+
+# 向量化模式下每次写入的电子数上限 (约 150 MB 缓冲区)
+CHUNK_ELECTRONS = 1 << 22
+
+
+def _remove_existing(file_path):
+    """删除已存在的输出文件，避免以 'wb' 打开时截断与 .pri 缓存共享的硬链接。"""
+    if os.path.lexists(file_path):
+        os.remove(file_path)
+
+
+def _pixel_counts(rng, x_num, y_num, epx, poisson):
+    """一次性抽取所有像素的电子数量，形状为 (x_num, y_num)。"""
+    if poisson:
+        return rng.poisson(epx, size=(x_num, y_num)).astype(np.int64)
+    return np.full((x_num, y_num), int(epx), dtype=np.int64)
+
+
+def _row_blocks(counts, chunk_electrons):
+    """按整行划分像素块，使每块电子数尽量不超过 chunk_electrons。"""
+    row_totals = counts.sum(axis=1)
+    i0 = 0
+    acc = 0
+    for i, n in enumerate(row_totals):
+        if acc > 0 and acc + n > chunk_electrons:
+            yield i0, i
+            i0 = i
+            acc = 0
+        acc += n
+    if i0 < len(row_totals):
+        yield i0, len(row_totals)
+
+
+def _fill_rows(rng, counts, i0, xpx, ypx, z, energy, sigma, dx, dy, dz):
+    """
+    用向量化操作填充 counts 中全部像素的电子记录。
+
+    counts 为若干连续行 (从第 i0 行开始) 的电子数量；记录顺序与逐像素循环一致，
+    即先遍历 x 像素再遍历 y 像素。高斯偏移按 (x, y) 成对顺序抽取，
+    因此同一种子下的输出与分块大小无关。
+    """
+    rows, y_num = counts.shape
+    flat = counts.ravel()
+    total = int(flat.sum())
+    px = np.repeat(np.repeat(np.arange(i0, i0 + rows, dtype=np.int32), y_num), flat)
+    py = np.repeat(np.tile(np.arange(y_num, dtype=np.int32), rows), flat)
+    offsets = rng.standard_normal((total, 2))
+
+    buffer = np.empty(total, dtype=electron_dtype)
+    buffer['x'] = xpx[px] + sigma * offsets[:, 0]
+    buffer['y'] = ypx[py] + sigma * offsets[:, 1]
+    buffer['z'] = z
+    buffer['dx'] = dx
+    buffer['dy'] = dy
+    buffer['dz'] = dz
+    buffer['E'] = energy
+    buffer['px'] = px
+    buffer['py'] = py
+    return buffer
+
+
+def iter_sem_pri_blocks(z, xpx, ypx, energy=500, epx=1000, sigma=1, poisson=True,
+                        dx=0, dy=0, dz=-1, seed=None, chunk_electrons=CHUNK_ELECTRONS):
+    """
+    按行块逐块生成 .pri 电子记录 (向量化模式)。
+
+    产出 (已完成的x像素行数, 电子记录数组)；依次写出所有块即得到完整的 .pri 内容，
+    可用于写文件，也可用于向命名管道流式输出。
+    """
+    xpx = np.asarray(xpx, dtype=np.float64)
+    ypx = np.asarray(ypx, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    counts = _pixel_counts(rng, len(xpx), len(ypx), epx, poisson)
+    for i0, i1 in _row_blocks(counts, chunk_electrons):
+        yield i1, _fill_rows(rng, counts[i0:i1], i0, xpx, ypx, z, energy, sigma, dx, dy, dz)
+
+
 def generate_sem_pri_data(
         z: float, 
         xpx: np.ndarray, 
@@ -23,7 +111,11 @@ def generate_sem_pri_data(
         dx: float = 0, 
         dy: float = 0, 
         dz: float = -1, 
-        file_path: str = 'sem.pri'
+        file_path: str = 'sem.pri',
+        vectorized: bool = False,
+        seed: Optional[int] = None,
+        chunk_electrons: int = CHUNK_ELECTRONS,
+        compress: Optional[str] = None
         ):
     """
     # 参数设置:
@@ -37,6 +129,10 @@ def generate_sem_pri_data(
     dx = 0                           # x方向的方向向量
     dy = 0                           # y方向的方向向量
     dz = -1                          # z方向的方向向量
+    vectorized = False               # 是否使用整幅向量化模式(一次抽取所有像素的电子数, 按行块写入)
+    seed = None                      # 向量化模式的随机种子, 固定种子时输出逐字节一致
+    chunk_electrons = 1 << 22        # 向量化模式下每次写入的电子数上限
+    compress = None                  # 压缩容器的编码('zlib'或'lzma', 见record_pack), None为原始.pri
     """
    
     # 计算实际步长
@@ -47,13 +143,6 @@ def generate_sem_pri_data(
     print(f"x方向的步长: {x_step:.4f} nm")
     print(f"y方向的步长: {y_step:.4f} nm")
 
-    # 这是一个对应pri文件格式的numpy数据类型
-    electron_dtype = np.dtype([
-        ('x',  '=f'), ('y',  '=f'), ('z',  '=f'), # 位置
-        ('dx', '=f'), ('dy', '=f'), ('dz', '=f'), # 方向
-        ('E',  '=f'),                             # 能量
-        ('px', '=i'), ('py', '=i')])              # 像素索引
-
     #print(f"输出文件: {file_path}")
 
     try:
@@ -74,49 +163,62 @@ def generate_sem_pri_data(
         start_time = time.time()
         
         print("开始生成SEM数据...")
-        with open(file_path, 'wb') as file:
-            # 遍历像素
-            for i, xmid in enumerate(xpx):
-                # 每处理10%的像素显示一次进度
-                if i % (len(xpx) // 10) == 0 and i > 0:
-                    percent = i * 100 // len(xpx)
+        _remove_existing(file_path)
+        if vectorized:
+            blocks = iter_sem_pri_blocks(z, xpx, ypx, energy, epx, sigma, poisson,
+                                         dx, dy, dz * norm_factor, seed, chunk_electrons)
+            with record_writer(file_path, electron_dtype, compress) as file:
+                for i1, buffer in blocks:
+                    file.write(buffer)
+                    total_electrons += len(buffer)
                     elapsed = time.time() - start_time
-                    remaining = elapsed * (len(xpx) - i) / i
-                    print(f"进度: {percent}%, 已处理电子数: {total_electrons}, "
+                    remaining = elapsed * (len(xpx) - i1) / i1
+                    print(f"进度: {i1 * 100 // len(xpx)}%, 已处理电子数: {total_electrons}, "
                         f"已用时间: {elapsed:.1f}秒, 预计剩余: {remaining:.1f}秒")
+        else:
+            with record_writer(file_path, electron_dtype, compress) as file:
+                # 遍历像素
+                for i, xmid in enumerate(xpx):
+                    # 每处理10%的像素显示一次进度
+                    if i % (len(xpx) // 10) == 0 and i > 0:
+                        percent = i * 100 // len(xpx)
+                        elapsed = time.time() - start_time
+                        remaining = elapsed * (len(xpx) - i) / i
+                        print(f"进度: {percent}%, 已处理电子数: {total_electrons}, "
+                            f"已用时间: {elapsed:.1f}秒, 预计剩余: {remaining:.1f}秒")
                     
-                for j, ymid in enumerate(ypx):
-                    try:
-                        # 计算此像素的电子数量
-                        N_elec = np.random.poisson(epx) if poisson else epx
-                        total_electrons += N_elec
+                    for j, ymid in enumerate(ypx):
+                        try:
+                            # 计算此像素的电子数量
+                            N_elec = np.random.poisson(epx) if poisson else epx
+                            total_electrons += N_elec
                         
-                        # 分批处理大量电子以节省内存
-                        batch_size = min(N_elec, 10000)  # 每批最多处理10000个电子
+                            # 分批处理大量电子以节省内存
+                            batch_size = min(N_elec, 10000)  # 每批最多处理10000个电子
                         
-                        for batch_start in range(0, N_elec, batch_size):
-                            batch_end = min(batch_start + batch_size, N_elec)
-                            batch_count = batch_end - batch_start
+                            for batch_start in range(0, N_elec, batch_size):
+                                batch_end = min(batch_start + batch_size, N_elec)
+                                batch_count = batch_end - batch_start
                             
-                            # 分配numpy缓冲区
-                            buffer = np.empty(batch_count, dtype=electron_dtype)
+                                # 分配numpy缓冲区
+                                buffer = np.empty(batch_count, dtype=electron_dtype)
                             
-                            # 填充数据
-                            buffer['x'] = np.random.normal(xmid, sigma, batch_count)
-                            buffer['y'] = np.random.normal(ymid, sigma, batch_count)
-                            buffer['z'] = z
-                            buffer['dx'] = dx
-                            buffer['dy'] = dy
-                            buffer['dz'] = dz * norm_factor  # 使用归一化的方向向量
-                            buffer['E'] = energy
-                            buffer['px'] = i
-                            buffer['py'] = j
+                                # 填充数据
+                                buffer['x'] = np.random.normal(xmid, sigma, batch_count)
+                                buffer['y'] = np.random.normal(ymid, sigma, batch_count)
+                                buffer['z'] = z
+                                buffer['dx'] = dx
+                                buffer['dy'] = dy
+                                buffer['dz'] = dz * norm_factor  # 使用归一化的方向向量
+                                buffer['E'] = energy
+                                buffer['px'] = i
+                                buffer['py'] = j
                             
-                            # 写入文件
-                            buffer.tofile(file)
-                    except Exception as e:
-                            # 如果发生错误，打印错误信息并继续处理下一个像素
-                            raise RuntimeError(f"处理像素({i},{j})时出错: {str(e)}")        
+                                # 写入文件
+                                file.write(buffer)
+                        except Exception as e:
+                                # 如果发生错误，打印错误信息并继续处理下一个像素
+                                raise RuntimeError(f"处理像素({i},{j})时出错: {str(e)}")        
         total_time = time.time() - start_time
         print(f"完成! 总共处理了 {total_electrons:,} 个电子")
         print(f"总用时: {total_time:.2f} 秒")
@@ -125,4 +227,95 @@ def generate_sem_pri_data(
         
     except Exception as e:
         #print(f"错误: {str(e)}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+
+def _write_band(args):
+    """
+    子进程任务：生成一个行带的全部电子记录，并写入输出文件中该行带自己的偏移处。
+
+    每个行带使用由 SeedSequence 派生的独立随机流，结果与进程数无关。
+    """
+    (file_path, offset, counts, i0, band_seed, xpx, ypx,
+     z, energy, sigma, dx, dy, dz, chunk_electrons) = args
+    rng = np.random.default_rng(band_seed)
+    written = 0
+    with open(file_path, 'r+b') as file:
+        file.seek(offset)
+        for r0, r1 in _row_blocks(counts, chunk_electrons):
+            buffer = _fill_rows(rng, counts[r0:r1], i0 + r0, xpx, ypx,
+                                z, energy, sigma, dx, dy, dz)
+            buffer.tofile(file)
+            written += len(buffer)
+    return i0, written
+
+
+def generate_sem_pri_data_parallel(
+        z: float,
+        xpx: np.ndarray,
+        ypx: np.ndarray,
+        energy: float = 500,
+        epx: int = 1000,
+        sigma: float = 1,
+        poisson: bool = True,
+        dx: float = 0,
+        dy: float = 0,
+        dz: float = -1,
+        file_path: str = 'sem.pri',
+        seed: Optional[int] = None,
+        workers: Optional[int] = None,
+        band_rows: int = 64,
+        chunk_electrons: int = CHUNK_ELECTRONS
+        ):
+    """
+    多进程分片生成 .pri 文件。
+
+    将 x 像素按 band_rows 行划分为行带，每个行带交给一个子进程，
+    使用 np.random.SeedSequence 派生的独立随机流生成电子，并写入文件中预先计算好的偏移处。
+    行带划分和随机流只取决于 seed 与 band_rows，与 workers 无关，
+    因此固定 seed 时不同进程数的输出逐字节一致。
+
+    参数与 generate_sem_pri_data 相同，另有:
+        workers: 子进程数量，默认为 CPU 核数
+        band_rows: 每个行带包含的 x 像素行数
+
+    返回:
+        int: 写入的电子总数
+    """
+    xpx = np.asarray(xpx, dtype=np.float64)
+    ypx = np.asarray(ypx, dtype=np.float64)
+    start_time = time.time()
+
+    root = np.random.SeedSequence(seed)
+    bands = [(i0, min(i0 + band_rows, len(xpx))) for i0 in range(0, len(xpx), band_rows)]
+    count_seed, *band_seeds = root.spawn(1 + len(bands))
+
+    # 先在主进程中抽取全部像素电子数，据此确定每个行带在文件中的偏移
+    counts = _pixel_counts(np.random.default_rng(count_seed), len(xpx), len(ypx), epx, poisson)
+    band_totals = np.array([counts[i0:i1].sum() for i0, i1 in bands], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(band_totals)[:-1])) * electron_dtype.itemsize
+    total_electrons = int(band_totals.sum())
+    print(f"行带数: {len(bands)}, 预计电子总数: {total_electrons:,}")
+
+    _remove_existing(file_path)
+    with open(file_path, 'wb') as file:
+        file.truncate(total_electrons * electron_dtype.itemsize)
+
+    tasks = [
+        (file_path, int(offsets[k]), counts[i0:i1], i0, band_seeds[k], xpx, ypx,
+         z, energy, sigma, dx, dy, dz, chunk_electrons)
+        for k, (i0, i1) in enumerate(bands)
+    ]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _, written in pool.map(_write_band, tasks):
+            done += written
+            elapsed = time.time() - start_time
+            print(f"进度: {done * 100 // max(total_electrons, 1)}%, 已处理电子数: {done}, "
+                  f"已用时间: {elapsed:.1f}秒")
+
+    total_time = time.time() - start_time
+    print(f"完成! 总共处理了 {total_electrons:,} 个电子")
+    print(f"总用时: {total_time:.2f} 秒")
+    print(f"文件已保存到: {file_path}")
+    return total_electrons
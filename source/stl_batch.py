@@ -0,0 +1,256 @@
+import argparse
+import multiprocessing
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+"""
+整个目录的 STL 批量转换为 .tri
+
+在进程池中同时转换多个 STL，输出比输入新时跳过，并报告每个文件和总体的吞吐量。
+转换本身仍由已有函数完成:
+    plain: process_stl_to_tri.process_stl_to_tri，每个 STL 生成一个只含样品三角形的 .tri
+    scene: voxel_to_mesh.generate_meshes_from_stl，生成带探测器和环境的 .tri/.trib，
+           可指定多个旋转角度
+
+用法:
+    python stl_batch.py models/ -o tri/ -j 8
+    python stl_batch.py models/ -o tri/ --mode scene --sample-tilt-x 55 --angles 0 90 180 270
+"""
+
+# 各模式默认的坐标缩放因子，与 process_stl_to_tri / generate_mesh_from_stl 的默认值相同
+DEFAULT_SCALE = {'plain': 20, 'scene': 10}
+
+
+def find_stl_files(input_dir, recursive=False):
+    """返回目录下的 .stl 文件 (不区分大小写)，按路径排序。"""
+    input_dir = pathlib.Path(input_dir)
+    candidates = input_dir.rglob('*') if recursive else input_dir.iterdir()
+    return sorted(p for p in candidates if p.is_file() and p.suffix.lower() == '.stl')
+
+
+def is_up_to_date(output_path, input_path):
+    """输出存在且修改时间不早于输入。"""
+    try:
+        return os.stat(output_path).st_mtime_ns >= os.stat(input_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _scene_outputs(stl_path, out_dir, angle, settings):
+    """
+    scene 模式下某个角度已有的 .tri 输出 (文件名中的面片数在读取 STL 之前未知，用 glob 匹配)。
+    """
+    from voxel_to_mesh import stl_tri_filename
+    pattern = stl_tri_filename(stl_path.stem, settings['sample_tilt_x'], settings['sample_tilt_y'],
+                               angle, settings['det_tilt_x'], None)
+    return sorted(out_dir.glob(pattern))
+
+
+def pending_angles(stl_path, out_dir, settings):
+    """
+    scene 模式下还需要生成的角度: 没有输出，或最新的 .tri (及其 .trib) 比 STL 旧。
+
+    STL 修改后面片数可能改变，旧面片数的 .tri 会留在输出目录中，因此只检查最新的一个。
+    """
+    pending = []
+    for angle in settings['angles']:
+        outputs = _scene_outputs(stl_path, out_dir, angle, settings)
+        if not outputs:
+            pending.append(angle)
+            continue
+        newest = max(outputs, key=lambda p: p.stat().st_mtime_ns)
+        newest = [newest, newest.with_suffix('.trib')] if settings['write_binary'] else [newest]
+        if not all(is_up_to_date(p, stl_path) for p in newest):
+            pending.append(angle)
+    return pending
+
+
+def convert_one(stl_path, out_dir, mode, settings):
+    """
+    在工作进程中转换一个 STL。
+
+    返回:
+        dict: stl_path, outputs (生成的 .tri), triangles, seconds,
+              status ('converted' 或 'failed'), error
+    """
+    t_start = time.time()
+    result = {'stl_path': stl_path, 'outputs': [], 'triangles': 0, 'status': 'converted',
+              'error': None}
+    try:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        if mode == 'plain':
+            from process_stl_to_tri import process_stl_to_tri
+            tri_path = out_dir / f'{stl_path.stem}.tri'
+            triangles, tri_path = process_stl_to_tri(str(stl_path), str(tri_path),
+                                                     scale_factor=settings['scale'])
+            if tri_path is None:
+                raise RuntimeError('process_stl_to_tri 转换失败')
+            result['outputs'] = [pathlib.Path(tri_path)]
+            result['triangles'] = triangles
+        else:
+            from voxel_to_mesh import generate_meshes_from_stl
+            meshes = generate_meshes_from_stl(
+                stl_path, out_dir, settings['angles'],
+                scale=settings['scale'],
+                sample_tilt_x=settings['sample_tilt_x'],
+                sample_tilt_y=settings['sample_tilt_y'],
+                det_tilt_x=settings['det_tilt_x'],
+                write_binary=settings['write_binary'],
+                workers=settings['threads'],
+            )
+            result['outputs'] = [m['tri_path'] for m in meshes]
+            result['triangles'] = sum(m['faces'] for m in meshes)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['seconds'] = time.time() - t_start
+    return result
+
+
+def convert_directory(input_dir, out_dir=None, mode='plain', workers=None, recursive=False,
+                      force=False, scale=None, sample_tilt_x=0, sample_tilt_y=0, angles=(0,),
+                      det_tilt_x=0, write_binary=True):
+    """
+    并行转换目录中的所有 STL。
+
+    参数:
+        input_dir: STL 所在目录
+        out_dir: 输出目录，默认与 input_dir 相同；recursive 时保留子目录结构
+        mode: 'plain' (process_stl_to_tri) 或 'scene' (generate_meshes_from_stl)
+        workers: 进程数，默认为 CPU 核数
+        recursive: 是否包含子目录中的 STL
+        force: 为 True 时即使输出比输入新也重新转换
+        scale: 坐标缩放因子，默认取该模式原有的默认值
+        sample_tilt_x, sample_tilt_y, angles, det_tilt_x, write_binary:
+            scene 模式的倾转、旋转角度列表和 .trib 开关
+
+    返回:
+        list: 每个 STL 一个结果字典 (见 convert_one)，跳过的文件 status 为 'skipped'
+    """
+    if mode not in DEFAULT_SCALE:
+        raise ValueError(f"未知的转换模式: {mode}")
+    input_dir = pathlib.Path(input_dir)
+    out_dir = input_dir if out_dir is None else pathlib.Path(out_dir)
+    workers = workers or os.cpu_count() or 1
+    settings = {
+        'scale': DEFAULT_SCALE[mode] if scale is None else scale,
+        'sample_tilt_x': sample_tilt_x,
+        'sample_tilt_y': sample_tilt_y,
+        'angles': list(angles),
+        'det_tilt_x': det_tilt_x,
+        'write_binary': write_binary,
+        # 多个进程同时转换时，每个进程只用一个线程写文件
+        'threads': 1,
+    }
+
+    t_start = time.time()
+    results = {}
+    tasks = []
+    for stl_path in find_stl_files(input_dir, recursive):
+        target_dir = out_dir / stl_path.parent.relative_to(input_dir)
+        if mode == 'plain':
+            todo = force or not is_up_to_date(target_dir / f'{stl_path.stem}.tri', stl_path)
+            task_settings = settings
+        else:
+            if force:
+                task_angles = settings['angles']
+            else:
+                task_angles = pending_angles(stl_path, target_dir, settings)
+            todo = bool(task_angles)
+            task_settings = dict(settings, angles=task_angles)
+        if todo:
+            tasks.append((stl_path, target_dir, task_settings))
+        else:
+            results[stl_path] = {'stl_path': stl_path, 'outputs': [], 'triangles': 0,
+                                 'seconds': 0.0, 'status': 'skipped', 'error': None}
+    print(f"共 {len(tasks) + len(results)} 个STL，需要转换 {len(tasks)} 个，"
+          f"跳过 {len(results)} 个 (输出已是最新)")
+
+    if tasks:
+        # scene 模式可能使用 CUDA，子进程必须以 spawn 方式启动
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as pool:
+            futures = [pool.submit(convert_one, stl_path, target_dir, mode, task_settings)
+                       for stl_path, target_dir, task_settings in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['stl_path']] = result
+                _report_file(result)
+
+    ordered = [results[p] for p in sorted(results)]
+    _report_total(ordered, time.time() - t_start)
+    return ordered
+
+
+def _report_file(result):
+    name = result['stl_path'].name
+    if result['status'] == 'failed':
+        print(f"[失败] {name}: {result['error']}")
+        return
+    rate = result['triangles'] / result['seconds'] if result['seconds'] > 0 else float('inf')
+    print(f"[完成] {name}: {result['triangles']} 个三角形, {len(result['outputs'])} 个输出, "
+          f"用时 {result['seconds']:.2f}s ({rate:.0f} 三角形/秒)")
+
+
+def _report_total(results, wall_time):
+    converted = [r for r in results if r['status'] == 'converted']
+    failed = [r for r in results if r['status'] == 'failed']
+    skipped = len(results) - len(converted) - len(failed)
+    triangles = sum(r['triangles'] for r in converted)
+    busy = sum(r['seconds'] for r in converted + failed)
+    rate = triangles / wall_time if wall_time > 0 else float('inf')
+    parallelism = busy / wall_time if wall_time > 0 else 0.0
+    print(f"批量转换完成: 转换 {len(converted)} 个, 跳过 {skipped} 个, 失败 {len(failed)} 个; "
+          f"共 {triangles} 个三角形, 用时 {wall_time:.1f}s "
+          f"({rate:.0f} 三角形/秒, 平均并行度 {parallelism:.1f})")
+
+
+def _number(text):
+    """命令行中的角度: 整数值保持为 int，使输出文件名与其他入口生成的一致 (例如 0 而不是 0.0)。"""
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(
+        description='Convert every STL in a directory to .tri on a process pool')
+    parser.add_argument('input_dir', help='Directory containing .stl files')
+    parser.add_argument('-o', '--out-dir', help='Output directory; default: the input directory')
+    parser.add_argument('--mode', choices=['plain', 'scene'], default='plain',
+                        help='plain: process_stl_to_tri; '
+                             'scene: generate_mesh_from_stl with detector and environment')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='Number of worker processes; default: CPU count')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Include STLs in subdirectories')
+    parser.add_argument('--force', action='store_true',
+                        help='Convert even when the output is newer than the input')
+    parser.add_argument('--scale', type=float,
+                        help='Coordinate scale factor; default: 20 (plain) or 10 (scene)')
+    parser.add_argument('--sample-tilt-x', type=_number, default=0,
+                        help='scene: sample tilt about X in degrees')
+    parser.add_argument('--sample-tilt-y', type=_number, default=0,
+                        help='scene: sample tilt about Y in degrees')
+    parser.add_argument('--angles', type=_number, nargs='+', default=[0],
+                        help='scene: rotation angles about the sample normal')
+    parser.add_argument('--det-tilt-x', type=_number, default=0,
+                        help='scene: detector tilt about X in degrees')
+    parser.add_argument('--no-trib', action='store_true',
+                        help='scene: do not write the binary .trib companion')
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    convert_directory(
+        args.input_dir, args.out_dir, mode=args.mode, workers=args.workers,
+        recursive=args.recursive, force=args.force, scale=args.scale,
+        sample_tilt_x=args.sample_tilt_x, sample_tilt_y=args.sample_tilt_y,
+        angles=args.angles, det_tilt_x=args.det_tilt_x, write_binary=not args.no_trib,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+import hashlib
+import json
+import multiprocessing
+import pathlib
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
+
+import numpy as np
+
+from analysis import sem_analysis
+from atomic_output import atomic_output, commit, discard, temporary_path
+from gpu_pool import DevicePool, device_env
+from parameters import tri_parameters, pri_parameters
+from nebula_launcher import COMPLETION_GRACE, build_argv, format_argv, is_successful
+from progress_events import ProgressLogger
+from record_pack import pack_file, packed_path
+from run_nebula import nebula_gpu
+from save_parameters import add_frame_to_parameters, save_parameters
+from sem_pri import electron_dtype
+from sweep_manifest import NON_INPUT_KEYS
+
+"""
+多 STL、多角度扫描的流水线调度
+
+每个 (stl, 旋转角度) 是一个任务，分三个阶段:
+1. 准备: 生成 .tri (每个 STL 的第一个角度同时生成 .pri)，在进程池中执行
+2. 模拟: 运行 nebula_gpu，同时运行的数量受 sim_slots 限制
+3. 分析: 由 .det 生成图像，在进程池中执行
+
+三个阶段互相重叠: 任务 N 模拟时，任务 N+1 在准备，任务 N-1 在分析。
+提供 SweepManifest 时，每个任务结束后记录到清单并更新 camera_parameters.json，
+重新运行时跳过清单中已完成的任务。
+
+每个任务在 STL 输出目录下有独立的工作目录 (由角度和任务参数的哈希决定)，
+.tri/.pri/.det/.png 都先写临时文件，完成后原子重命名，多个模拟可以安全地同时运行。
+指定 GPU 列表时，每个模拟从 DevicePool 取得一块空闲 GPU (CUDA_VISIBLE_DEVICES)。
+"""
+
+
+def job_workdir(save_dir, job):
+    """由任务参数确定的工作目录，参数相同时目录相同，不同任务互不覆盖。"""
+    inputs = {k: v for k, v in job.items()
+              if k not in NON_INPUT_KEYS and k not in ('first', 'save_dir')}
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:10]
+    return pathlib.Path(save_dir) / f"angle{job['rotate_angle']}_{digest}"
+
+
+def make_jobs(stl_list, rotate_angle_list, **settings):
+    """
+    为每个 (stl, 旋转角度) 生成一个任务字典。
+
+    参数:
+        stl_list: STL 文件路径列表
+        rotate_angle_list: 绕样品新法线方向的旋转角度列表
+        settings: 所有任务共享的参数，见 auto_run_simulation.py
+    """
+    jobs = []
+    for stl_path in stl_list:
+        stl_path = pathlib.Path(stl_path)
+        save_dir = stl_path.parent / stl_path.name.split('.')[0]
+        for k, rotate_angle in enumerate(rotate_angle_list):
+            job = dict(
+                settings,
+                stl_path=stl_path,
+                save_dir=save_dir,
+                rotate_angle=rotate_angle.item() if hasattr(rotate_angle, 'item') else rotate_angle,
+                first=(k == 0),
+            )
+            job['work_dir'] = job_workdir(save_dir, job)
+            jobs.append(job)
+    return jobs
+
+
+def make_pri(job, roi, d_zmin, d_zmax, stream=False):
+    """按任务参数创建 pri_parameters，.pri (或命名管道) 保存在该任务的工作目录中。"""
+    return pri_parameters(
+        pri_dir=job['work_dir'],
+        pixel_size=job['pixel_size'],
+        energy=job['energy'],
+        epx=job['epx'],
+        sigma=job.get('sigma', 1.0),
+        poisson=job.get('poisson', True),
+        roi_x_min=roi[0],
+        roi_x_max=roi[1],
+        roi_y_min=roi[2],
+        roi_y_max=roi[3],
+        d_zmin=d_zmin,
+        d_zmax=d_zmax,
+        seed=job.get('pri_seed'),
+        stream=stream,
+        cache_dir=job.get('pri_cache_dir'),
+    )
+
+
+def prepare_job(job):
+    """准备阶段: 生成 .tri；每个 STL 的第一个角度同时确定 ROI 并生成 .pri。"""
+    t_start = time.time()
+    work_dir = pathlib.Path(job['work_dir'])
+    work_dir.mkdir(parents=True, exist_ok=True)
+    TRI = tri_parameters(
+        stl_path=job['stl_path'],
+        mesh_path=work_dir,
+        beam_type=job.get('beam_type', 'ion'),
+        sample_tilt_x=job.get('sample_tilt_x', 0),
+        sample_tilt_y=0,
+        sample_tilt_new_z=job['rotate_angle'],
+        det_tilt_x=job.get('det_tilt_x', 0),
+    )
+    v, faces, d_zmin, d_zmax, tri_file_path, R = TRI.run()
+    result = {
+        'tri_path': pathlib.Path(tri_file_path),
+        'd_zmin': float(d_zmin),
+        'd_zmax': float(d_zmax),
+        'R': R.tolist() if hasattr(R, 'tolist') else R,
+        'roi': None,
+        'pri_path': None,
+    }
+    if job['first']:
+        # 以第一个角度的模型范围作为该 STL 所有角度的 ROI
+        result['roi'] = [
+            int(np.floor(float(v[:, 0].min()))),
+            int(np.ceil(float(v[:, 0].max()))),
+            int(np.floor(float(v[:, 1].min()))),
+            int(np.ceil(float(v[:, 1].max()))),
+        ]
+        if not job.get('stream_pri', False):
+            result['pri_path'] = pathlib.Path(make_pri(job, result['roi'], d_zmin, d_zmax).run())
+    result['prepare_time'] = time.time() - t_start
+    return result
+
+
+def simulate_job(job, prepared, first, device=None):
+    """
+    模拟阶段: 在任务工作目录中运行 nebula_gpu，.det 与 .png 与该角度的 .tri 同名。
+    nebula_gpu 输出到临时文件，进程结束后才重命名为 .det。
+    任务参数 compress_det 为 'zlib' 或 'lzma' 时改为压缩成 .det.pack，不保留原始 .det。
+    device 不为 None 时只让 nebula_gpu 看到该 GPU。
+    """
+    t_start = time.time()
+    tri_path = prepared['tri_path']
+    pri_path = first['pri_path']
+    PRI = None
+    if job.get('stream_pri', False):
+        # 命名管道只能被读取一次，每个角度重新启动流式输出
+        PRI = make_pri(job, first['roi'], first['d_zmin'], first['d_zmax'], stream=True)
+        pri_path = PRI.run()
+
+    if not pathlib.Path(job['nebula_gpu_path']).is_file():
+        raise FileNotFoundError(f"可执行文件 {job['nebula_gpu_path']} 不存在")
+    if not tri_path.exists():
+        raise FileNotFoundError(f"文件 {tri_path} 不存在")
+    if not pathlib.Path(pri_path).exists():
+        raise FileNotFoundError(f"文件 {pri_path} 不存在")
+
+    det_path = tri_path.with_suffix('.det')
+    image_path = tri_path.with_suffix('.png')
+    tmp_det_path = temporary_path(det_path)
+    command = build_argv(job['nebula_gpu_path'], tri_path, pri_path, job['mat_paths'])
+    print(f"运行命令: {format_argv(command, det_path)}")
+    on_progress = None
+    if job.get('progress_log', False):
+        # 进度事件记录到工作目录下的 progress.csv，可用于统计每次运行的速率
+        on_progress = ProgressLogger(pathlib.Path(job['work_dir']) / 'progress.csv',
+                                     run_id=det_path.stem)
+    runner = nebula_gpu(
+        command=command,
+        sem_simu_result=tmp_det_path,
+        image_path=image_path,
+        live_interval=job.get('live_interval'),
+        analyze=False,
+        cwd=job['work_dir'],
+        env=device_env(device) if device is not None else None,
+        on_progress=on_progress,
+        completion_grace=job.get('completion_grace', COMPLETION_GRACE),
+    )
+    try:
+        return_code = runner.run()
+    finally:
+        if PRI is not None and PRI.pri_stream is not None:
+            PRI.pri_stream.close()
+    try:
+        if PRI is not None and PRI.pri_stream is not None:
+            # 生成或写管道出错时 nebula_gpu 读到的是截断的 .pri，结果不能作为完成的任务
+            PRI.pri_stream.check()
+        if return_code is None or not tmp_det_path.exists():
+            raise RuntimeError(f"nebula_gpu 运行失败，未生成 {det_path}")
+        # 与 run_nebula 相同的判断: 进度 100% 后由启动器终止的进程也视为成功
+        if not is_successful(runner.result):
+            raise RuntimeError(
+                f"nebula_gpu 运行失败，状态码 {return_code} (状态: {runner.result['status']})")
+    except BaseException:
+        discard(tmp_det_path)
+        raise
+    if job.get('compress_det'):
+        # 分析阶段和清单直接使用压缩文件 (analysis 可以读取)
+        det_path = packed_path(det_path)
+        try:
+            packed = pack_file(tmp_det_path, det_path, electron_dtype, job['compress_det'])
+        finally:
+            discard(tmp_det_path)
+        print(f"{det_path.name}: {packed['raw_bytes'] / 2**20:.1f} MB "
+              f"压缩为 {packed['packed_bytes'] / 2**20:.1f} MB, 用时 {packed['seconds']:.1f}s")
+    else:
+        commit(tmp_det_path, det_path)
+    return {
+        'pri_path': pathlib.Path(pri_path),
+        'det_path': det_path,
+        'image_path': image_path,
+        'return_code': return_code,
+        'device': device,
+        'detected': runner.result['detected'] if runner.result is not None else None,
+        'primary_rate': runner.result['primary_rate'] if runner.result is not None else None,
+        'sim_time': time.time() - t_start,
+    }
+
+
+def analyze_job(det_path, image_path):
+    """分析阶段: 由 .det 生成图像，返回用时。"""
+    t_start = time.time()
+    with atomic_output(image_path) as tmp_path:
+        sem_analysis(det_path, tmp_path, plot=False, save=True)
+    return time.time() - t_start
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+class SweepScheduler:
+    def __init__(self, jobs, prepare_workers=1, sim_slots=None, analysis_workers=1, manifest=None,
+                 devices=None):
+        """
+        参数:
+            jobs: make_jobs 生成的任务列表
+            prepare_workers: 准备阶段 (.tri/.pri 生成) 的进程数
+            sim_slots: 同时运行的 nebula_gpu 数量，为 None 时等于 GPU 数量 (未指定 devices 时为 1)
+            analysis_workers: 分析阶段的进程数
+            manifest: SweepManifest，为 None 时不记录清单也不跳过任务
+            devices: GPU 编号列表，或 'auto' 自动检测；为 None 时不指定设备
+        """
+        self.jobs = jobs
+        self.prepare_workers = prepare_workers
+        self.device_pool = None
+        if devices is not None:
+            self.device_pool = DevicePool(None if devices == 'auto' else devices)
+            print(f"使用GPU: {', '.join(self.device_pool.devices)}")
+        if sim_slots is None:
+            sim_slots = len(self.device_pool) if self.device_pool is not None else 1
+        self.sim_slots = sim_slots
+        self.analysis_workers = analysis_workers
+        self.manifest = manifest
+        self.results = [{'job': job, 'status': 'pending'} for job in jobs]
+        self.to_run = len(jobs)
+        self.finished = 0
+        self.start_time = None
+
+    def _simulate(self, i, prepare_future, first_future):
+        prepared = prepare_future.result()
+        self.results[i].update(prepared)
+        first = first_future.result()
+        if self.device_pool is None:
+            return simulate_job(self.jobs[i], prepared, first)
+        with self.device_pool.device() as device:
+            return simulate_job(self.jobs[i], prepared, first, device)
+
+    def _report(self, i):
+        result = self.results[i]
+        job = result['job']
+        elapsed = time.time() - self.start_time
+        remaining = elapsed / self.finished * (self.to_run - self.finished)
+        timings = ", ".join(
+            f"{name}: {result[key]:.1f}s"
+            for name, key in (('准备', 'prepare_time'), ('模拟', 'sim_time'),
+                              ('分析', 'analysis_time'))
+            if key in result
+        )
+        print(f"[进度] {self.finished}/{self.to_run} {job['stl_path'].name} "
+              f"角度 {job['rotate_angle']} {result['status']} ({timings}) | "
+              f"已用 {_format_seconds(elapsed)}, 预计剩余 {_format_seconds(remaining)}")
+
+    def _finish(self, i, status):
+        self.results[i]['status'] = status
+        self.finished += 1
+        self._report(i)
+        if self.manifest is not None:
+            self.manifest.record(self.results[i])
+            stl_path = self.jobs[i]['stl_path']
+            save_camera_parameters([r for r in self.results if r['job']['stl_path'] == stl_path])
+
+    def _fail(self, i, error):
+        self.results[i]['error'] = str(error)
+        job = self.jobs[i]
+        print(f"[ERROR] 任务 {job['stl_path'].name} 角度 {job['rotate_angle']} 失败: {error}")
+        self._finish(i, 'failed')
+
+    def _restore_prepare(self, i, prepare_pool):
+        """已完成任务的准备结果：.pri 仍然存在时直接复用清单中的记录，否则重新准备。"""
+        result = self.results[i]
+        pri_path = result.get('pri_path')
+        if self.jobs[i].get('stream_pri', False) or (pri_path is not None and pri_path.exists()):
+            future = Future()
+            future.set_result(result)
+            return future
+        return prepare_pool.submit(prepare_job, self.jobs[i])
+
+    def run(self):
+        """运行全部任务，返回与 jobs 顺序一致的结果列表。"""
+        self.start_time = time.time()
+        # 准备阶段会使用 CUDA，子进程必须以 spawn 方式启动
+        context = multiprocessing.get_context('spawn')
+        first_index = {}
+        for i, job in enumerate(self.jobs):
+            first_index.setdefault(job['stl_path'], i)
+
+        completed = self.manifest.completed(self.jobs) if self.manifest is not None else {}
+        for i, result in completed.items():
+            self.results[i] = result
+        self.to_run = len(self.jobs) - len(completed)
+        if completed:
+            print(f"跳过 {len(completed)} 个已完成的任务，剩余 {self.to_run} 个")
+
+        with ProcessPoolExecutor(self.prepare_workers, mp_context=context) as prepare_pool, \
+                ThreadPoolExecutor(self.sim_slots) as sim_pool, \
+                ProcessPoolExecutor(self.analysis_workers, mp_context=context) as analysis_pool:
+            prepare_futures = {}
+            for i, job in enumerate(self.jobs):
+                if i in completed:
+                    continue
+                first = first_index[job['stl_path']]
+                if first in completed and first not in prepare_futures:
+                    # 同一 STL 的其他角度仍依赖第一个角度的 ROI 和 .pri
+                    prepare_futures[first] = self._restore_prepare(first, prepare_pool)
+                prepare_futures[i] = prepare_pool.submit(prepare_job, job)
+            stage = {}
+            for i, job in enumerate(self.jobs):
+                if i in completed:
+                    continue
+                future = sim_pool.submit(self._simulate, i, prepare_futures[i],
+                                         prepare_futures[first_index[job['stl_path']]])
+                stage[future] = ('simulate', i)
+
+            pending = set(stage)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, i = stage.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        self._fail(i, e)
+                        continue
+                    if name == 'simulate':
+                        self.results[i].update(value)
+                        future = analysis_pool.submit(analyze_job, value['det_path'],
+                                                      value['image_path'])
+                        stage[future] = ('analyze', i)
+                        pending.add(future)
+                    else:
+                        self.results[i]['analysis_time'] = value
+                        self._finish(i, 'done')
+
+        total = time.time() - self.start_time
+        failed = sum(1 for r in self.results if r['status'] == 'failed')
+        print(f"扫描完成! 共 {len(self.jobs)} 个任务, 失败 {failed} 个, "
+              f"总用时 {_format_seconds(total)}")
+        if self.device_pool is not None:
+            self.device_pool.report()
+        return self.results
+
+
+def save_camera_parameters(results):
+    """按 STL 汇总成功任务的旋转矩阵，写入各自输出目录下的 camera_parameters.json。"""
+    by_stl = {}
+    for result in results:
+        by_stl.setdefault(result['job']['stl_path'], []).append(result)
+
+    for stl_path, stl_results in by_stl.items():
+        roi_array = stl_results[0].get('roi')
+        frames = [r for r in stl_results if r['status'] == 'done']
+        if roi_array is None or not frames:
+            continue
+        parameters = {
+            "camera": {
+                "width": roi_array[1] - roi_array[0] + 1,
+                "height": roi_array[3] - roi_array[2] + 1,
+                "cx": (roi_array[1] - roi_array[0] + 1) / 2,
+                "cy": (roi_array[3] - roi_array[2] + 1) / 2,
+            },
+            "frames": [],
+        }
+        for r in frames:
+            parameters = add_frame_to_parameters(
+                parameters,
+                str(r['image_path']),
+                json.dumps(r['R']),
+                json.dumps([0.0, 0.0, 0.0])
+            )
+        parameters_path = pathlib.Path(stl_results[0]['job']['save_dir']) / "camera_parameters.json"
+        save_parameters(parameters, parameters_path)
+        print(f"相机参数已保存至: {parameters_path}")
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+"""
+扫描任务清单
+
+以 JSON lines 格式记录扫描中每个任务的输入哈希、输出路径、状态和各阶段用时，
+每完成 (或失败) 一个任务追加一行，同一任务以最后一行为准。
+扫描中断后重新运行时，输入未变化且输出文件仍然存在的已完成任务会被跳过。
+"""
+
+# 不影响输出结果的任务参数，不参与输入哈希 (compress_det 只改变 .det 的存储格式)
+NON_INPUT_KEYS = {'live_interval', 'progress_log', 'completion_grace', 'compress_det'}
+
+# 清单中以路径形式保存的字段
+PATH_KEYS = ('tri_path', 'pri_path', 'det_path', 'image_path')
+
+# 从任务结果写入清单的字段
+RECORD_KEYS = PATH_KEYS + ('roi', 'd_zmin', 'd_zmax', 'R', 'return_code', 'device', 'detected',
+                           'primary_rate', 'prepare_time', 'sim_time', 'analysis_time', 'error')
+
+
+def job_id(job):
+    """任务的唯一标识: STL 路径与旋转角度。"""
+    return f"{job['stl_path']}|{job['rotate_angle']}"
+
+
+def job_inputs_hash(job):
+    """任务输入的哈希，包括任务参数以及 STL 文件的大小和修改时间。"""
+    inputs = {k: v for k, v in job.items() if k not in NON_INPUT_KEYS}
+    stl_path = pathlib.Path(job['stl_path'])
+    if stl_path.exists():
+        stat = stl_path.stat()
+        inputs['_stl_stat'] = [stat.st_size, stat.st_mtime_ns]
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class SweepManifest:
+    def __init__(self, manifest_path):
+        """
+        参数:
+            manifest_path: 清单文件路径 (.jsonl)
+        """
+        self.manifest_path = pathlib.Path(manifest_path)
+        self.entries = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 上次中断时可能只写了半行
+                        continue
+                    self.entries[entry['id']] = entry
+
+    def record(self, result):
+        """追加一个任务结果。"""
+        job = result['job']
+        entry = {
+            'id': job_id(job),
+            'inputs_hash': job_inputs_hash(job),
+            'status': result['status'],
+            'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        for key in RECORD_KEYS:
+            if key in result:
+                value = result[key]
+                entry[key] = str(value) if key in PATH_KEYS and value is not None else value
+        self.entries[entry['id']] = entry
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed(self, jobs):
+        """
+        返回可以跳过的任务: {任务下标: 由清单恢复的结果}。
+
+        条件是状态为 done、输入哈希一致，并且 .det 与图像文件仍然存在。
+        """
+        done = {}
+        for i, job in enumerate(jobs):
+            entry = self.entries.get(job_id(job))
+            if entry is None or entry['status'] != 'done':
+                continue
+            if entry['inputs_hash'] != job_inputs_hash(job):
+                continue
+            if not all(entry.get(k) and os.path.exists(entry[k])
+                       for k in ('det_path', 'image_path')):
+                continue
+            result = {'job': job, 'status': 'done', 'skipped': True}
+            for key in RECORD_KEYS:
+                if key in entry:
+                    value = entry[key]
+                    if key in PATH_KEYS and value is not None:
+                        value = pathlib.Path(value)
+                    result[key] = value
+            done[i] = result
+        return done
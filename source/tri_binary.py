@@ -0,0 +1,120 @@
+import argparse
+import pathlib
+
+import numpy as np
+
+"""
+.trib 二进制三角形文件
+
+文本 .tri 每行为: 材料1 材料2 x0 y0 z0 x1 y1 z1 x2 y2 z2。
+.trib 是它的紧凑二进制伴随文件，布局为:
+    头部 16 字节: 魔数 b'TRIB', 版本号 (uint32), 三角形数量 (uint64)
+    每个三角形 40 字节: 材料1, 材料2 (int16), 9 个顶点坐标 (float32)
+均为小端序。读取时使用 np.memmap，不需要解析文本。
+
+坐标以 float32 存储，与模拟器解析 .tri 时使用的精度相同；.trib 转回 .tri 时使用
+'%.9g' 输出，保证 tri -> trib -> tri -> trib 往返后数据逐位一致。
+"""
+
+TRIB_MAGIC = b'TRIB'
+TRIB_VERSION = 1
+TRIB_HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'), ('count', '<u8')])
+TRIB_DTYPE = np.dtype([('m1', '<i2'), ('m2', '<i2'), ('v', '<f4', (9,))])
+
+
+def parse_tri_text(text):
+    """
+    解析 .tri 文本，忽略空行和多余空白。
+
+    返回:
+        tuple: (materials (N, 2) int16, triangles (N, 9) float32)
+    """
+    values = np.array(text.split(), dtype=np.float64)
+    if values.size % 11 != 0:
+        raise ValueError(f".tri 数据列数不正确: 共 {values.size} 个数值，不是 11 的倍数")
+    rows = values.reshape(-1, 11)
+    return rows[:, :2].astype(np.int16), rows[:, 2:].astype(np.float32)
+
+
+def write_trib(trib_path, materials, triangles):
+    """
+    写出 .trib 文件
+
+    参数:
+        trib_path: 输出路径
+        materials: (N, 2) 材料编号
+        triangles: (N, 9) 顶点坐标
+    """
+    materials = np.asarray(materials)
+    triangles = np.asarray(triangles)
+    records = np.empty(len(triangles), dtype=TRIB_DTYPE)
+    records['m1'] = materials[:, 0]
+    records['m2'] = materials[:, 1]
+    records['v'] = triangles
+    header = np.array([(TRIB_MAGIC, TRIB_VERSION, len(records))], dtype=TRIB_HEADER_DTYPE)
+    with open(trib_path, 'wb') as f:
+        header.tofile(f)
+        records.tofile(f)
+    return pathlib.Path(trib_path)
+
+
+def read_trib(trib_path):
+    """
+    以内存映射方式读取 .trib 文件
+
+    返回:
+        np.memmap: 结构化数组，字段为 m1, m2, v (9 个 float32)
+    """
+    header = np.fromfile(trib_path, dtype=TRIB_HEADER_DTYPE, count=1)
+    if len(header) != 1 or header['magic'][0] != TRIB_MAGIC:
+        raise ValueError(f"不是有效的 .trib 文件: {trib_path}")
+    if header['version'][0] != TRIB_VERSION:
+        raise ValueError(f"不支持的 .trib 版本: {header['version'][0]}")
+    count = int(header['count'][0])
+    if count == 0:
+        return np.empty(0, dtype=TRIB_DTYPE)
+    return np.memmap(trib_path, dtype=TRIB_DTYPE, mode='r',
+                     offset=TRIB_HEADER_DTYPE.itemsize, shape=(count,))
+
+
+def tri_to_trib(tri_path, trib_path=None):
+    """把文本 .tri 转换为 .trib，默认输出到同名 .trib 文件。"""
+    tri_path = pathlib.Path(tri_path)
+    trib_path = tri_path.with_suffix('.trib') if trib_path is None else pathlib.Path(trib_path)
+    materials, triangles = parse_tri_text(tri_path.read_text())
+    return write_trib(trib_path, materials, triangles)
+
+
+def trib_to_tri(trib_path, tri_path=None, block_size=100000):
+    """把 .trib 转换回文本 .tri，默认输出到同名 .tri 文件。"""
+    trib_path = pathlib.Path(trib_path)
+    tri_path = trib_path.with_suffix('.tri') if tri_path is None else pathlib.Path(tri_path)
+    records = read_trib(trib_path)
+    row_format = '%d %d ' + ' '.join(['%.9g'] * 9) + '\n'
+    with open(tri_path, 'w') as f:
+        for start in range(0, len(records), block_size):
+            block = records[start:start + block_size]
+            rows = np.column_stack([block['m1'], block['m2'], block['v'].astype(np.float64)])
+            f.write((row_format * len(block)) % tuple(rows.ravel().tolist()))
+    return tri_path
+
+
+def _build_cli():
+    parser = argparse.ArgumentParser(description='Convert between text .tri and binary .trib')
+    parser.add_argument('input', help='Path to input .tri or .trib file')
+    parser.add_argument('output', nargs='?',
+                        help='Path to output file; default: input with swapped suffix')
+    return parser
+
+
+def main():
+    args = _build_cli().parse_args()
+    if args.input.lower().endswith('.trib'):
+        out = trib_to_tri(args.input, args.output)
+    else:
+        out = tri_to_trib(args.input, args.output)
+    print(f"转换完成! 输出文件: {out}")
+
+
+if __name__ == '__main__':
+    main()
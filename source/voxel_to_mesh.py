@@ -1,16 +1,147 @@
 import os
 os.environ['PYOPENGL_PLATFORM'] = 'egl' 
 import pathlib
-from skimage import io
 import time
 import numpy as np
-import torch
-from torchmcubes import marching_cubes
 import random
 import math
-import trimesh  # 用于读取STL文件
+import collections
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from rotation_matrix import rotation_matrix
-def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sample_tilt_x=0, sample_tilt_new_z=0, sample_tilt_y=0, det_tilt_x=0, det_tilt_y=0):  # final_side设置为1000
+from tri_binary import parse_tri_text, write_trib
+from atomic_output import atomic_output
+
+# torch、torchmcubes、skimage、trimesh 导入较慢，在第一次使用时才导入，
+# 只生成 .pri 或只做分析的流程不需要为它们付出启动时间。
+# STL 路径中 torch 是可选的: 未安装时顶点以 numpy 数组在 CPU 上计算。
+
+# 内存中保留的已加载网格数量 (按 STL 路径、修改时间和缩放因子区分)
+MESH_CACHE_SIZE = 4
+
+_mesh_cache = collections.OrderedDict()
+_mesh_cache_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _torch():
+    """返回 torch 模块，未安装时返回 None。"""
+    try:
+        import torch
+    except ImportError:
+        return None
+    return torch
+
+
+def _mesh_device():
+    torch = _torch()
+    return 'cuda' if torch is not None and torch.cuda.is_available() else 'cpu'
+
+
+def _as_mesh_array(array):
+    """把 numpy 数组转换为网格计算使用的数组: 有 torch 时为所在设备上的张量，否则原样返回。"""
+    torch = _torch()
+    if torch is None:
+        return array
+    return torch.from_numpy(np.ascontiguousarray(array)).to(_mesh_device())
+
+
+def _apply_sample_tilt(verts, sample_tilt_x=0, sample_tilt_y=0):
+    """返回先绕X轴、再绕Y轴倾转后的顶点副本。"""
+    v = verts.copy()
+    if sample_tilt_x != 0:
+        tilt_x_rad = math.radians(sample_tilt_x)
+        cos_tx = math.cos(tilt_x_rad)
+        sin_tx = math.sin(tilt_x_rad)
+        y = v[:, 1] * cos_tx - v[:, 2] * sin_tx
+        z = v[:, 1] * sin_tx + v[:, 2] * cos_tx
+        v[:, 1] = y
+        v[:, 2] = z
+    if sample_tilt_y != 0:
+        tilt_y_rad = math.radians(sample_tilt_y)
+        cos_ty = math.cos(tilt_y_rad)
+        sin_ty = math.sin(tilt_y_rad)
+        x = v[:, 0] * cos_ty + v[:, 2] * sin_ty
+        z = -v[:, 0] * sin_ty + v[:, 2] * cos_ty
+        v[:, 0] = x
+        v[:, 2] = z
+    return v
+
+
+def _new_z_matrix(sample_tilt_x=0, sample_tilt_y=0, sample_tilt_new_z=0):
+    # 同时有 X、Y 倾转时以 Y 倾转后的法线为旋转轴
+    if sample_tilt_y != 0:
+        R = rotation_matrix(tilt_y=sample_tilt_y, rotate_angle=sample_tilt_new_z)
+    else:
+        R = rotation_matrix(tilt_x=sample_tilt_x, rotate_angle=sample_tilt_new_z)
+    return np.asarray(R, dtype=np.float32)
+
+
+def new_z_rotation(sample_tilt_x=0, sample_tilt_y=0, sample_tilt_new_z=0):
+    """
+    绕倾转后样品表面法线旋转 sample_tilt_new_z 度的 3x3 旋转矩阵 (float32)，
+    与 load_tilted_mesh 返回的顶点位于同一设备。
+    """
+    return _as_mesh_array(_new_z_matrix(sample_tilt_x, sample_tilt_y, sample_tilt_new_z))
+
+
+def load_tilted_mesh(stl_path, scale=10, sample_tilt_x=0, sample_tilt_y=0):
+    """
+    读取 STL 并把顶点缩放、居中、倾转，结果保留在内存 (或显存) 中。
+
+    缓存键为 (路径, 修改时间, 缩放因子)，STL 被修改后自动重新读取；同一模型的每种倾转只计算一次。
+    生成同一模型的多个旋转角度时，每个角度只需要再做一次 3x3 矩阵乘法。
+
+    返回:
+        tuple: (倾转后的顶点, 面片, 模型边长)，顶点和面片由缓存共享，调用方不能原地修改。
+               安装了 torch 时顶点和面片为 torch 张量 (有 GPU 时位于 GPU)，否则为 numpy 数组。
+    """
+    stl_path = pathlib.Path(stl_path)
+    key = (str(stl_path.resolve()), stl_path.stat().st_mtime_ns, scale)
+    with _mesh_cache_lock:
+        entry = _mesh_cache.get(key)
+        if entry is None:
+            import trimesh  # 用于读取STL文件
+            mesh = trimesh.load(stl_path)
+            # 如果stl模型的单位为微米，获取顶点和面，并把顶点坐标视为0.001倍的微米单位，
+            # 并把0.001微米单位转为纳米，纯粹为了加速计算。
+            verts = np.asarray(mesh.vertices * scale, dtype=np.float32)
+            # 计算模型的边界框，并将模型中心移到原点
+            bbox_min = verts.min(axis=0)
+            bbox_max = verts.max(axis=0)
+            # 这里的处理暂时不用参数final_side来控制大小，直接使用模型实际的边长
+            final_side = float(max(bbox_max - bbox_min))
+            verts -= (bbox_min + bbox_max) / 2
+            entry = {
+                'verts': verts,
+                'faces': _as_mesh_array(np.asarray(mesh.faces, dtype=np.int32)),
+                'final_side': final_side,
+                'tilted': {},
+            }
+            # 同一 STL 被修改后，旧版本的缓存不再需要
+            for old_key in [k for k in _mesh_cache if k[0] == key[0]]:
+                del _mesh_cache[old_key]
+            _mesh_cache[key] = entry
+            while len(_mesh_cache) > MESH_CACHE_SIZE:
+                _mesh_cache.popitem(last=False)
+        else:
+            _mesh_cache.move_to_end(key)
+        tilt = (sample_tilt_x, sample_tilt_y)
+        if tilt not in entry['tilted']:
+            entry['tilted'][tilt] = _as_mesh_array(
+                _apply_sample_tilt(entry['verts'], sample_tilt_x, sample_tilt_y))
+        return entry['tilted'][tilt], entry['faces'], entry['final_side']
+
+def clear_mesh_cache():
+    """释放缓存的网格 (例如在显存紧张时)。"""
+    with _mesh_cache_lock:
+        _mesh_cache.clear()
+
+
+def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sample_tilt_x=0,
+                           sample_tilt_new_z=0, sample_tilt_y=0, det_tilt_x=0, det_tilt_y=0,
+                           write_binary=True):  # final_side设置为1000
     """
     从STL文件生成网格
     
@@ -22,6 +153,7 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
         tilt_x: X轴旋转角度
         tilt_y: Y轴旋转角度
         pad_scale: 填充缩放因子
+        write_binary: 是否在.tri旁边同时写出二进制.trib伴随文件
     """
     stl_path = sanitize_path(stl_path)
     output_path = sanitize_path(output_path)
@@ -30,96 +162,50 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
     # 保留原始文件名
     name = stl_path.stem
     
-    # 读取STL文件
+    # 读取STL文件 (同一模型的后续角度直接使用缓存的倾转后顶点)
     t_start = time.time()
-    mesh = trimesh.load(stl_path)
-    
-    
-    #verts = torch.tensor(mesh.vertices * 1000, dtype=torch.float32).cuda()   # 获取顶点和面，并把顶点坐标从微米转为纳米
-    # 如果stl模型的单位为微米，获取顶点和面，并把顶点坐标视为0.001倍的微米单位，并把0.001微米单位转为纳米，纯粹为了加速计算。  
-    verts = torch.tensor(mesh.vertices * scale, dtype=torch.float32).to('cuda' if torch.cuda.is_available() else 'cpu')   
-    #verts = torch.tensor(mesh.vertices * 10, dtype=torch.float32).cuda()
-    faces = torch.tensor(mesh.faces, dtype=torch.int32).to('cuda' if torch.cuda.is_available() else 'cpu')
+    tilted, faces, final_side = load_tilted_mesh(stl_path, scale, sample_tilt_x, sample_tilt_y)
     t_end = time.time()
     
     #(f"顶点数: {verts.size(0)}, 面片数: {faces.size(0)}, 用时: {t_end - t_start:.1f}s")
-    #print(torch.max(verts, dim=0), torch.min(verts, dim=0))
-    
-    # 计算模型的边界框
-    bbox_min = torch.min(verts, dim=0).values
-    bbox_max = torch.max(verts, dim=0).values
-    bbox_size = bbox_max - bbox_min
-    
-    # 计算缩放因子，使模型适应指定大小。这里的处理暂时不用这个final_side来控制大小
-    final_side = max(bbox_size)
-    final_size_scale = final_side / max(bbox_size)
-    #print(f"缩放因子: {scale:.6f}")
-    # 复制顶点进行变换
-    v = verts.clone()
-    
-    # 将模型中心移到原点
-    v -= (bbox_min + bbox_max) / 2
-    
-    # 应用缩放
-    v *= final_size_scale
-    
-    # 预先定义旋转变量，避免在后续代码中未定义的问题
-    cos_tx = cos_ty = 1.0
-    sin_tx = sin_ty = 0.0
-    R = torch.eye(3, device=v.device).float()
-    # Apply tilts
-    if sample_tilt_x != 0 or sample_tilt_y != 0:
-        if sample_tilt_x != 0:
-            tilt_x_rad = math.radians(sample_tilt_x)
-            cos_tx = math.cos(tilt_x_rad)
-            sin_tx = math.sin(tilt_x_rad)
-            y = v[:, 1] * cos_tx - v[:, 2] * sin_tx
-            z = v[:, 1] * sin_tx + v[:, 2] * cos_tx
-            v[:, 1] = y
-            v[:, 2] = z
 
-            # 绕x轴旋转后，如果样品倾转角为55度，绕样品表面法线方向旋转
-            
-            # 计算旋转角度（弧度）
-            # tilt_new_z_rad = math.radians(sample_tilt_new_z)
-             #tilt_new_z_rad_tensor = torch.tensor(tilt_new_z_rad, device=v.device)
-            
-            # 计算新的Z轴方向（样品表面法线方向）- 预计算常量
-            # 当样品倾转角为55度时，新的Z轴方向为 [0, -sin(55°), cos(55°)]
-            # rotation_axis = torch.tensor([0, -sin_tx, cos_tx], device=v.device)
-            R = torch.tensor(rotation_matrix(tilt_x=sample_tilt_x, rotate_angle=sample_tilt_new_z), dtype=torch.float32).to('cuda' if torch.cuda.is_available() else 'cpu')
-            points = torch.stack([v[:, 0], v[:, 1], v[:, 2]], dim=1)
-            rotated_points = torch.mm(points, R.T)  # 矩阵乘法
+    # 绕样品表面法线方向 (倾转后的新Z轴) 旋转
+    R = new_z_rotation(sample_tilt_x, sample_tilt_y, sample_tilt_new_z)
+    v = tilted @ R.T  # 矩阵乘法
+    d_zmin, d_zmax, mesh_path = _write_stl_tri(v, faces, final_side, mesh_path, name, sample_tilt_x,
+                                               sample_tilt_y, sample_tilt_new_z, det_tilt_x,
+                                               write_binary)
+    return v, faces, d_zmin, d_zmax, mesh_path, R
 
-        if sample_tilt_y != 0:
-            tilt_y_rad = math.radians(sample_tilt_y)
-            cos_ty = math.cos(tilt_y_rad)
-            sin_ty = math.sin(tilt_y_rad)
-            x = v[:, 0] * cos_ty + v[:, 2] * sin_ty
-            z = -v[:, 0] * sin_ty + v[:, 2] * cos_ty
-            v[:, 0] = x
-            v[:, 2] = z
 
-            # # 绕 Y 轴旋转后的旋转轴方向（新的 Z 轴方向）
-            # rotation_axis = torch.tensor([sin_ty, 0, cos_ty], device=v.device)
-            R = rotation_matrix(tilt_y=sample_tilt_y, rotate_angle=sample_tilt_new_z)
-            R = torch.tensor(R, dtype=torch.float32).to('cuda' if torch.cuda.is_available() else 'cpu')
-            points = torch.stack([v[:, 0], v[:, 1], v[:, 2]], dim=1)
-            rotated_points = torch.mm(points, R.T)  # 矩阵乘法
-        # 更新顶点坐标
-        v[:, 0] = rotated_points[:, 0]
-        v[:, 1] = rotated_points[:, 1]
-        v[:, 2] = rotated_points[:, 2]
-    else:
-        R = torch.tensor(rotation_matrix(rotate_angle=sample_tilt_new_z), dtype=torch.float32).to('cuda' if torch.cuda.is_available() else 'cpu')
-        points = torch.stack([v[:, 0], v[:, 1], v[:, 2]], dim=1)
-        rotated_points = torch.mm(points, R.T)  # 矩阵乘法
+def stl_tri_filename(name, sample_tilt_x, sample_tilt_y, sample_tilt_new_z, det_tilt_x, num_faces):
+    """
+    generate_mesh_from_stl 输出的 .tri 文件名，只对文件名做文件系统兼容的字符替换。
+    num_faces 为 None 时返回匹配任意面片数的 glob 模式 (例如在读取 STL 之前查找已有输出)。
+    """
+    prefix = (f'{name}_stl_to_tri_sampleTiltx{sample_tilt_x}_sampleTilty{sample_tilt_y}'
+              f'_sampleTiltNewZ{sample_tilt_new_z}_detTiltx{det_tilt_x}_')
+    prefix = ''.join(c if c.isalnum() or c in '_-.' else '_' for c in prefix)
+    return prefix + ('*' if num_faces is None else str(num_faces)) + '.tri'
+
 
-        # 更新顶点坐标
-        v[:, 0] = rotated_points[:, 0]
-        v[:, 1] = rotated_points[:, 1]
-        v[:, 2] = rotated_points[:, 2]
+def _write_stl_tri(v, faces, final_side, mesh_path, name, sample_tilt_x, sample_tilt_y,
+                   sample_tilt_new_z, det_tilt_x, write_binary=True):
+    """
+    把旋转后的样品顶点连同探测器和环境三角形写成 .tri (以及 .trib)。
 
+    返回:
+        tuple: (探测器最低 z, 探测器最高 z, .tri 文件路径)
+    """
+    # 预先定义旋转变量，供下面的基础平面使用
+    cos_tx = cos_ty = 1.0
+    sin_tx = sin_ty = 0.0
+    if sample_tilt_x != 0:
+        cos_tx = math.cos(math.radians(sample_tilt_x))
+        sin_tx = math.sin(math.radians(sample_tilt_x))
+    if sample_tilt_y != 0:
+        cos_ty = math.cos(math.radians(sample_tilt_y))
+        sin_ty = math.sin(math.radians(sample_tilt_y))
 
     # 因为模型中心在坐标原点
     xmin = ymin = -final_side / 2
@@ -129,12 +215,12 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
     base_z = -final_side / 2  
 
     # Define base points
-    base_points = torch.tensor([
+    base_points = np.array([
         [xmax, ymin, base_z],
         [xmin, ymin, base_z],
         [xmax, ymax, base_z],
         [xmin, ymax, base_z]
-    ], dtype=torch.float32)
+    ], dtype=np.float32)
 
     # Apply rotations to base points
     if sample_tilt_x != 0 or sample_tilt_y != 0:
@@ -277,7 +363,7 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
     d_xmin, d_xmax = np.min(detector_x), np.max(detector_x)
     d_ymin, d_ymax = np.min(detector_y), np.max(detector_y)
     d_zmin, d_zmax = np.min(detector_z), np.max(detector_z)
-    terminator_z = torch.min(v[:, 2]) # 在样品下方放置终止器  
+    terminator_z = float(v[:, 2].min()) # 在样品下方放置终止器  
     mirror_ymax = max(ymax, d_ymax) 
 
     env_str = f"""
@@ -293,16 +379,13 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
 -127 -127  {d_xmax}   {mirror_ymax} {terminator_z}  {d_xmin}   {d_ymin} {terminator_z}  {d_xmin}   {mirror_ymax}     {terminator_z}"""
 
     # 生成输出文件名，保留原始文件名
-    output_filename = f'{name}_stl_to_tri_sampleTiltx{sample_tilt_x}_sampleTilty{sample_tilt_y}_sampleTiltNewZ{sample_tilt_new_z}_detTiltx{det_tilt_x}_{faces.size(0)}.tri'
-    # 只对输出文件名进行安全处理，确保文件系统兼容性
-    safe_output_filename = ''.join(c if c.isalnum() or c in '_-.' else '_' for c in output_filename)
-    mesh_path = mesh_path / safe_output_filename
+    mesh_path = mesh_path / stl_tri_filename(name, sample_tilt_x, sample_tilt_y, sample_tilt_new_z,
+                                             det_tilt_x, len(faces))
     # 生成网格文件
-    with open(mesh_path, 'w') as f:
-        for face in faces:
-            f.write(
-                f"0 -123 {v[face[0], 0]:.2f} {v[face[0], 1]:.2f} {v[face[0], 2]:.2f} {v[face[1], 0]:.2f} {v[face[1], 1]:.2f} {v[face[1], 2]:.2f} {v[face[2], 0]:.2f} {v[face[2], 1]:.2f} {v[face[2], 2]:.2f}\n"
-            )
+    triangles = gather_triangles(v, faces)
+    # 先写临时文件再重命名，并行生成时其他进程不会读到不完整的 .tri
+    with atomic_output(mesh_path) as tmp_path, open(tmp_path, 'w') as f:
+        write_triangles(f, triangles, "0 -123")
         f.write("\n")
         f.write("\n")
         d_j = 0
@@ -314,7 +397,80 @@ def generate_mesh_from_stl(stl_path, output_path, final_side=1000, scale=10, sam
         f.write("\n")
         f.write(env_str)
 
-    return v, faces, d_zmin, d_zmax, mesh_path, R
+    if write_binary:
+        # 二进制伴随文件: 样品三角形、探测器三角形、环境三角形，坐标取 .tri 中按文本精度舍入后的值，
+        # 两个文件描述同一组三角形
+        env_materials, env_triangles = parse_tri_text(env_str)
+        # float32 乘以 100 在 float64 中是精确的，np.round 与 '%.2f' 的舍入结果相同
+        triangles = np.round(np.asarray(triangles, dtype=np.float64), 2)
+        detector_triangles = np.array(
+            [[float(f'{value:.6f}') for value in axis]
+             for axis in (detector_x, detector_y, detector_z)]
+        ).T.reshape(-1, 9)
+        with atomic_output(mesh_path.with_suffix('.trib')) as tmp_path:
+            write_trib(
+                tmp_path,
+                np.concatenate([
+                    np.tile([0, -123], (len(triangles), 1)),
+                    np.column_stack([material1, material2]),
+                    env_materials,
+                ]),
+                np.concatenate([triangles, detector_triangles, env_triangles]),
+            )
+
+    return d_zmin, d_zmax, mesh_path
+
+
+def generate_meshes_from_stl(stl_path, output_path, sample_tilt_new_z_list, scale=10,
+                             sample_tilt_x=0, sample_tilt_y=0, det_tilt_x=0, write_binary=True,
+                             batch_size=32, workers=None):
+    """
+    一次调用生成同一 STL 在多个旋转角度下的 .tri 文件 (例如断层扫描的角度序列)
+
+    STL 只读取和倾转一次；每批 batch_size 个角度的旋转矩阵堆叠为 (K, 3, 3)，
+    用一次批量矩阵乘法得到 K 组顶点，再由 workers 个线程并行写出 K 个文件。
+
+    参数:
+        stl_path: STL文件路径
+        output_path: 输出目录
+        sample_tilt_new_z_list: 绕样品表面法线的旋转角度列表
+        batch_size: 每批同时旋转的角度数，限制 (K, 顶点数, 3) 张量占用的内存
+        workers: 写文件的线程数，默认为 CPU 核数 (最多 8)
+        其余参数与 generate_mesh_from_stl 相同
+
+    返回:
+        list: 与角度顺序一致的字典列表，包含 sample_tilt_new_z, tri_path, faces (面片数),
+              d_zmin, d_zmax, R
+    """
+    stl_path = sanitize_path(stl_path)
+    mesh_path = sanitize_path(output_path)
+    mesh_path.mkdir(parents=True, exist_ok=True)
+    name = stl_path.stem
+    angles = list(sample_tilt_new_z_list)
+    workers = workers or min(8, os.cpu_count() or 1)
+
+    t_start = time.time()
+    tilted, faces, final_side = load_tilted_mesh(stl_path, scale, sample_tilt_x, sample_tilt_y)
+    results = []
+    with ThreadPoolExecutor(workers) as executor:
+        for start in range(0, len(angles), batch_size):
+            batch = angles[start:start + batch_size]
+            Rs = _as_mesh_array(np.stack([_new_z_matrix(sample_tilt_x, sample_tilt_y, angle)
+                                          for angle in batch]))
+            rotated = tilted @ Rs.swapaxes(1, 2)  # (K, 顶点数, 3)
+            futures = [
+                executor.submit(_write_stl_tri, rotated[k], faces, final_side, mesh_path, name,
+                                sample_tilt_x, sample_tilt_y, angle, det_tilt_x, write_binary)
+                for k, angle in enumerate(batch)
+            ]
+            for angle, R, future in zip(batch, Rs, futures):
+                d_zmin, d_zmax, tri_path = future.result()
+                results.append({'sample_tilt_new_z': angle, 'tri_path': tri_path,
+                                'faces': len(faces), 'd_zmin': d_zmin, 'd_zmax': d_zmax, 'R': R})
+    elapsed = time.time() - t_start
+    print(f"已生成 {len(results)} 个角度的.tri文件, 面片数: {len(faces)}, 用时: {elapsed:.1f}s")
+    return results
+
 
 def generate_mesh_from_voxel(voxel_path, output_path, final_side=1000, tilt_x=0, tilt_y=0, pad_scale=1.0, length=20, reverse=False):  # final_side设置为1000
     """
@@ -336,6 +492,9 @@ def generate_mesh_from_voxel(voxel_path, output_path, final_side=1000, tilt_x=0,
     mesh_path.mkdir(parents=True, exist_ok=True)
     # 保留原始文件名
     name = voxel_path.stem
+    import torch
+    from skimage import io
+    from torchmcubes import marching_cubes
     try:
         voxel = io.imread(voxel_path)
     except Exception as e:
@@ -464,14 +623,44 @@ def generate_mesh_from_voxel(voxel_path, output_path, final_side=1000, tilt_x=0,
     # 只对输出文件名进行安全处理，确保文件系统兼容性
     safe_output_filename = ''.join(c if c.isalnum() or c in '_-.' else '_' for c in output_filename)
     with open(mesh_path / safe_output_filename, 'w') as f:
-        for face in faces:
-            f.write(
-            f"-123 0 {v[face[0], 0] * 1000:.2f} {v[face[0], 1] * 1000:.2f} {v[face[0], 2] * 1000:.2f} {v[face[1], 0] * 1000:.2f} {v[face[1], 1] * 1000:.2f} {v[face[1], 2] * 1000:.2f} {v[face[2], 0] * 1000:.2f} {v[face[2], 1] * 1000:.2f} {v[face[2], 2] * 1000:.2f}\n")        
+        write_triangles(f, gather_triangles(v * 1000, faces), "-123 0")
         #f.write(base_str)
         f.write(env_str)
 
     return v, faces
 
+def gather_triangles(v, faces):
+    """
+    一次性按面索引收集三角形顶点坐标
+
+    参数:
+        v: 顶点张量或 numpy 数组 (V, 3)
+        faces: 面片张量或 numpy 数组 (F, 3)
+
+    返回:
+        np.ndarray: (F, 9) 的数组，每行为三个顶点的 x, y, z 坐标
+    """
+    if isinstance(v, np.ndarray):
+        return v[faces].reshape(-1, 9)
+    return v[faces.long()].reshape(-1, 9).cpu().numpy()
+
+
+def write_triangles(f, triangles, materials, block_size=100000):
+    """
+    按块批量写出 .tri 三角形行
+
+    参数:
+        f: 已打开的文本文件
+        triangles: (F, 9) 的顶点坐标数组
+        materials: 行首的材料编号列，例如 "0 -123"
+        block_size: 每次格式化并写入的三角形数量
+    """
+    row_format = materials + ' ' + ' '.join(['%.2f'] * 9) + '\n'
+    for start in range(0, len(triangles), block_size):
+        block = triangles[start:start + block_size]
+        f.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+
+
 def sanitize_path(path):
     """
     处理路径，确保能正确处理包含空格和特殊字符的路径，但不修改文件名